@@ -0,0 +1,27 @@
+#!/bin/bash
+
+python setup/setup_dataset_teacher_output_packed.py \
+--teacher_output_paths \
+    training/kitti/kitti_train_clean_teacher_output0-nlspn.txt \
+    training/kitti/kitti_train_clean_teacher_output0-penet.txt \
+    training/kitti/kitti_train_clean_teacher_output0-enet.txt \
+--external_models \
+    nlspn \
+    penet \
+    enet \
+--packed_teacher_output_path \
+    training/kitti/kitti_train_clean_teacher_output0-packed.txt \
+--n_thread 8
+
+python setup/setup_dataset_teacher_output_packed.py \
+--teacher_output_paths \
+    training/kitti/kitti_train_clean_teacher_output1-nlspn.txt \
+    training/kitti/kitti_train_clean_teacher_output1-penet.txt \
+    training/kitti/kitti_train_clean_teacher_output1-enet.txt \
+--external_models \
+    nlspn \
+    penet \
+    enet \
+--packed_teacher_output_path \
+    training/kitti/kitti_train_clean_teacher_output1-packed.txt \
+--n_thread 8
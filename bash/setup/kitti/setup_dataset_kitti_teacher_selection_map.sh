@@ -0,0 +1,38 @@
+#!/bin/bash
+
+python setup/setup_dataset_teacher_selection_map.py \
+--image0_path \
+    training/kitti/kitti_train_clean_image0.txt \
+--image1_path \
+    training/kitti/kitti_train_clean_image1.txt \
+--teacher_output0_paths \
+    training/kitti/kitti_train_clean_teacher_output0-nlspn.txt \
+    training/kitti/kitti_train_clean_teacher_output0-penet.txt \
+    training/kitti/kitti_train_clean_teacher_output0-enet.txt \
+--focal_length_baseline0_path \
+    training/kitti/kitti_train_clean_focal_length_baseline0.txt \
+--external_models \
+    nlspn \
+    penet \
+    enet \
+--teacher_selection_map_path \
+    training/kitti/kitti_train_clean_teacher_selection_map0.txt
+
+python setup/setup_dataset_teacher_selection_map.py \
+--image0_path \
+    training/kitti/kitti_train_clean_image1.txt \
+--image1_path \
+    training/kitti/kitti_train_clean_image0.txt \
+--teacher_output0_paths \
+    training/kitti/kitti_train_clean_teacher_output1-nlspn.txt \
+    training/kitti/kitti_train_clean_teacher_output1-penet.txt \
+    training/kitti/kitti_train_clean_teacher_output1-enet.txt \
+--focal_length_baseline0_path \
+    training/kitti/kitti_train_clean_focal_length_baseline1.txt \
+--external_models \
+    nlspn \
+    penet \
+    enet \
+--teacher_selection_map_path \
+    training/kitti/kitti_train_clean_teacher_selection_map1.txt \
+--flip
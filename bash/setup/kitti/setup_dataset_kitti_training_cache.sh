@@ -0,0 +1,34 @@
+#!/bin/bash
+
+python setup/setup_dataset_training_cache.py \
+--train_image0_path \
+    training/kitti/kitti_train_clean_image0.txt \
+--train_image1_path \
+    training/kitti/kitti_train_clean_image1.txt \
+--train_sparse_depth0_path \
+    training/kitti/kitti_train_clean_sparse_depth0.txt \
+--train_sparse_depth1_path \
+    training/kitti/kitti_train_clean_sparse_depth1.txt \
+--train_ground_truth0_path \
+    training/kitti/kitti_train_clean_ground_truth0.txt \
+--train_ground_truth1_path \
+    training/kitti/kitti_train_clean_ground_truth1.txt \
+--train_teacher_output0_paths \
+    training/kitti/kitti_train_clean_teacher_output0-nlspn.txt \
+    training/kitti/kitti_train_clean_teacher_output0-penet.txt \
+    training/kitti/kitti_train_clean_teacher_output0-enet.txt \
+--train_teacher_output1_paths \
+    training/kitti/kitti_train_clean_teacher_output1-nlspn.txt \
+    training/kitti/kitti_train_clean_teacher_output1-penet.txt \
+    training/kitti/kitti_train_clean_teacher_output1-enet.txt \
+--train_intrinsics0_path \
+    training/kitti/kitti_train_clean_instrinsics0.txt \
+--train_intrinsics1_path \
+    training/kitti/kitti_train_clean_instrinsics1.txt \
+--train_focal_length_baseline0_path \
+    training/kitti/kitti_train_clean_focal_length_baseline0.txt \
+--train_focal_length_baseline1_path \
+    training/kitti/kitti_train_clean_focal_length_baseline1.txt \
+--cache_path \
+    training/kitti/cache \
+--n_thread 8
@@ -0,0 +1,7 @@
+#!/bin/bash
+
+python setup/setup_dataset_triplet_frames.py \
+--image_paths \
+    training/kitti/kitti_train_clean_image0.txt \
+    training/kitti/kitti_train_clean_image1.txt \
+--n_thread 8
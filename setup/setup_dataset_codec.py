@@ -0,0 +1,133 @@
+'''
+Authors:
+Tian Yu Liu <tianyu@cs.ucla.edu>
+Parth Agrawal <parthagrawal24@ucla.edu>
+Allison Chen <allisonchen2@ucla.edu>
+Alex Wong <alex.wong@yale.edu>
+
+If you use this code, please cite the following paper:
+T.Y. Liu, P. Agrawal, A. Chen, B.W. Hong, and A. Wong. Monitored Distillation for Positive Congruent Depth Completion.
+https://arxiv.org/abs/2203.16034
+
+@inproceedings{liu2022monitored,
+  title={Monitored distillation for positive congruent depth completion},
+  author={Liu, Tian Yu and Agrawal, Parth and Chen, Allison and Hong, Byung-Woo and Wong, Alex},
+  booktitle={European Conference on Computer Vision},
+  year={2022},
+  organization={Springer}
+}
+'''
+
+import os, sys, argparse
+import multiprocessing as mp
+sys.path.insert(0, 'src')
+import data_utils
+
+
+def process_frame(inputs):
+    '''
+    Re-encodes a single image or depth map file with a codec
+
+    Arg(s):
+        inputs : tuple
+            path to image or depth map file,
+            boolean flag if set then file is a depth map,
+            codec to encode with,
+            boolean flag if set then overwrite existing files
+    Returns:
+        str : path to re-encoded file
+    '''
+
+    path, is_depth, codec, overwrite = inputs
+
+    output_path = data_utils.get_codec_path(path, codec)
+
+    if output_path == path or (not overwrite and os.path.exists(output_path)):
+        return output_path
+
+    # Decode with the reference backend and store alongside the original file
+    if is_depth:
+        data_utils.write_depth_file(
+            data_utils.read_depth_file(path, codec='pil'),
+            path,
+            codec=codec)
+    else:
+        data_utils.write_image_file(
+            data_utils.read_image_file(path, codec='pil'),
+            path,
+            codec=codec)
+
+    return output_path
+
+def setup_dataset_codec(image_paths,
+                        depth_paths,
+                        codec='npz',
+                        overwrite=False,
+                        n_thread=8):
+    '''
+    Stores images and depth maps with an array codec next to the original files
+    (see data_utils.get_codec_path) so that they can be loaded with --codec without
+    changing the path lists
+
+    Arg(s):
+        image_paths : list[str]
+            paths to lists of image paths
+        depth_paths : list[str]
+            paths to lists of depth map paths e.g. sparse depth, ground truth
+        codec : str
+            codec to encode with
+        overwrite : bool
+            if set, then overwrite files that already exist
+        n_thread : int
+            number of threads to use
+    '''
+
+    inputs = [
+        (path, False) for path in image_paths
+    ] + [
+        (path, True) for path in depth_paths
+    ]
+
+    for path, is_depth in inputs:
+        paths = data_utils.read_paths(path)
+
+        n_sample = len(paths)
+
+        print('Encoding {} files from {} with {} codec'.format(n_sample, path, codec))
+
+        pool_inputs = [
+            (input_path, is_depth, codec, overwrite) for input_path in paths
+        ]
+
+        with mp.Pool(n_thread) as pool:
+            pool_results = pool.imap(process_frame, pool_inputs, chunksize=8)
+
+            for idx, _ in enumerate(pool_results):
+                print('Processed {}/{} samples'.format(idx + 1, n_sample), end='\r')
+
+        print('')
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--image_paths',
+        nargs='+', type=str, default=[], help='Space delimited list of paths to list of image paths')
+    parser.add_argument('--depth_paths',
+        nargs='+', type=str, default=[], help='Space delimited list of paths to list of depth map paths')
+    parser.add_argument('--codec',
+        type=str, default='npz', help='Codec to encode with: npz')
+    parser.add_argument('--overwrite',
+        action='store_true', help='If set, then overwrite files that already exist')
+    parser.add_argument('--n_thread',
+        type=int, default=8, help='Number of threads to use')
+
+    args = parser.parse_args()
+
+    setup_dataset_codec(
+        args.image_paths,
+        args.depth_paths,
+        args.codec,
+        args.overwrite,
+        args.n_thread)
@@ -21,9 +21,9 @@ https://arxiv.org/abs/2203.16034
 import os, sys, argparse
 import torch
 sys.path.insert(0, 'src')
-import datasets, data_utils
+import data_utils
 from external_model import ExternalModel
-from run_external_model import run
+from run_external_model import generate_outputs
 
 
 '''
@@ -103,7 +103,11 @@ def setup_dataset_kitti_training(external_models,
                                  external_models_restore_paths,
                                  min_predict_depth,
                                  max_predict_depth,
-                                 paths_only):
+                                 paths_only,
+                                 n_batch=8,
+                                 n_thread=8,
+                                 n_thread_output=4,
+                                 overwrite=False):
     '''
     Creates teacher_output based on external models
 
@@ -118,6 +122,14 @@ def setup_dataset_kitti_training(external_models,
             maximum value for predicted depth
         paths_only : bool
             if set, then only produces paths
+        n_batch : int
+            maximum number of samples per batch
+        n_thread : int
+            number of threads for loading data
+        n_thread_output : int
+            number of threads for saving outputs
+        overwrite : bool
+            if set, then regenerate outputs that already exist instead of resuming
     '''
 
     assert len(external_models) == len(external_models_restore_paths), \
@@ -290,23 +302,22 @@ def setup_dataset_kitti_training(external_models,
 
             n_sample = len(image_paths)
 
-            # Instantiate dataloader
-            dataloader = torch.utils.data.DataLoader(
-                datasets.DepthCompletionInferenceDataset(
-                    image_paths=image_paths,
-                    sparse_depth_paths=sparse_depth_paths,
-                    intrinsics_paths=intrinsics_paths,
-                    load_image_triplets=True if tag == 'training' else False),
-                batch_size=1,
-                shuffle=False,
-                num_workers=1,
-                drop_last=False)
-
             if not paths_only:
                 print('Generating teacher_output for {} {} samples'.format(n_sample, tag))
 
-                # Write to teacher_output to disk
-                run(model, dataloader, output_paths=output_paths, verbose=True)
+                # Write teacher_output to disk, skipping samples that already have valid outputs
+                generate_outputs(
+                    model,
+                    image_paths=image_paths,
+                    sparse_depth_paths=sparse_depth_paths,
+                    intrinsics_paths=intrinsics_paths,
+                    output_paths=output_paths,
+                    load_image_triplets=True if tag == 'training' else False,
+                    n_batch=n_batch,
+                    n_thread=n_thread,
+                    n_thread_output=n_thread_output,
+                    overwrite=overwrite,
+                    verbose=True)
 
     # Write paths to disk
     train_filepaths = [
@@ -440,6 +451,14 @@ if __name__ == "__main__":
         type=float, default=100.0, help='Maximum value for predicted depth')
     parser.add_argument('--paths_only',
         action='store_true', help='If set, then generate paths only')
+    parser.add_argument('--n_batch',
+        type=int, default=8, help='Maximum number of samples per batch')
+    parser.add_argument('--n_thread',
+        type=int, default=8, help='Number of threads for loading data')
+    parser.add_argument('--n_thread_output',
+        type=int, default=4, help='Number of threads for saving outputs')
+    parser.add_argument('--overwrite',
+        action='store_true', help='If set, then regenerate existing outputs instead of resuming')
 
     args = parser.parse_args()
 
@@ -454,4 +473,8 @@ if __name__ == "__main__":
         args.external_models_restore_paths,
         args.min_predict_depth,
         args.max_predict_depth,
-        args.paths_only)
+        args.paths_only,
+        n_batch=args.n_batch,
+        n_thread=args.n_thread,
+        n_thread_output=args.n_thread_output,
+        overwrite=args.overwrite)
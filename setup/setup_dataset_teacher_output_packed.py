@@ -0,0 +1,158 @@
+'''
+Authors:
+Tian Yu Liu <tianyu@cs.ucla.edu>
+Parth Agrawal <parthagrawal24@ucla.edu>
+Allison Chen <allisonchen2@ucla.edu>
+Alex Wong <alex.wong@yale.edu>
+
+If you use this code, please cite the following paper:
+T.Y. Liu, P. Agrawal, A. Chen, B.W. Hong, and A. Wong. Monitored Distillation for Positive Congruent Depth Completion.
+https://arxiv.org/abs/2203.16034
+
+@inproceedings{liu2022monitored,
+  title={Monitored distillation for positive congruent depth completion},
+  author={Liu, Tian Yu and Agrawal, Parth and Chen, Allison and Hong, Byung-Woo and Wong, Alex},
+  booktitle={European Conference on Computer Vision},
+  year={2022},
+  organization={Springer}
+}
+'''
+
+import os, sys, argparse
+import numpy as np
+import multiprocessing as mp
+sys.path.insert(0, 'src')
+import data_utils
+
+
+def process_frame(inputs):
+    '''
+    Packs the teacher output of an ensemble for a single frame
+
+    Arg(s):
+        inputs : tuple
+            list of teacher output paths for the frame (one per teacher),
+            output packed teacher output path,
+            boolean flag if set then create paths only
+    Returns:
+        str : output packed teacher output path
+    '''
+
+    teacher_output_paths, \
+        packed_teacher_output_path, \
+        paths_only = inputs
+
+    # Create output directories
+    output_dirpath = os.path.dirname(packed_teacher_output_path)
+    if not os.path.exists(output_dirpath):
+        try:
+            os.makedirs(output_dirpath)
+        except FileExistsError:
+            pass
+
+    if not paths_only:
+        # Read each teacher output and stack into M x H x W
+        teacher_output = np.stack([
+            data_utils.load_depth(path, data_format='HW')
+            for path in teacher_output_paths
+        ], axis=0)
+
+        # Write to disk
+        data_utils.save_packed_depth(teacher_output, packed_teacher_output_path)
+
+    return packed_teacher_output_path
+
+def setup_dataset_teacher_output_packed(teacher_output_paths,
+                                        external_models,
+                                        packed_teacher_output_path,
+                                        paths_only=False,
+                                        n_thread=8):
+    '''
+    Packs teacher output from an ensemble, stored as one 16-bit PNG per teacher
+    per frame, into a single M x H x W 16-bit array per frame
+
+    Arg(s):
+        teacher_output_paths : list[str]
+            paths to lists of teacher output paths, one for each teacher
+        external_models : list[str]
+            name of external model for each list of teacher output paths
+        packed_teacher_output_path : str
+            path to store list of packed teacher output paths
+        paths_only : bool
+            if set, then only produces paths
+        n_thread : int
+            number of threads to use
+    '''
+
+    assert len(teacher_output_paths) == len(external_models), \
+        'Length of teacher output paths list does not match length of external models list.'
+
+    # Read input paths for each teacher
+    ensemble_teacher_output_paths = [
+        data_utils.read_paths(path) for path in teacher_output_paths
+    ]
+
+    n_sample = len(ensemble_teacher_output_paths[0])
+
+    for paths in ensemble_teacher_output_paths:
+        assert len(paths) == n_sample
+
+    # Store packed output alongside the teacher output of first model
+    model_dirname = os.sep + external_models[0] + os.sep
+    packed_dirname = os.sep + 'packed-{}'.format('-'.join(external_models)) + os.sep
+
+    pool_inputs = []
+
+    for idx in range(n_sample):
+
+        frame_teacher_output_paths = [
+            paths[idx] for paths in ensemble_teacher_output_paths
+        ]
+
+        if model_dirname not in frame_teacher_output_paths[0]:
+            raise ValueError('Unable to find {} in teacher output path: {}'.format(
+                external_models[0], frame_teacher_output_paths[0]))
+
+        packed_path = frame_teacher_output_paths[0].replace(model_dirname, packed_dirname, 1)
+        packed_path = os.path.splitext(packed_path)[0] + '.npy'
+
+        pool_inputs.append((
+            frame_teacher_output_paths,
+            packed_path,
+            paths_only))
+
+    if not paths_only:
+        print('Packing teacher output of {} models for {} samples'.format(
+            len(external_models), n_sample))
+
+    with mp.Pool(n_thread) as pool:
+        packed_teacher_output_paths = pool.map(process_frame, pool_inputs)
+
+    print('Storing {} packed teacher output file paths into: {}'.format(
+        len(packed_teacher_output_paths), packed_teacher_output_path))
+    data_utils.write_paths(packed_teacher_output_path, packed_teacher_output_paths)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--teacher_output_paths',
+        nargs='+', type=str, required=True, help='Space delimited list of paths to list of teacher output paths, one per teacher')
+    parser.add_argument('--external_models',
+        nargs='+', type=str, required=True, help='Space delimited list of external model names in same order as teacher output paths')
+    parser.add_argument('--packed_teacher_output_path',
+        type=str, required=True, help='Path to store list of packed teacher output paths')
+    parser.add_argument('--paths_only',
+        action='store_true', help='If set, then generate paths only')
+    parser.add_argument('--n_thread',
+        type=int, default=8, help='Number of threads to use')
+
+    args = parser.parse_args()
+
+    setup_dataset_teacher_output_packed(
+        args.teacher_output_paths,
+        args.external_models,
+        args.packed_teacher_output_path,
+        args.paths_only,
+        args.n_thread)
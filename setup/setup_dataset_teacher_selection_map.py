@@ -0,0 +1,283 @@
+'''
+Authors:
+Tian Yu Liu <tianyu@cs.ucla.edu>
+Parth Agrawal <parthagrawal24@ucla.edu>
+Allison Chen <allisonchen2@ucla.edu>
+Alex Wong <alex.wong@yale.edu>
+
+If you use this code, please cite the following paper:
+T.Y. Liu, P. Agrawal, A. Chen, B.W. Hong, and A. Wong. Monitored Distillation for Positive Congruent Depth Completion.
+https://arxiv.org/abs/2203.16034
+
+@inproceedings{liu2022monitored,
+  title={Monitored distillation for positive congruent depth completion},
+  author={Liu, Tian Yu and Agrawal, Parth and Chen, Allison and Hong, Byung-Woo and Wong, Alex},
+  booktitle={European Conference on Computer Vision},
+  year={2022},
+  organization={Springer}
+}
+'''
+
+import os, sys, argparse
+import numpy as np
+import torch
+sys.path.insert(0, 'src')
+import datasets, data_utils, loss_utils
+import global_constants as settings
+
+
+def compute_selection_map(image0,
+                          image3,
+                          teacher_output0,
+                          focal_length_baseline0,
+                          normalized_image_range=[0, 1],
+                          flip=False):
+    '''
+    Computes the stereo reprojection error of each teacher the same way as the
+    stereo branch of MonitoredDistillationModel.compute_loss with ensemble method mondi
+
+    Arg(s):
+        image0 : torch.Tensor[float32]
+            3 x H x W image with intensities in [0, 255]
+        image3 : torch.Tensor[float32]
+            3 x H x W stereo pair of image0 with intensities in [0, 255]
+        teacher_output0 : torch.Tensor[float32]
+            M x H x W teacher output from ensemble for image0
+        focal_length_baseline0 : torch.Tensor[float32]
+            2 focal length and baseline of camera of image0
+        normalized_image_range : list[float]
+            intensity range after normalizing images
+        flip : bool
+            if set, then horizontally flip inputs before and error maps after,
+            used for right camera, which is flipped when left and right are swapped
+    Returns:
+        torch.Tensor[float32] : M x H x W stereo reprojection error of each teacher
+    '''
+
+    if flip:
+        image0, image3, teacher_output0 = [
+            torch.flip(T, dims=[-1]) for T in [image0, image3, teacher_output0]
+        ]
+
+    if normalized_image_range == [0, 1]:
+        image0 = image0 / 255.0
+        image3 = image3 / 255.0
+    elif normalized_image_range == [-1, 1]:
+        image0 = 2.0 * (image0 / 255.0) - 1.0
+        image3 = 2.0 * (image3 / 255.0) - 1.0
+    elif normalized_image_range == [0, 255]:
+        pass
+    else:
+        raise ValueError('Unsupported normalization range: {}'.format(
+            normalized_image_range))
+
+    M = teacher_output0.shape[0]
+
+    fb = focal_length_baseline0[0] * focal_length_baseline0[1]
+
+    # Evaluate all teachers at once: M x 3 x H x W images and M x 1 x H x W depth
+    images3to0 = loss_utils.warp1d_horizontal(
+        image3.unsqueeze(0).repeat(M, 1, 1, 1),
+        -fb / teacher_output0.unsqueeze(1))
+
+    # Left image statistics are shared across teachers so it is not repeated
+    selection_map = loss_utils.structural_consistency_loss_func(
+        image0.unsqueeze(0),
+        images3to0,
+        reduce_loss=False)
+
+    selection_map = selection_map.squeeze(1)
+
+    if flip:
+        selection_map = torch.flip(selection_map, dims=[-1])
+
+    return selection_map
+
+def setup_dataset_teacher_selection_map(image0_path,
+                                        image1_path,
+                                        teacher_output0_paths,
+                                        focal_length_baseline0_path,
+                                        external_models,
+                                        teacher_selection_map_path,
+                                        normalized_image_range=[0, 1],
+                                        flip=False,
+                                        codec='pil',
+                                        paths_only=False,
+                                        device='cuda'):
+    '''
+    Computes per-frame, per-teacher stereo reprojection error maps of one camera
+    once so that training does not need to warp the stereo pair with every teacher
+    at every step. Maps are stored as M x H x W 16-bit arrays alongside the teacher
+    output of the first model in the same teacher order as teacher output paths
+
+    Arg(s):
+        image0_path : str
+            path to list of image triplet paths of camera to compute maps for
+        image1_path : str
+            path to list of image triplet paths of its stereo pair
+        teacher_output0_paths : list[str]
+            paths to lists of teacher output paths (16-bit PNG or packed .npy)
+        focal_length_baseline0_path : str
+            path to list of focal length and baseline paths of camera
+        external_models : list[str]
+            name of external model for each list of teacher output paths
+        teacher_selection_map_path : str
+            path to store list of teacher selection map paths
+        normalized_image_range : list[float]
+            intensity range after normalizing images, must match training
+        flip : bool
+            if set, then compute maps in horizontally flipped frame (right camera)
+        codec : str
+            codec that images and depth maps are stored with
+        paths_only : bool
+            if set, then only produces paths
+        device : str
+            device to compute maps on: cuda, gpu, cpu
+    '''
+
+    assert len(teacher_output0_paths) == len(external_models), \
+        'Length of teacher output paths list does not match length of external models list.'
+
+    if device == settings.CUDA or device == settings.GPU:
+        device = torch.device(settings.CUDA if torch.cuda.is_available() else settings.CPU)
+    else:
+        device = torch.device(settings.CPU)
+
+    image0_paths = data_utils.read_paths(image0_path)
+    image1_paths = data_utils.read_paths(image1_path)
+
+    ensemble_teacher_output0_paths = [
+        data_utils.read_paths(path) for path in teacher_output0_paths
+    ]
+
+    focal_length_baseline0_paths = data_utils.read_paths(focal_length_baseline0_path)
+
+    n_sample = len(image0_paths)
+
+    for paths in [image1_paths, focal_length_baseline0_paths] + ensemble_teacher_output0_paths:
+        assert len(paths) == n_sample
+
+    split = all([
+        datasets.is_triplet_split(paths[0], codec)
+        for paths in [image0_paths, image1_paths]
+    ])
+
+    # Store selection maps alongside the teacher output of first model
+    model_dirname = os.sep + external_models[0] + os.sep
+    selection_dirname = os.sep + 'selection-{}'.format('-'.join(external_models)) + os.sep
+
+    teacher_selection_map_paths = []
+
+    if not paths_only:
+        print('Computing teacher selection maps of {} models for {} samples'.format(
+            len(external_models), n_sample))
+
+    for idx in range(n_sample):
+
+        frame_teacher_output_paths = [
+            paths[idx] for paths in ensemble_teacher_output0_paths
+        ]
+
+        if model_dirname not in frame_teacher_output_paths[0]:
+            raise ValueError('Unable to find {} in teacher output path: {}'.format(
+                external_models[0], frame_teacher_output_paths[0]))
+
+        selection_map_path = frame_teacher_output_paths[0].replace(model_dirname, selection_dirname, 1)
+        selection_map_path = os.path.splitext(selection_map_path)[0] + '.npy'
+
+        teacher_selection_map_paths.append(selection_map_path)
+
+        if paths_only:
+            continue
+
+        output_dirpath = os.path.dirname(selection_map_path)
+        if not os.path.exists(output_dirpath):
+            os.makedirs(output_dirpath)
+
+        # Load frame at t of the camera and of its stereo pair
+        image0, image3 = [
+            datasets.load_triplet_frame(
+                path=paths[idx],
+                frame=1,
+                normalize=False,
+                data_format='CHW',
+                dtype=np.float32,
+                split=split,
+                codec=codec)
+            for paths in [image0_paths, image1_paths]
+        ]
+
+        teacher_output0 = datasets.load_teacher_output(
+            frame_teacher_output_paths,
+            data_format='CHW',
+            codec=codec)
+
+        focal_length_baseline0 = np.load(focal_length_baseline0_paths[idx])
+
+        image0, image3, teacher_output0, focal_length_baseline0 = [
+            torch.from_numpy(np.asarray(T, dtype=np.float32)).to(device)
+            for T in [image0, image3, teacher_output0, focal_length_baseline0]
+        ]
+
+        with torch.no_grad():
+            selection_map = compute_selection_map(
+                image0,
+                image3,
+                teacher_output0,
+                focal_length_baseline0,
+                normalized_image_range=normalized_image_range,
+                flip=flip)
+
+        data_utils.save_selection_map(selection_map.cpu().numpy(), selection_map_path)
+
+        print('Processed {}/{} samples'.format(idx + 1, n_sample), end='\r')
+
+    if not paths_only:
+        print('')
+
+    print('Storing {} teacher selection map file paths into: {}'.format(
+        len(teacher_selection_map_paths), teacher_selection_map_path))
+    data_utils.write_paths(teacher_selection_map_path, teacher_selection_map_paths)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--image0_path',
+        type=str, required=True, help='Path to list of image triplet paths of camera to compute maps for')
+    parser.add_argument('--image1_path',
+        type=str, required=True, help='Path to list of image triplet paths of stereo pair')
+    parser.add_argument('--teacher_output0_paths',
+        nargs='+', type=str, required=True, help='Space delimited list of paths to list of teacher output paths of camera')
+    parser.add_argument('--focal_length_baseline0_path',
+        type=str, required=True, help='Path to list of focal length and baseline paths of camera')
+    parser.add_argument('--external_models',
+        nargs='+', type=str, required=True, help='Space delimited list of external model names in same order as teacher output paths')
+    parser.add_argument('--teacher_selection_map_path',
+        type=str, required=True, help='Path to store list of teacher selection map paths')
+    parser.add_argument('--normalized_image_range',
+        nargs='+', type=float, default=settings.NORMALIZED_IMAGE_RANGE, help='Range of image intensities after normalization, must match training')
+    parser.add_argument('--flip',
+        action='store_true', help='If set, then compute maps for right camera, which is flipped when left and right are swapped')
+    parser.add_argument('--codec',
+        type=str, default=settings.CODEC, help='Codec that images and depth maps are stored with: pil, opencv, npz')
+    parser.add_argument('--paths_only',
+        action='store_true', help='If set, then generate paths only')
+    parser.add_argument('--device',
+        type=str, default=settings.DEVICE, help='Device to use: cuda, gpu, cpu')
+
+    args = parser.parse_args()
+
+    setup_dataset_teacher_selection_map(
+        image0_path=args.image0_path,
+        image1_path=args.image1_path,
+        teacher_output0_paths=args.teacher_output0_paths,
+        focal_length_baseline0_path=args.focal_length_baseline0_path,
+        external_models=args.external_models,
+        teacher_selection_map_path=args.teacher_selection_map_path,
+        normalized_image_range=args.normalized_image_range,
+        flip=args.flip,
+        codec=args.codec,
+        paths_only=args.paths_only,
+        device=args.device)
@@ -0,0 +1,314 @@
+'''
+Authors:
+Tian Yu Liu <tianyu@cs.ucla.edu>
+Parth Agrawal <parthagrawal24@ucla.edu>
+Allison Chen <allisonchen2@ucla.edu>
+Alex Wong <alex.wong@yale.edu>
+
+If you use this code, please cite the following paper:
+T.Y. Liu, P. Agrawal, A. Chen, B.W. Hong, and A. Wong. Monitored Distillation for Positive Congruent Depth Completion.
+https://arxiv.org/abs/2203.16034
+
+@inproceedings{liu2022monitored,
+  title={Monitored distillation for positive congruent depth completion},
+  author={Liu, Tian Yu and Agrawal, Parth and Chen, Allison and Hong, Byung-Woo and Wong, Alex},
+  booktitle={European Conference on Computer Vision},
+  year={2022},
+  organization={Springer}
+}
+'''
+
+import os, sys, argparse
+import numpy as np
+import multiprocessing as mp
+from PIL import Image
+sys.path.insert(0, 'src')
+import datasets, data_utils
+
+
+def process_frame(inputs):
+    '''
+    Decodes a single frame of one camera into compact arrays
+
+    Arg(s):
+        inputs : tuple
+            image triplet path,
+            sparse depth path,
+            ground truth path,
+            list of teacher output paths,
+            intrinsics path,
+            focal length baseline path (or None)
+    Returns:
+        numpy[uint8] : 3 x H x 3W image triplet
+        numpy[uint16] : 1 x H x W sparse depth
+        numpy[uint16] : 1 x H x W ground truth
+        numpy[uint16] : M x H x W teacher output
+        numpy[float32] : 3 x 3 intrinsics
+        numpy[float32] : 2 focal length and baseline
+    '''
+
+    image_path, \
+        sparse_depth_path, \
+        ground_truth_path, \
+        teacher_output_paths, \
+        intrinsics_path, \
+        focal_length_baseline_path = inputs
+
+    images = data_utils.load_image(image_path, normalize=False, data_format='CHW')
+    images = images.astype(np.uint8)
+
+    # Store depth maps in the same 16-bit encoding as the PNG files
+    sparse_depth = data_utils.load_depth(sparse_depth_path, data_format='CHW')
+    sparse_depth = np.uint16(np.round(sparse_depth * 256.0))
+
+    ground_truth = data_utils.load_depth(ground_truth_path, data_format='CHW')
+    ground_truth = np.uint16(np.round(ground_truth * 256.0))
+
+    teacher_output = datasets.load_teacher_output(teacher_output_paths, data_format='CHW')
+    teacher_output = np.uint16(np.round(teacher_output * 256.0))
+
+    intrinsics = np.load(intrinsics_path).astype(np.float32)
+
+    if focal_length_baseline_path is not None:
+        focal_length_baseline = np.load(focal_length_baseline_path).astype(np.float32)
+    else:
+        focal_length_baseline = np.zeros([2], dtype=np.float32)
+
+    return images, sparse_depth, ground_truth, teacher_output, intrinsics, focal_length_baseline
+
+def setup_dataset_training_cache(cache_dirpath,
+                                 image_paths,
+                                 sparse_depth_paths,
+                                 ground_truth_paths,
+                                 ensemble_teacher_output_paths,
+                                 intrinsics_paths,
+                                 focal_length_baseline_paths,
+                                 n_thread=8):
+    '''
+    Decodes every sample of a training split once and stores them as fixed shape
+    memory-mapped arrays. Samples smaller than the largest sample are zero padded
+    and their original height and width are stored in shape.npy
+
+    Arg(s):
+        cache_dirpath : str
+            path to directory to store cached arrays
+        image_paths : list[list[str]]
+            paths to image triplets for each camera
+        sparse_depth_paths : list[list[str]]
+            paths to sparse depth maps for each camera
+        ground_truth_paths : list[list[str]]
+            paths to ground truth depth maps for each camera
+        ensemble_teacher_output_paths : list[list[list[str]]]
+            list of lists of paths to teacher output for ensemble for each camera
+        intrinsics_paths : list[list[str]]
+            paths to intrinsic camera calibration matrix for each camera
+        focal_length_baseline_paths : list[list[str]]
+            paths to focal length and baseline for each camera, or None
+        n_thread : int
+            number of threads to use
+    '''
+
+    if not os.path.exists(cache_dirpath):
+        os.makedirs(cache_dirpath)
+
+    n_sample = len(image_paths[0])
+
+    # Find fixed shape that holds every sample by reading image headers only
+    shapes = np.zeros([n_sample, 2], dtype=np.int32)
+
+    for idx, path in enumerate(image_paths[0]):
+        width, height = Image.open(path).size
+        shapes[idx, :] = [height, width // 3]
+
+    n_height, n_width = np.max(shapes, axis=0)
+
+    np.save(os.path.join(cache_dirpath, 'shape.npy'), shapes)
+
+    for camera in range(len(image_paths)):
+
+        camera_paths = [
+            image_paths[camera],
+            sparse_depth_paths[camera],
+            ground_truth_paths[camera],
+            intrinsics_paths[camera]
+        ]
+
+        camera_paths = camera_paths + ensemble_teacher_output_paths[camera]
+
+        if focal_length_baseline_paths[camera] is not None:
+            camera_paths.append(focal_length_baseline_paths[camera])
+            camera_focal_length_baseline_paths = focal_length_baseline_paths[camera]
+        else:
+            camera_focal_length_baseline_paths = [None] * n_sample
+
+        for paths in camera_paths:
+            assert len(paths) == n_sample
+
+        n_teacher = sum([
+            data_utils.get_n_packed_depth(paths[0])
+            for paths in ensemble_teacher_output_paths[camera]
+        ])
+
+        # Preallocate memory-mapped arrays on disk
+        shapes_dtypes = [
+            ('image', (n_sample, 3, n_height, 3 * n_width), np.uint8),
+            ('sparse_depth', (n_sample, 1, n_height, n_width), np.uint16),
+            ('ground_truth', (n_sample, 1, n_height, n_width), np.uint16),
+            ('teacher_output', (n_sample, n_teacher, n_height, n_width), np.uint16),
+            ('intrinsics', (n_sample, 3, 3), np.float32),
+            ('focal_length_baseline', (n_sample, 2), np.float32)
+        ]
+
+        arrays = [
+            np.lib.format.open_memmap(
+                os.path.join(cache_dirpath, '{}{}.npy'.format(name, camera)),
+                mode='w+',
+                shape=shape,
+                dtype=dtype)
+            for name, shape, dtype in shapes_dtypes
+        ]
+
+        pool_inputs = [
+            (
+                image_paths[camera][idx],
+                sparse_depth_paths[camera][idx],
+                ground_truth_paths[camera][idx],
+                [paths[idx] for paths in ensemble_teacher_output_paths[camera]],
+                intrinsics_paths[camera][idx],
+                camera_focal_length_baseline_paths[idx]
+            )
+            for idx in range(n_sample)
+        ]
+
+        print('Caching {} samples for camera {} into: {}'.format(
+            n_sample, camera, cache_dirpath))
+
+        with mp.Pool(n_thread) as pool:
+            pool_results = pool.imap(process_frame, pool_inputs, chunksize=8)
+
+            for idx, result in enumerate(pool_results):
+                height, width = shapes[idx]
+
+                images, \
+                    sparse_depth, \
+                    ground_truth, \
+                    teacher_output, \
+                    intrinsics, \
+                    focal_length_baseline = result
+
+                arrays[0][idx, :, :height, :3 * width] = images
+                arrays[1][idx, :, :height, :width] = sparse_depth
+                arrays[2][idx, :, :height, :width] = ground_truth
+                arrays[3][idx, :, :height, :width] = teacher_output
+                arrays[4][idx, ...] = intrinsics
+                arrays[5][idx, ...] = focal_length_baseline
+
+                print('Processed {}/{} samples'.format(idx + 1, n_sample), end='\r')
+
+        print('')
+
+        for array in arrays:
+            array.flush()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--train_image0_path',
+        type=str, required=True, help='Path to list of training left camera image paths')
+    parser.add_argument('--train_image1_path',
+        type=str, default=None, help='Path to list of training right camera image paths')
+    parser.add_argument('--train_sparse_depth0_path',
+        type=str, required=True, help='Path to list of training left camera sparse depth paths')
+    parser.add_argument('--train_sparse_depth1_path',
+        type=str, default=None, help='Path to list of training right camera sparse depth paths')
+    parser.add_argument('--train_ground_truth0_path',
+        type=str, required=True, help='Path to list of training left camera ground truth paths')
+    parser.add_argument('--train_ground_truth1_path',
+        type=str, default=None, help='Path to list of training right camera ground truth paths')
+    parser.add_argument('--train_teacher_output0_paths',
+        nargs='+', type=str, required=True, help='Path to list of training left camera teacher output paths')
+    parser.add_argument('--train_teacher_output1_paths',
+        nargs='+', type=str, default=None, help='Path to list of training right camera teacher output paths')
+    parser.add_argument('--train_intrinsics0_path',
+        type=str, required=True, help='Path to list of training left camera intrinsics paths')
+    parser.add_argument('--train_intrinsics1_path',
+        type=str, default=None, help='Path to list of training right camera intrinsics paths')
+    parser.add_argument('--train_focal_length_baseline0_path',
+        type=str, default=None, help='Path to list of training left camera focal length baseline paths')
+    parser.add_argument('--train_focal_length_baseline1_path',
+        type=str, default=None, help='Path to list of training right camera focal length baseline paths')
+    parser.add_argument('--cache_path',
+        type=str, required=True, help='Path to directory to store cached arrays')
+    parser.add_argument('--n_thread',
+        type=int, default=8, help='Number of threads to use')
+
+    args = parser.parse_args()
+
+    stereo_available = \
+        args.train_image1_path is not None and \
+        args.train_sparse_depth1_path is not None and \
+        args.train_ground_truth1_path is not None and \
+        args.train_teacher_output1_paths is not None and \
+        args.train_intrinsics1_path is not None and \
+        args.train_focal_length_baseline0_path is not None and \
+        args.train_focal_length_baseline1_path is not None
+
+    cameras = [
+        (
+            args.train_image0_path,
+            args.train_sparse_depth0_path,
+            args.train_ground_truth0_path,
+            args.train_teacher_output0_paths,
+            args.train_intrinsics0_path,
+            args.train_focal_length_baseline0_path
+        )
+    ]
+
+    if stereo_available:
+        cameras.append((
+            args.train_image1_path,
+            args.train_sparse_depth1_path,
+            args.train_ground_truth1_path,
+            args.train_teacher_output1_paths,
+            args.train_intrinsics1_path,
+            args.train_focal_length_baseline1_path
+        ))
+
+    image_paths = []
+    sparse_depth_paths = []
+    ground_truth_paths = []
+    ensemble_teacher_output_paths = []
+    intrinsics_paths = []
+    focal_length_baseline_paths = []
+
+    for image_path, \
+            sparse_depth_path, \
+            ground_truth_path, \
+            teacher_output_paths, \
+            intrinsics_path, \
+            focal_length_baseline_path in cameras:
+
+        image_paths.append(data_utils.read_paths(image_path))
+        sparse_depth_paths.append(data_utils.read_paths(sparse_depth_path))
+        ground_truth_paths.append(data_utils.read_paths(ground_truth_path))
+        ensemble_teacher_output_paths.append([
+            data_utils.read_paths(path) for path in teacher_output_paths
+        ])
+        intrinsics_paths.append(data_utils.read_paths(intrinsics_path))
+
+        if focal_length_baseline_path is not None:
+            focal_length_baseline_paths.append(data_utils.read_paths(focal_length_baseline_path))
+        else:
+            focal_length_baseline_paths.append(None)
+
+    setup_dataset_training_cache(
+        cache_dirpath=args.cache_path,
+        image_paths=image_paths,
+        sparse_depth_paths=sparse_depth_paths,
+        ground_truth_paths=ground_truth_paths,
+        ensemble_teacher_output_paths=ensemble_teacher_output_paths,
+        intrinsics_paths=intrinsics_paths,
+        focal_length_baseline_paths=focal_length_baseline_paths,
+        n_thread=args.n_thread)
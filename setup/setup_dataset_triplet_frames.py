@@ -0,0 +1,132 @@
+'''
+Authors:
+Tian Yu Liu <tianyu@cs.ucla.edu>
+Parth Agrawal <parthagrawal24@ucla.edu>
+Allison Chen <allisonchen2@ucla.edu>
+Alex Wong <alex.wong@yale.edu>
+
+If you use this code, please cite the following paper:
+T.Y. Liu, P. Agrawal, A. Chen, B.W. Hong, and A. Wong. Monitored Distillation for Positive Congruent Depth Completion.
+https://arxiv.org/abs/2203.16034
+
+@inproceedings{liu2022monitored,
+  title={Monitored distillation for positive congruent depth completion},
+  author={Liu, Tian Yu and Agrawal, Parth and Chen, Allison and Hong, Byung-Woo and Wong, Alex},
+  booktitle={European Conference on Computer Vision},
+  year={2022},
+  organization={Springer}
+}
+'''
+
+import os, sys, argparse
+import numpy as np
+import multiprocessing as mp
+sys.path.insert(0, 'src')
+import datasets, data_utils
+
+
+def process_frame(inputs):
+    '''
+    Splits an image triplet into its frames and stores each in its own file
+
+    Arg(s):
+        inputs : tuple
+            path to image triplet,
+            codec to encode frames with,
+            boolean flag if set then overwrite existing frames
+    Returns:
+        str : path to image triplet
+    '''
+
+    image_path, codec, overwrite = inputs
+
+    if not overwrite and datasets.is_triplet_split(image_path, codec):
+        return image_path
+
+    images = data_utils.load_image(
+        image_path,
+        normalize=False,
+        data_format='HWC',
+        dtype=np.uint8,
+        codec=codec)
+
+    # Triplet is stored as [t - 1, t, t + 1] along width
+    frames = np.split(images, indices_or_sections=3, axis=1)
+
+    for frame, image in enumerate(frames):
+        frame_path = datasets.get_triplet_frame_path(image_path, frame)
+
+        # Write to a temporary file and then move it, so that an interrupted run
+        # never leaves a partially written frame that would be treated as complete
+        dirpath, filename = os.path.split(frame_path)
+        temp_path = os.path.join(dirpath, '.tmp-' + filename)
+
+        data_utils.save_image(
+            image,
+            temp_path,
+            normalized=False,
+            codec=codec)
+
+        os.replace(
+            data_utils.get_codec_path(temp_path, codec),
+            data_utils.get_codec_path(frame_path, codec))
+
+    return image_path
+
+def setup_dataset_triplet_frames(image_paths, codec='pil', overwrite=False, n_thread=8):
+    '''
+    Stores each frame of image triplets alongside the triplet as separate files
+    (see datasets.get_triplet_frame_path) so that dataloaders can decode only the
+    frames they need. Triplets are kept so existing path lists remain valid
+
+    Arg(s):
+        image_paths : list[str]
+            paths to lists of image triplet paths
+        codec : str
+            codec that triplets are stored with and to encode frames with
+        overwrite : bool
+            if set, then overwrite frames that already exist
+        n_thread : int
+            number of threads to use
+    '''
+
+    for path in image_paths:
+        triplet_paths = data_utils.read_paths(path)
+
+        n_sample = len(triplet_paths)
+
+        print('Splitting {} image triplets from: {}'.format(n_sample, path))
+
+        pool_inputs = [
+            (triplet_path, codec, overwrite) for triplet_path in triplet_paths
+        ]
+
+        with mp.Pool(n_thread) as pool:
+            pool_results = pool.imap(process_frame, pool_inputs, chunksize=8)
+
+            for idx, _ in enumerate(pool_results):
+                print('Processed {}/{} samples'.format(idx + 1, n_sample), end='\r')
+
+        print('')
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--image_paths',
+        nargs='+', type=str, required=True, help='Space delimited list of paths to list of image triplet paths')
+    parser.add_argument('--codec',
+        type=str, default='pil', help='Codec that triplets are stored with: pil, opencv, npz')
+    parser.add_argument('--overwrite',
+        action='store_true', help='If set, then overwrite frames that already exist')
+    parser.add_argument('--n_thread',
+        type=int, default=8, help='Number of threads to use')
+
+    args = parser.parse_args()
+
+    setup_dataset_triplet_frames(
+        args.image_paths,
+        args.codec,
+        args.overwrite,
+        args.n_thread)
@@ -0,0 +1,143 @@
+'''
+Authors:
+Tian Yu Liu <tianyu@cs.ucla.edu>
+Parth Agrawal <parthagrawal24@ucla.edu>
+Allison Chen <allisonchen2@ucla.edu>
+Alex Wong <alex.wong@yale.edu>
+
+If you use this code, please cite the following paper:
+T.Y. Liu, P. Agrawal, A. Chen, B.W. Hong, and A. Wong. Monitored Distillation for Positive Congruent Depth Completion.
+https://arxiv.org/abs/2203.16034
+
+@inproceedings{liu2022monitored,
+  title={Monitored distillation for positive congruent depth completion},
+  author={Liu, Tian Yu and Agrawal, Parth and Chen, Allison and Hong, Byung-Woo and Wong, Alex},
+  booktitle={European Conference on Computer Vision},
+  year={2022},
+  organization={Springer}
+}
+'''
+
+import os, time, shutil, tempfile, argparse
+import numpy as np
+import data_utils
+
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('--image_path',
+    type=str, default=None, help='Path to list of image paths to benchmark')
+parser.add_argument('--depth_path',
+    type=str, default=None, help='Path to list of depth map paths to benchmark')
+parser.add_argument('--codecs',
+    nargs='+', type=str, default=data_utils.CODECS, help='Space delimited list of codecs to benchmark')
+parser.add_argument('--n_sample',
+    type=int, default=100, help='Number of files to sample from each list')
+parser.add_argument('--n_repeat',
+    type=int, default=3, help='Number of times to decode each file')
+
+
+def benchmark(paths, read_func, codecs, n_repeat=3):
+    '''
+    Measures decode throughput of each codec and checks that it decodes the same
+    values as the PIL reference. Files are copied into a temporary directory and
+    re-encoded there for codecs that store files in another format
+
+    Arg(s):
+        paths : list[str]
+            paths to image or depth map files
+        read_func : func
+            data_utils.read_image_file or data_utils.read_depth_file
+        codecs : list[str]
+            codecs to benchmark
+        n_repeat : int
+            number of times to decode each file
+    '''
+
+    write_func = data_utils.write_image_file \
+        if read_func is data_utils.read_image_file else data_utils.write_depth_file
+
+    with tempfile.TemporaryDirectory() as temp_dirpath:
+
+        # Copy files and decode reference values with PIL
+        temp_paths = []
+        references = []
+
+        for idx, path in enumerate(paths):
+            temp_path = os.path.join(
+                temp_dirpath,
+                '{:010d}{}'.format(idx, os.path.splitext(path)[1]))
+            shutil.copyfile(path, temp_path)
+
+            temp_paths.append(temp_path)
+            references.append(read_func(temp_path, codec='pil'))
+
+        n_byte_decoded = sum([reference.nbytes for reference in references])
+
+        print('{:<10}  {:>12}  {:>12}  {:>12}  {:>8}'.format(
+            'codec', 'ms / file', 'MB / s', 'MB on disk', 'correct'))
+
+        for codec in codecs:
+
+            for temp_path, reference in zip(temp_paths, references):
+                if data_utils.get_codec_path(temp_path, codec) != temp_path:
+                    write_func(reference, temp_path, codec=codec)
+
+            n_byte_disk = sum([
+                os.path.getsize(data_utils.get_codec_path(temp_path, codec))
+                for temp_path in temp_paths
+            ])
+
+            # Check values before timing so that the first pass also warms up file cache
+            correct = all([
+                np.array_equal(
+                    np.asarray(read_func(temp_path, codec=codec), dtype=np.int64),
+                    np.asarray(reference, dtype=np.int64))
+                for temp_path, reference in zip(temp_paths, references)
+            ])
+
+            time_start = time.time()
+
+            for _ in range(n_repeat):
+                for temp_path in temp_paths:
+                    read_func(temp_path, codec=codec)
+
+            time_elapse = time.time() - time_start
+
+            print('{:<10}  {:>12.3f}  {:>12.1f}  {:>12.1f}  {:>8}'.format(
+                codec,
+                1000.0 * time_elapse / (n_repeat * len(temp_paths)),
+                n_repeat * n_byte_decoded / time_elapse / 1e6,
+                n_byte_disk / 1e6,
+                str(correct)))
+
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+
+    inputs = [
+        ('images', args.image_path, data_utils.read_image_file),
+        ('depth maps', args.depth_path, data_utils.read_depth_file)
+    ]
+
+    for name, path, read_func in inputs:
+
+        if path is None:
+            continue
+
+        paths = data_utils.read_paths(path)
+
+        # Sample evenly across the list
+        idxs = np.linspace(0, len(paths) - 1, min(args.n_sample, len(paths))).astype(np.int32)
+        paths = [paths[idx] for idx in np.unique(idxs)]
+
+        print('Decoding {} {} from: {}'.format(len(paths), name, path))
+
+        benchmark(
+            paths,
+            read_func=read_func,
+            codecs=args.codecs,
+            n_repeat=args.n_repeat)
+
+        print('')
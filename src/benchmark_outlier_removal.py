@@ -0,0 +1,201 @@
+'''
+Authors:
+Tian Yu Liu <tianyu@cs.ucla.edu>
+Parth Agrawal <parthagrawal24@ucla.edu>
+Allison Chen <allisonchen2@ucla.edu>
+Alex Wong <alex.wong@yale.edu>
+
+If you use this code, please cite the following paper:
+T.Y. Liu, P. Agrawal, A. Chen, B.W. Hong, and A. Wong. Monitored Distillation for Positive Congruent Depth Completion.
+https://arxiv.org/abs/2203.16034
+
+@inproceedings{liu2022monitored,
+  title={Monitored distillation for positive congruent depth completion},
+  author={Liu, Tian Yu and Agrawal, Parth and Chen, Allison and Hong, Byung-Woo and Wong, Alex},
+  booktitle={European Conference on Computer Vision},
+  year={2022},
+  organization={Springer}
+}
+'''
+
+import time, argparse
+import numpy as np
+import torch
+import data_utils
+import global_constants as settings
+from net_utils import OutlierRemoval
+
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('--sparse_depth_path',
+    type=str, default=None, help='Path to list of sparse depth paths, if not given then random sparse depth is used')
+parser.add_argument('--n_batch',
+    type=int, default=settings.N_BATCH, help='Number of samples per batch')
+parser.add_argument('--n_height',
+    type=int, default=352, help='Height of random sparse depth')
+parser.add_argument('--n_width',
+    type=int, default=1216, help='Width of random sparse depth')
+parser.add_argument('--density',
+    type=float, default=0.05, help='Fraction of valid points in random sparse depth')
+parser.add_argument('--kernel_sizes',
+    nargs='+', type=int, default=[settings.OUTLIER_REMOVAL_KERNEL_SIZE], help='Space delimited list of kernel sizes to benchmark')
+parser.add_argument('--threshold',
+    type=float, default=settings.OUTLIER_REMOVAL_THRESHOLD, help='Difference threshold to consider a point an outlier')
+parser.add_argument('--n_repeat',
+    type=int, default=50, help='Number of times to run each implementation')
+parser.add_argument('--device',
+    type=str, default=settings.CUDA, help='Device to use: gpu, cpu')
+
+
+def remove_outliers_reference(sparse_depth, validity_map, kernel_size, threshold):
+    '''
+    Previous implementation of OutlierRemoval.remove_outliers with a full K x K pool
+    over the padded depth map and a batch-wide fill value
+
+    Arg(s):
+        sparse_depth : torch.Tensor[float32]
+            N x 1 x H x W tensor sparse depth
+        validity_map : torch.Tensor[float32]
+            N x 1 x H x W tensor validity map
+        kernel_size : int
+            local neighborhood to consider
+        threshold : float
+            depth difference threshold
+    Returns:
+        torch.Tensor[float32] : N x 1 x H x W sparse depth
+        torch.Tensor[float32] : N x 1 x H x W validity map
+    '''
+
+    max_value = 10 * torch.max(sparse_depth)
+    sparse_depth_max_filled = torch.where(
+        validity_map <= 0,
+        torch.full_like(sparse_depth, fill_value=max_value),
+        sparse_depth)
+
+    padding = kernel_size // 2
+    sparse_depth_max_filled = torch.nn.functional.pad(
+        input=sparse_depth_max_filled,
+        pad=(padding, padding, padding, padding),
+        mode='constant',
+        value=max_value)
+
+    min_values = -torch.nn.functional.max_pool2d(
+        input=-sparse_depth_max_filled,
+        kernel_size=kernel_size,
+        stride=1,
+        padding=0)
+
+    validity_map_clean = torch.where(
+        min_values < sparse_depth - threshold,
+        torch.zeros_like(validity_map),
+        torch.ones_like(validity_map))
+
+    validity_map_clean = validity_map * validity_map_clean
+    sparse_depth_clean = sparse_depth * validity_map_clean
+
+    return sparse_depth_clean, validity_map_clean
+
+def time_func(func, n_repeat, device):
+    '''
+    Measures average run time of a function
+
+    Arg(s):
+        func : func
+            function without arguments
+        n_repeat : int
+            number of times to run function
+        device : torch.device
+            device that function runs on
+    Returns:
+        float : average time in ms
+    '''
+
+    # Warm up
+    func()
+
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+    time_start = time.time()
+
+    for _ in range(n_repeat):
+        func()
+
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+    return 1000.0 * (time.time() - time_start) / n_repeat
+
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+
+    if args.device == settings.CUDA or args.device == settings.GPU:
+        device = torch.device(settings.CUDA if torch.cuda.is_available() else settings.CPU)
+    else:
+        device = torch.device(settings.CPU)
+
+    if args.sparse_depth_path is not None:
+        paths = data_utils.read_paths(args.sparse_depth_path)[0:args.n_batch]
+
+        sparse_depth = np.stack([
+            data_utils.load_depth(path, data_format='CHW') for path in paths
+        ], axis=0)
+
+        sparse_depth = torch.from_numpy(sparse_depth)
+    else:
+        shape = (args.n_batch, 1, args.n_height, args.n_width)
+
+        sparse_depth = 80.0 * torch.rand(shape)
+        sparse_depth = torch.where(
+            torch.rand(shape) < args.density,
+            sparse_depth,
+            torch.zeros_like(sparse_depth))
+
+    sparse_depth = sparse_depth.to(device)
+    validity_map = torch.where(
+        sparse_depth > 0,
+        torch.ones_like(sparse_depth),
+        sparse_depth)
+
+    print('Sparse depth: {} with {:.2f}% valid points on {}'.format(
+        list(sparse_depth.shape), 100.0 * validity_map.mean().item(), device))
+
+    print('{:<8}  {:<12}  {:>10}  {:>10}'.format('kernel', 'method', 'ms', 'identical'))
+
+    for kernel_size in args.kernel_sizes:
+
+        outputs_reference = remove_outliers_reference(
+            sparse_depth, validity_map, kernel_size, args.threshold)
+
+        def run_reference():
+            return remove_outliers_reference(
+                sparse_depth, validity_map, kernel_size, args.threshold)
+
+        methods = [
+            ('reference', run_reference),
+            ('separable', OutlierRemoval(kernel_size, args.threshold, sparse_aware=False)),
+            ('sparse', OutlierRemoval(kernel_size, args.threshold, sparse_aware=True))
+        ]
+
+        for name, method in methods:
+
+            if isinstance(method, OutlierRemoval):
+                func = lambda: method.remove_outliers(sparse_depth, validity_map)
+            else:
+                func = method
+
+            with torch.no_grad():
+                outputs = func()
+
+                identical = all([
+                    torch.equal(output, output_reference)
+                    for output, output_reference in zip(outputs, outputs_reference)
+                ])
+
+                time_elapse = time_func(func, args.n_repeat, device)
+
+            print('{:<8}  {:<12}  {:>10.3f}  {:>10}'.format(
+                kernel_size, name, time_elapse, str(identical)))
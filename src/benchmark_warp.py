@@ -0,0 +1,165 @@
+'''
+Authors:
+Tian Yu Liu <tianyu@cs.ucla.edu>
+Parth Agrawal <parthagrawal24@ucla.edu>
+Allison Chen <allisonchen2@ucla.edu>
+Alex Wong <alex.wong@yale.edu>
+
+If you use this code, please cite the following paper:
+T.Y. Liu, P. Agrawal, A. Chen, B.W. Hong, and A. Wong. Monitored Distillation for Positive Congruent Depth Completion.
+https://arxiv.org/abs/2203.16034
+
+@inproceedings{liu2022monitored,
+  title={Monitored distillation for positive congruent depth completion},
+  author={Liu, Tian Yu and Agrawal, Parth and Chen, Allison and Hong, Byung-Woo and Wong, Alex},
+  booktitle={European Conference on Computer Vision},
+  year={2022},
+  organization={Springer}
+}
+'''
+
+import time, argparse
+import torch
+import global_constants as settings
+import loss_utils
+
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument('--n_batch',
+    type=int, default=settings.N_BATCH, help='Number of samples per batch')
+parser.add_argument('--n_height',
+    type=int, default=352, help='Height of random image')
+parser.add_argument('--n_width',
+    type=int, default=1216, help='Width of random image')
+parser.add_argument('--max_disparity',
+    type=float, default=100.0, help='Maximum magnitude of random disparity in pixels')
+parser.add_argument('--padding_modes',
+    nargs='+', type=str, default=['border', 'zeros'], help='Space delimited list of padding modes to benchmark')
+parser.add_argument('--n_repeat',
+    type=int, default=50, help='Number of times to run each implementation')
+parser.add_argument('--device',
+    type=str, default=settings.CUDA, help='Device to use: gpu, cpu')
+
+
+def warp1d_horizontal_reference(image, disparity, padding_mode='border'):
+    '''
+    Previous implementation of loss_utils.warp1d_horizontal that builds a full
+    flow field and samples it with bilinear grid_sample
+
+    Arg(s):
+        image : torch.Tensor[float32]
+            N x C x H x W image
+        disparity : torch.Tensor[float32]
+            N x 1 x H x W disparity
+        padding_mode : str
+            border, zeros
+    Returns:
+        torch.Tensor[float32] : N x C x H x W warped image
+    '''
+
+    n_batch, _, n_height, n_width = image.shape
+    device = image.device
+
+    x = torch.linspace(0, 1, n_width, dtype=torch.float32, device=device) \
+        .repeat(n_batch, n_height, 1)
+    y = torch.linspace(0, 1, n_height, dtype=torch.float32, device=device) \
+        .repeat(n_batch, n_width, 1) \
+        .transpose(1, 2)
+
+    dx = disparity[:, 0, :, :] / n_width
+    flow_field = torch.stack((x + dx, y), dim=3)
+
+    return torch.nn.functional.grid_sample(
+        image,
+        grid=(2 * flow_field - 1),
+        mode='bilinear',
+        padding_mode=padding_mode,
+        align_corners=True)
+
+def time_func(func, n_repeat, device):
+    '''
+    Measures average run time of a function
+
+    Arg(s):
+        func : func
+            function without arguments
+        n_repeat : int
+            number of times to run function
+        device : torch.device
+            device that function runs on
+    Returns:
+        float : average time in ms
+    '''
+
+    # Warm up
+    func()
+
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+    time_start = time.time()
+
+    for _ in range(n_repeat):
+        func()
+
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+    return 1000.0 * (time.time() - time_start) / n_repeat
+
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+
+    if args.device == settings.CUDA or args.device == settings.GPU:
+        device = torch.device(settings.CUDA if torch.cuda.is_available() else settings.CPU)
+    else:
+        device = torch.device(settings.CPU)
+
+    image = torch.rand((args.n_batch, 3, args.n_height, args.n_width), device=device)
+    disparity = torch.rand((args.n_batch, 1, args.n_height, args.n_width), device=device)
+    disparity = args.max_disparity * (2.0 * disparity - 1.0)
+
+    print('Image: {}  disparity in [{:.1f}, {:.1f}] on {}'.format(
+        list(image.shape), -args.max_disparity, args.max_disparity, device))
+
+    print('{:<8}  {:<10}  {:>10}  {:>10}  {:>12}  {:>12}'.format(
+        'padding', 'method', 'forward ms', 'train ms', 'output err', 'grad err'))
+
+    for padding_mode in args.padding_modes:
+
+        def forward_backward(func):
+            disparity_grad = disparity.clone().requires_grad_()
+            output = func(image, disparity_grad, padding_mode=padding_mode)
+            torch.sum(output).backward()
+            return output.detach(), disparity_grad.grad
+
+        output_reference, grad_reference = forward_backward(warp1d_horizontal_reference)
+
+        methods = [
+            ('reference', warp1d_horizontal_reference),
+            ('warp1d', loss_utils.warp1d_horizontal)
+        ]
+
+        for name, method in methods:
+
+            output, grad = forward_backward(method)
+
+            output_error = torch.max(torch.abs(output - output_reference)).item()
+            grad_error = torch.max(torch.abs(grad - grad_reference)).item()
+
+            with torch.no_grad():
+                time_forward = time_func(
+                    lambda: method(image, disparity, padding_mode=padding_mode),
+                    args.n_repeat,
+                    device)
+
+            time_train = time_func(
+                lambda: forward_backward(method),
+                args.n_repeat,
+                device)
+
+            print('{:<8}  {:<10}  {:>10.3f}  {:>10.3f}  {:>12.2e}  {:>12.2e}'.format(
+                padding_mode, name, time_forward, time_train, output_error, grad_error))
@@ -18,7 +18,9 @@ https://arxiv.org/abs/2203.16034
 }
 '''
 
+import os, threading
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 from skimage.restoration import inpaint
 from scipy.interpolate import LinearNDInterpolator
@@ -63,7 +65,139 @@ def write_paths(filepath, paths):
         for idx in range(len(paths)):
             o.write(paths[idx] + '\n')
 
-def load_image(path, normalize=True, data_format='HWC'):
+# Backends to decode and encode image and depth map files with
+CODECS = ['pil', 'opencv', 'npz']
+
+def get_codec_path(path, codec='pil'):
+    '''
+    Returns path of file stored with a codec, files of array codecs are stored
+    next to the original image file with the extension of the codec
+
+    Arg(s):
+        path : str
+            path to image or depth map file e.g. PNG
+        codec : str
+            pil, opencv, npz
+    Returns:
+        str : path to file for codec
+    '''
+
+    if codec == 'npz':
+        return os.path.splitext(path)[0] + '.npz'
+    elif codec in ['pil', 'opencv']:
+        return path
+    else:
+        raise ValueError('Unsupported codec: {}'.format(codec))
+
+def read_image_file(path, codec='pil'):
+    '''
+    Decodes an RGB image file
+
+    Arg(s):
+        path : str
+            path to image file
+        codec : str
+            pil, opencv, npz
+    Returns:
+        numpy[uint8] : H x W x 3 image
+    '''
+
+    if codec == 'pil':
+        return np.asarray(Image.open(path).convert('RGB'))
+    elif codec == 'opencv':
+        import cv2
+
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+
+        if image is None:
+            raise ValueError('Unable to read image: {}'.format(path))
+
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    elif codec == 'npz':
+        with np.load(get_codec_path(path, codec)) as data:
+            return data['data']
+    else:
+        raise ValueError('Unsupported codec: {}'.format(codec))
+
+def read_depth_file(path, codec='pil'):
+    '''
+    Decodes a 16-bit depth map file without converting it to float
+
+    Arg(s):
+        path : str
+            path to 16-bit depth map file
+        codec : str
+            pil, opencv, npz
+    Returns:
+        numpy[int] : H x W raw 16-bit values
+    '''
+
+    if codec == 'pil':
+        return np.asarray(Image.open(path))
+    elif codec == 'opencv':
+        import cv2
+
+        z = cv2.imread(path, cv2.IMREAD_ANYDEPTH)
+
+        if z is None:
+            raise ValueError('Unable to read depth map: {}'.format(path))
+
+        return z
+    elif codec == 'npz':
+        with np.load(get_codec_path(path, codec)) as data:
+            return data['data']
+    else:
+        raise ValueError('Unsupported codec: {}'.format(codec))
+
+def write_image_file(image, path, codec='pil'):
+    '''
+    Encodes an RGB image to file
+
+    Arg(s):
+        image : numpy[uint8]
+            H x W x 3 image
+        path : str
+            path to image file
+        codec : str
+            pil, opencv, npz
+    '''
+
+    if codec == 'pil':
+        Image.fromarray(image).save(path)
+    elif codec == 'opencv':
+        import cv2
+
+        cv2.imwrite(path, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+    elif codec == 'npz':
+        np.savez_compressed(get_codec_path(path, codec), data=image)
+    else:
+        raise ValueError('Unsupported codec: {}'.format(codec))
+
+def write_depth_file(z, path, codec='pil'):
+    '''
+    Encodes raw 16-bit depth map values (depth * 256) to file
+
+    Arg(s):
+        z : numpy[int]
+            H x W raw 16-bit values
+        path : str
+            path to depth map file
+        codec : str
+            pil, opencv, npz
+    '''
+
+    if codec == 'pil':
+        Image.fromarray(np.uint32(z), mode='I').save(path)
+    elif codec == 'opencv':
+        import cv2
+
+        cv2.imwrite(path, np.uint16(z))
+    elif codec == 'npz':
+        np.savez_compressed(get_codec_path(path, codec), data=np.uint16(z))
+    else:
+        raise ValueError('Unsupported codec: {}'.format(codec))
+
+def load_image(path, normalize=True, data_format='HWC', dtype=np.float32, codec='pil'):
     '''
     Loads an RGB image
 
@@ -74,15 +208,16 @@ def load_image(path, normalize=True, data_format='HWC'):
             if set, then normalize image between [0, 1]
         data_format : str
             'CHW', or 'HWC'
+        dtype : numpy.dtype
+            data type of image, use np.uint8 without normalize to keep raw intensities
+        codec : str
+            pil, opencv, npz
     Returns:
         numpy[float32] : H x W x C or C x H x W image
     '''
 
-    # Load image
-    image = Image.open(path).convert('RGB')
-
-    # Convert to numpy
-    image = np.asarray(image, np.float32)
+    # Load image and convert to numpy
+    image = read_image_file(path, codec=codec).astype(dtype, copy=False)
 
     if data_format == 'HWC':
         pass
@@ -96,7 +231,25 @@ def load_image(path, normalize=True, data_format='HWC'):
 
     return image
 
-def load_depth_with_validity_map(path, data_format='HW'):
+def save_image(image, path, normalized=True, codec='pil'):
+    '''
+    Saves an RGB image to file
+
+    Arg(s):
+        image : numpy[float32]
+            H x W x C image
+        path : str
+            path to store image
+        normalized : bool
+            if set, then image is between [0, 1] and is scaled to [0, 255]
+        codec : str
+            pil, opencv, npz
+    '''
+
+    image = 255.0 * image if normalized else image
+    write_image_file(image.astype(np.uint8), path, codec=codec)
+
+def load_depth_with_validity_map(path, data_format='HW', codec='pil'):
     '''
     Loads a depth map and validity map from a 16-bit PNG file
 
@@ -105,16 +258,18 @@ def load_depth_with_validity_map(path, data_format='HW'):
             path to 16-bit PNG file
         data_format : str
             HW, CHW, HWC
+        codec : str
+            pil, opencv, npz
     Returns:
         numpy[float32] : depth map
         numpy[float32] : binary validity map for available depth measurement locations
     '''
 
     # Loads depth map from 16-bit PNG file
-    z = np.array(Image.open(path), dtype=np.float32)
+    z = read_depth_file(path, codec=codec).astype(np.float32)
 
     # Assert 16-bit (not 8-bit) depth map
-    z = z / 256.0
+    z /= 256.0
     z[z <= 0] = 0.0
     v = z.astype(np.float32)
     v[z > 0] = 1.0
@@ -132,7 +287,7 @@ def load_depth_with_validity_map(path, data_format='HW'):
 
     return z, v
 
-def load_depth(path, data_format='HW'):
+def load_depth(path, data_format='HW', codec='pil'):
     '''
     Loads a depth map from a 16-bit PNG file
 
@@ -141,15 +296,17 @@ def load_depth(path, data_format='HW'):
             path to 16-bit PNG file
         data_format : str
             HW, CHW, HWC
+        codec : str
+            pil, opencv, npz
     Returns:
         numpy[float32] : depth map
     '''
 
     # Loads depth map from 16-bit PNG file
-    z = np.array(Image.open(path), dtype=np.float32)
+    z = read_depth_file(path, codec=codec).astype(np.float32)
 
     # Assert 16-bit (not 8-bit) depth map
-    z = z / 256.0
+    z /= 256.0
     z[z <= 0] = 0.0
 
     if data_format == 'HW':
@@ -163,7 +320,39 @@ def load_depth(path, data_format='HW'):
 
     return z
 
-def save_depth(z, path):
+def load_depth_compact(path, data_format='HW', codec='pil'):
+    '''
+    Loads a depth map from a 16-bit PNG file without decoding it to float, the
+    values are the raw 16-bit integers (depth * 256) reinterpreted as int16 so
+    that they can be batched as tensors. Decode with (z & 0xFFFF) / 256, where
+    non-zero values mark valid depth
+
+    Arg(s):
+        path : str
+            path to 16-bit PNG file
+        data_format : str
+            HW, CHW, HWC
+        codec : str
+            pil, opencv, npz
+    Returns:
+        numpy[int16] : raw 16-bit depth map
+    '''
+
+    # Loads raw 16-bit values, PIL reads 16-bit PNG files as 32-bit integers
+    z = read_depth_file(path, codec=codec).astype(np.uint16).view(np.int16)
+
+    if data_format == 'HW':
+        pass
+    elif data_format == 'CHW':
+        z = np.expand_dims(z, axis=0)
+    elif data_format == 'HWC':
+        z = np.expand_dims(z, axis=-1)
+    else:
+        raise ValueError('Unsupported data format: {}'.format(data_format))
+
+    return z
+
+def save_depth(z, path, codec='pil'):
     '''
     Saves a depth map to a 16-bit PNG file
 
@@ -172,11 +361,141 @@ def save_depth(z, path):
             depth map
         path : str
             path to store depth map
+        codec : str
+            pil, opencv, npz
     '''
 
     z = np.uint32(z * 256.0)
-    z = Image.fromarray(z, mode='I')
-    z.save(path)
+    write_depth_file(z, path, codec=codec)
+
+def load_packed_depth(path, data_format='CHW'):
+    '''
+    Loads a stack of depth maps (e.g. teacher outputs from an ensemble) stored
+    as a single contiguous M x H x W 16-bit array file
+
+    Arg(s):
+        path : str
+            path to .npy file
+        data_format : str
+            CHW, HWC
+    Returns:
+        numpy[float32] : M x H x W or H x W x M depth maps
+    '''
+
+    # Loads all depth maps in one read
+    z = np.load(path).astype(np.float32)
+
+    # Assert 16-bit (not 8-bit) depth map
+    z = z / 256.0
+    z[z <= 0] = 0.0
+
+    if data_format == 'CHW':
+        pass
+    elif data_format == 'HWC':
+        z = np.transpose(z, (1, 2, 0))
+    else:
+        raise ValueError('Unsupported data format: {}'.format(data_format))
+
+    return z
+
+def load_packed_depth_compact(path, data_format='CHW'):
+    '''
+    Loads a stack of depth maps stored as a single contiguous M x H x W 16-bit
+    array file without decoding it to float (see load_depth_compact)
+
+    Arg(s):
+        path : str
+            path to .npy file
+        data_format : str
+            CHW, HWC
+    Returns:
+        numpy[int16] : M x H x W or H x W x M raw 16-bit depth maps
+    '''
+
+    z = np.load(path).astype(np.uint16).view(np.int16)
+
+    if data_format == 'CHW':
+        pass
+    elif data_format == 'HWC':
+        z = np.transpose(z, (1, 2, 0))
+    else:
+        raise ValueError('Unsupported data format: {}'.format(data_format))
+
+    return z
+
+def save_packed_depth(z, path):
+    '''
+    Saves a stack of depth maps to a single contiguous 16-bit array file
+
+    Arg(s):
+        z : numpy[float32]
+            M x H x W depth maps
+        path : str
+            path to store depth maps
+    '''
+
+    z = np.uint16(z * 256.0)
+    np.save(path, np.ascontiguousarray(z))
+
+def get_n_packed_depth(path):
+    '''
+    Returns the number of depth maps stored in a path
+
+    Arg(s):
+        path : str
+            path to .npy packed depth maps or 16-bit PNG file
+    Returns:
+        int : number of depth maps stored in path
+    '''
+
+    if path is not None and path.endswith('.npy'):
+        # Only read the header
+        return np.load(path, mmap_mode='r').shape[0]
+    else:
+        return 1
+
+# Selection loss maps are stored as 16-bit fixed point, SSIM loss summed over
+# 3 channels lies in [0, 3] so this keeps a resolution of 1 / 16384
+SELECTION_MAP_SCALE = 16384.0
+
+def load_selection_map(path, data_format='CHW'):
+    '''
+    Loads per-teacher reprojection error maps used to select from an ensemble
+    stored as a single M x H x W 16-bit array file
+
+    Arg(s):
+        path : str
+            path to .npy file
+        data_format : str
+            CHW, HWC
+    Returns:
+        numpy[float32] : M x H x W or H x W x M error maps
+    '''
+
+    e = np.load(path).astype(np.float32) / SELECTION_MAP_SCALE
+
+    if data_format == 'CHW':
+        pass
+    elif data_format == 'HWC':
+        e = np.transpose(e, (1, 2, 0))
+    else:
+        raise ValueError('Unsupported data format: {}'.format(data_format))
+
+    return e
+
+def save_selection_map(e, path):
+    '''
+    Saves per-teacher reprojection error maps to a single contiguous 16-bit array file
+
+    Arg(s):
+        e : numpy[float32]
+            M x H x W error maps
+        path : str
+            path to store error maps
+    '''
+
+    e = np.clip(e * SELECTION_MAP_SCALE, 0, np.iinfo(np.uint16).max)
+    np.save(path, np.ascontiguousarray(np.uint16(np.round(e))))
 
 def load_validity_map(path, data_format='HW'):
     '''
@@ -326,3 +645,66 @@ def interpolate_depth(depth_map, validity_map, log_space=False):
         Z[Z < 1e-1] = 0.0
 
     return Z
+
+
+class OutputWriter(object):
+    '''
+    Saves outputs (e.g. with save_image, save_depth) in background threads so
+    that encoding and writing to disk overlaps with inference. Submitting blocks
+    once the number of pending saves reaches the maximum queue size
+
+    Arg(s):
+        n_thread : int
+            number of threads to save with
+        max_queue_size : int
+            maximum number of pending saves before submit blocks
+    '''
+
+    def __init__(self, n_thread=4, max_queue_size=32):
+
+        self.executor = ThreadPoolExecutor(max_workers=n_thread)
+        self.slots = threading.BoundedSemaphore(max_queue_size)
+        self.error = None
+
+    def submit(self, save_func, *args):
+        '''
+        Queues a save to run in the background
+
+        Arg(s):
+            save_func : func
+                function to save outputs e.g. save_depth
+            args : list
+                arguments to save function, must not be modified after submitting
+        '''
+
+        # Fail early if a previous save failed
+        if self.error is not None:
+            raise self.error
+
+        # Wait for a free slot
+        self.slots.acquire()
+
+        try:
+            future = self.executor.submit(save_func, *args)
+        except Exception:
+            self.slots.release()
+            raise
+
+        future.add_done_callback(self._release)
+
+    def _release(self, future):
+
+        self.slots.release()
+
+        if future.exception() is not None and self.error is None:
+            self.error = future.exception()
+
+    def close(self):
+        '''
+        Waits for all pending saves to finish
+        '''
+
+        self.executor.shutdown(wait=True)
+
+        if self.error is not None:
+            raise self.error
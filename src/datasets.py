@@ -18,12 +18,13 @@ https://arxiv.org/abs/2203.16034
 }
 '''
 
+import os
 import torch
 import numpy as np
 import data_utils
 
 
-def load_triplet_image(path, normalize=True, data_format='CHW'):
+def load_triplet_image(path, normalize=True, data_format='CHW', dtype=np.float32, codec='pil'):
     '''
     Load in triplet frames from path
 
@@ -34,6 +35,10 @@ def load_triplet_image(path, normalize=True, data_format='CHW'):
             if set, normalize to [0, 1]
         data_format : str
             'CHW', or 'HWC'
+        dtype : numpy.dtype
+            data type of images
+        codec : str
+            pil, opencv, npz
     Returns:
         numpy[float32] : image at t - 1
         numpy[float32] : image at t
@@ -43,11 +48,248 @@ def load_triplet_image(path, normalize=True, data_format='CHW'):
     images = data_utils.load_image(
         path,
         normalize=normalize,
-        data_format=data_format)
+        data_format=data_format,
+        dtype=dtype,
+        codec=codec)
 
     image1, image0, image2 = np.split(images, indices_or_sections=3, axis=-1)
     return image1, image0, image2
 
+def get_triplet_frame_path(path, frame):
+    '''
+    Returns path to a single frame of an image triplet that is stored as
+    separate files (see setup/setup_dataset_triplet_frames.py)
+
+    Arg(s):
+        path : str
+            path to image triplet
+        frame : int
+            position of frame in triplet: 0 for t - 1, 1 for t, 2 for t + 1
+    Returns:
+        str : path to frame
+    '''
+
+    root, ext = os.path.splitext(path)
+
+    return '{}-frame{}{}'.format(root, frame, ext)
+
+def is_triplet_split(path, codec='pil'):
+    '''
+    Checks if the frames of an image triplet are also stored as separate files
+
+    Arg(s):
+        path : str
+            path to image triplet
+        codec : str
+            pil, opencv, npz
+    Returns:
+        bool : if set, then each frame can be loaded on its own
+    '''
+
+    return path is not None and all([
+        os.path.exists(data_utils.get_codec_path(get_triplet_frame_path(path, frame), codec))
+        for frame in range(3)
+    ])
+
+def load_triplet_frame(path, frame=1, normalize=True, data_format='CHW', dtype=np.float32, split=False, codec='pil'):
+    '''
+    Load in a single frame of an image triplet, if the triplet is split into
+    separate files then only the requested frame is decoded
+
+    Arg(s):
+        path : str
+            path to image triplet
+        frame : int
+            position of frame in triplet: 0 for t - 1, 1 for t, 2 for t + 1
+        normalize : bool
+            if set, normalize to [0, 1]
+        data_format : str
+            'CHW', or 'HWC'
+        dtype : numpy.dtype
+            data type of image
+        split : bool
+            if set, then load frame from its own file if the triplet is split,
+            otherwise decode the whole triplet
+        codec : str
+            pil, opencv, npz
+    Returns:
+        numpy[float32] : image at frame
+    '''
+
+    # Fall back to the triplet for samples that were not split e.g. interrupted setup
+    if split and is_triplet_split(path, codec):
+        return data_utils.load_image(
+            get_triplet_frame_path(path, frame),
+            normalize=normalize,
+            data_format=data_format,
+            dtype=dtype,
+            codec=codec)
+
+    images = load_triplet_image(
+        path,
+        normalize=normalize,
+        data_format=data_format,
+        dtype=dtype,
+        codec=codec)
+
+    return images[frame]
+
+def load_teacher_output(paths, data_format='CHW', compact=False, codec='pil'):
+    '''
+    Load in teacher output from an ensemble, where each path is either a
+    16-bit PNG holding a single teacher or a packed .npy holding several
+
+    Arg(s):
+        paths : list[str]
+            paths to teacher output
+        data_format : str
+            'CHW', or 'HWC'
+        compact : bool
+            if set, then load raw 16-bit values (see decode_depth_compact)
+        codec : str
+            pil, opencv, npz used for teacher output that is not packed
+    Returns:
+        numpy[float32] : M x H x W or H x W x M teacher output
+    '''
+
+    teacher_output = []
+
+    for path in paths:
+        if path.endswith('.npy'):
+            # Packed teacher output holds all teachers in one contiguous block
+            load_func = \
+                data_utils.load_packed_depth_compact if compact else data_utils.load_packed_depth
+
+            teacher_output.append(
+                load_func(
+                    path=path,
+                    data_format=data_format))
+        else:
+            load_func = \
+                data_utils.load_depth_compact if compact else data_utils.load_depth
+
+            teacher_output.append(
+                load_func(
+                    path=path,
+                    data_format=data_format,
+                    codec=codec))
+
+    if len(teacher_output) == 1:
+        return teacher_output[0]
+
+    axis = 0 if data_format == 'CHW' else -1
+
+    return np.concatenate(teacher_output, axis=axis)
+
+def decode_depth_compact(depth):
+    '''
+    Decodes a batch of depth maps loaded as raw 16-bit values reinterpreted as
+    int16 (see data_utils.load_depth_compact) into metric depth on the device
+    it is on. Depth maps that are already decoded are returned as they are
+
+    Arg(s):
+        depth : torch.Tensor
+            N x C x H x W int16 raw 16-bit or float32 depth
+    Returns:
+        torch.Tensor[float32] : N x C x H x W depth
+    '''
+
+    if depth.dtype != torch.int16:
+        return depth
+
+    # Undo int16 reinterpretation of unsigned 16-bit values
+    depth = torch.bitwise_and(depth.to(torch.int32), 0xFFFF)
+
+    return depth.to(torch.float32) / 256.0
+
+def depth_to_points(depth):
+    '''
+    Converts a sparse depth map to a list of its valid points
+
+    Arg(s):
+        depth : numpy[float32]
+            1 x H x W depth map or raw 16-bit values (see data_utils.load_depth_compact)
+    Returns:
+        numpy[float32] : P x 3 list of (row, column, depth)
+    '''
+
+    depth = depth[0, ...]
+
+    if depth.dtype == np.int16:
+        # Undo int16 reinterpretation of unsigned 16-bit values
+        depth = depth.view(np.uint16).astype(np.float32) / 256.0
+
+    y, x = np.nonzero(depth > 0)
+
+    return np.stack([y, x, depth[y, x]], axis=-1).astype(np.float32)
+
+def points_to_depth(points, n_height, n_width):
+    '''
+    Scatters a batch of point lists into sparse depth maps on the device they are on
+
+    Arg(s):
+        points : torch.Tensor[float32]
+            N x P x 3 list of (row, column, depth), points with depth of 0 are ignored
+        n_height : int
+            height of depth map
+        n_width : int
+            width of depth map
+    Returns:
+        torch.Tensor[float32] : N x 1 x H x W sparse depth
+    '''
+
+    n_batch, n_point, _ = points.shape
+
+    y, x, z = torch.unbind(points, dim=-1)
+
+    b = torch.arange(n_batch, device=points.device).view(n_batch, 1)
+
+    # Send ignored points to an extra element past the end of depth maps
+    n_element = n_batch * n_height * n_width
+
+    indices = (b * n_height + y.long()) * n_width + x.long()
+    indices = torch.where(z > 0, indices, torch.full_like(indices, n_element))
+
+    depth = torch.zeros(n_element + 1, device=points.device, dtype=points.dtype)
+    depth.scatter_(0, indices.view(-1), z.reshape(-1))
+
+    return depth[:n_element].view(n_batch, 1, n_height, n_width)
+
+class PointListCollate(object):
+    '''
+    Collates samples like the default collate function, except point lists
+    (see depth_to_points) are padded with ignored points to the largest number
+    of points in the batch
+
+    Arg(s):
+        point_indices : list[int]
+            positions of point lists in each sample
+    '''
+
+    def __init__(self, point_indices):
+
+        self.point_indices = point_indices
+
+    def __call__(self, batch):
+
+        outputs = []
+
+        for idx, samples in enumerate(zip(*batch)):
+
+            if idx in self.point_indices:
+                n_point = max([points.shape[0] for points in samples])
+
+                points_padded = np.zeros([len(samples), n_point, 3], dtype=np.float32)
+
+                for batch_idx, points in enumerate(samples):
+                    points_padded[batch_idx, :points.shape[0], :] = points
+
+                outputs.append(torch.from_numpy(points_padded))
+            else:
+                outputs.append(torch.utils.data.dataloader.default_collate(samples))
+
+        return outputs
+
 def horizontal_flip(images_arr):
     '''
     Perform horizontal flip on each sample
@@ -165,6 +407,7 @@ class DepthCompletionInferenceDataset(torch.utils.data.Dataset):
         (1) image
         (2) sparse depth
         (3) intrinsic camera calibration matrix
+        (4) if available, ground truth
 
     Arg(s):
         image_paths : list[str]
@@ -174,55 +417,122 @@ class DepthCompletionInferenceDataset(torch.utils.data.Dataset):
         intrinsics_paths : list[str]
             paths to intrinsic camera calibration matrix
         load_image_triplets : bool
-            Whether or not inference images are stored as triplets or single
+            Whether or not inference images are stored as triplets or single,
+            if triplets are also stored as separate frames then only frame at t is decoded
+        ground_truth_paths : list[str]
+            paths to ground truth depth maps
+        load_compact_ground_truth : bool
+            if set, then load ground truth as 1 x H x W raw 16-bit values
+            (see data_utils.load_depth_compact) instead of 2 x H x W float32 depth and validity map
+        load_compact : bool
+            if set, then load image as uint8 and sparse depth as raw 16-bit values
+            to be converted on device (see decode_depth_compact)
+        codec : str
+            backend to decode image and depth map files: pil, opencv, npz
+        load_sparse_depth_points : bool
+            if set, then return sparse depth as P x 3 list of points (see depth_to_points),
+            which requires batching with collate_fn
     '''
 
     def __init__(self,
                  image_paths,
                  sparse_depth_paths,
                  intrinsics_paths,
-                 load_image_triplets=False):
+                 load_image_triplets=False,
+                 ground_truth_paths=None,
+                 load_compact_ground_truth=False,
+                 load_compact=False,
+                 codec='pil',
+                 load_sparse_depth_points=False):
 
         self.n_sample = len(image_paths)
 
         for paths in [sparse_depth_paths, intrinsics_paths]:
             assert len(paths) == self.n_sample
 
+        self.ground_truth_available = ground_truth_paths is not None
+
+        if self.ground_truth_available:
+            assert len(ground_truth_paths) == self.n_sample
+
         self.image_paths = image_paths
         self.sparse_depth_paths = sparse_depth_paths
         self.intrinsics_paths = intrinsics_paths
+        self.ground_truth_paths = ground_truth_paths
 
         self.data_format = 'CHW'
         self.load_image_triplets = load_image_triplets
+        self.load_compact_ground_truth = load_compact_ground_truth
+        self.load_compact = load_compact
+
+        self.image_dtype = np.uint8 if load_compact else np.float32
+        self.load_depth_func = \
+            data_utils.load_depth_compact if load_compact else data_utils.load_depth
+
+        self.codec = codec
+
+        # Sparse depth point lists differ in length so they are padded when batched
+        self.load_sparse_depth_points = load_sparse_depth_points
+        self.collate_fn = PointListCollate([1]) if load_sparse_depth_points else None
+
+        self.split_triplets = \
+            load_image_triplets and self.n_sample > 0 and is_triplet_split(image_paths[0], codec)
 
     def __getitem__(self, index):
 
         # Load image
         if self.load_image_triplets:
-            _, image, _ = load_triplet_image(
+            image = load_triplet_frame(
                 path=self.image_paths[index],
+                frame=1,
                 normalize=False,
-                data_format=self.data_format)
+                data_format=self.data_format,
+                dtype=self.image_dtype,
+                split=self.split_triplets,
+                codec=self.codec)
         else:
             image = data_utils.load_image(
                 path=self.image_paths[index],
                 normalize=False,
-                data_format=self.data_format)
+                data_format=self.data_format,
+                dtype=self.image_dtype,
+                codec=self.codec)
 
         # Load sparse depth
-        sparse_depth = data_utils.load_depth(
+        sparse_depth = self.load_depth_func(
             path=self.sparse_depth_paths[index],
-            data_format=self.data_format)
+            data_format=self.data_format,
+            codec=self.codec)
 
         # Load camera intrinsics
-        intrinsics = np.load(self.intrinsics_paths[index])
+        intrinsics = np.load(self.intrinsics_paths[index]).astype(np.float32)
 
-        # Convert to float32
-        image, sparse_depth, intrinsics = [
-            T.astype(np.float32)
-            for T in [image, sparse_depth, intrinsics]
+        # Keep image and sparse depth compact, otherwise convert to float32
+        image, sparse_depth = [
+            np.ascontiguousarray(T) if self.load_compact else T.astype(np.float32)
+            for T in [image, sparse_depth]
         ]
-        return image, sparse_depth, intrinsics
+
+        if self.load_sparse_depth_points:
+            sparse_depth = depth_to_points(sparse_depth)
+
+        if not self.ground_truth_available:
+            return image, sparse_depth, intrinsics
+
+        # Load ground truth
+        if self.load_compact_ground_truth:
+            ground_truth = data_utils.load_depth_compact(
+                path=self.ground_truth_paths[index],
+                data_format=self.data_format,
+                codec=self.codec)
+        else:
+            ground_truth, validity_map = data_utils.load_depth_with_validity_map(
+                path=self.ground_truth_paths[index],
+                data_format=self.data_format,
+                codec=self.codec)
+            ground_truth = np.concatenate([ground_truth, validity_map], axis=0)
+
+        return image, sparse_depth, intrinsics, ground_truth
 
     def __len__(self):
         return self.n_sample
@@ -239,6 +549,7 @@ class MonitoredDistillationTrainingDataset(torch.utils.data.Dataset):
         (6) teacher output from ensemble at t
         (7) if stereo is available, intrinsic camera calibration matrix
         (8) if stereo is available, focal length and baseline
+        (9) if given, per-teacher stereo reprojection error maps at t
 
     Arg(s):
         image0_paths : list[str]
@@ -254,9 +565,11 @@ class MonitoredDistillationTrainingDataset(torch.utils.data.Dataset):
         ground_truth1_paths : list[str]
             paths to right camera ground truth depth maps
         ensemble_teacher_output0_paths : list[list[str]]
-            list of lists of paths to left camera teacher output for ensemble
+            list of lists of paths to left camera teacher output for ensemble,
+            each path is either a 16-bit PNG or a packed .npy of several teachers
         ensemble_teacher_output1_paths : list[list[str]]
-            list of lists of paths to right camera teacher output for ensemble
+            list of lists of paths to right camera teacher output for ensemble,
+            each path is either a 16-bit PNG or a packed .npy of several teachers
         intrinsics0_paths : list[str]
             paths to intrinsic left camera calibration matrix
         intrinsics1_paths : list[str]
@@ -271,6 +584,24 @@ class MonitoredDistillationTrainingDataset(torch.utils.data.Dataset):
             none, horizontal, vertical, anchored, bottom
         random_swap : bool
             Whether to perform random swapping as data augmentation
+        load_compact : bool
+            if set, then load images as uint8 and depth maps as raw 16-bit values
+            to be converted on device (see decode_depth_compact)
+        load_temporal_frames : bool
+            if not set, then images at t - 1 and t + 1 are not decoded and image at t
+            is returned in their place, if triplets are also stored as separate frames
+            then only frame at t is decoded
+        codec : str
+            backend to decode image and depth map files: pil, opencv, npz
+        load_sparse_depth_points : bool
+            if set, then return sparse depth as P x 3 list of points (see depth_to_points),
+            which requires batching with collate_fn
+        teacher_selection_map0_paths : list[str]
+            paths to left camera per-teacher stereo reprojection error maps
+            (see setup/setup_dataset_teacher_selection_map.py)
+        teacher_selection_map1_paths : list[str]
+            paths to right camera per-teacher stereo reprojection error maps,
+            required for random swapping
     '''
 
     def __init__(self,
@@ -288,7 +619,13 @@ class MonitoredDistillationTrainingDataset(torch.utils.data.Dataset):
                  focal_length_baseline1_paths,
                  random_crop_shape=None,
                  random_crop_type=None,
-                 random_swap=False):
+                 random_swap=False,
+                 load_compact=False,
+                 load_temporal_frames=True,
+                 codec='pil',
+                 load_sparse_depth_points=False,
+                 teacher_selection_map0_paths=None,
+                 teacher_selection_map1_paths=None):
 
         self.n_sample = len(image0_paths)
 
@@ -336,6 +673,18 @@ class MonitoredDistillationTrainingDataset(torch.utils.data.Dataset):
             ensemble_teacher_output0_paths + \
             ensemble_teacher_output1_paths
 
+        # Precomputed selection maps are optional, and only needed for right camera if swapping
+        self.load_selection_map = teacher_selection_map0_paths is not None
+
+        if self.load_selection_map:
+            input_paths.append(teacher_selection_map0_paths)
+
+            if random_swap and self.stereo_available:
+                if teacher_selection_map1_paths is None:
+                    raise ValueError('Random swap requires right camera teacher selection maps')
+
+                input_paths.append(teacher_selection_map1_paths)
+
         for paths in input_paths:
             assert len(paths) == self.n_sample
 
@@ -357,6 +706,15 @@ class MonitoredDistillationTrainingDataset(torch.utils.data.Dataset):
         self.ensemble_teacher_output0_paths = ensemble_teacher_output0_paths
         self.ensemble_teacher_output1_paths = ensemble_teacher_output1_paths
 
+        self.teacher_selection_map0_paths = teacher_selection_map0_paths
+        self.teacher_selection_map1_paths = teacher_selection_map1_paths
+
+        # Packed teacher output may hold more than one teacher per path
+        self.n_teacher = sum([
+            data_utils.get_n_packed_depth(paths[0]) if self.n_sample > 0 else 1
+            for paths in ensemble_teacher_output0_paths
+        ])
+
         self.random_crop_type = random_crop_type
         self.random_crop_shape = random_crop_shape
 
@@ -367,6 +725,24 @@ class MonitoredDistillationTrainingDataset(torch.utils.data.Dataset):
 
         self.data_format = 'CHW'
 
+        self.load_compact = load_compact
+        self.image_dtype = np.uint8 if load_compact else np.float32
+        self.load_depth_func = \
+            data_utils.load_depth_compact if load_compact else data_utils.load_depth
+
+        self.load_temporal_frames = load_temporal_frames
+        self.codec = codec
+
+        # Sparse depth point lists differ in length so they are padded when batched
+        self.load_sparse_depth_points = load_sparse_depth_points
+        self.collate_fn = PointListCollate([4]) if load_sparse_depth_points else None
+
+        # Frames can only be loaded on their own if triplets of both cameras are split
+        self.split_triplets = self.n_sample > 0 and all([
+            is_triplet_split(paths[0], codec)
+            for paths in [image0_paths, image1_paths] if paths[0] is not None
+        ])
+
     def __getitem__(self, index):
 
         # Swap and flip a stereo video stream
@@ -380,6 +756,7 @@ class MonitoredDistillationTrainingDataset(torch.utils.data.Dataset):
             ensemble_teacher_output0_paths = self.ensemble_teacher_output1_paths
             intrinsics0_path = self.intrinsics1_paths[index]
             focal_length_baseline0_path = self.focal_length_baseline1_paths[index]
+            teacher_selection_map_paths = self.teacher_selection_map1_paths
 
             image3_path = self.image0_paths[index]
         else:
@@ -390,45 +767,74 @@ class MonitoredDistillationTrainingDataset(torch.utils.data.Dataset):
             ensemble_teacher_output0_paths = self.ensemble_teacher_output0_paths
             intrinsics0_path = self.intrinsics0_paths[index]
             focal_length_baseline0_path = self.focal_length_baseline0_paths[index]
+            teacher_selection_map_paths = self.teacher_selection_map0_paths
 
             image3_path = self.image1_paths[index]
 
+        # Splitting may be incomplete so check each sample
+        split_triplets = self.split_triplets and is_triplet_split(image0_path, self.codec)
+
         # Load images at times: t-1, t, t+1
-        image1, image0, image2 = load_triplet_image(
-            path=image0_path,
-            normalize=False,
-            data_format=self.data_format)
+        if self.load_temporal_frames and not split_triplets:
+            image1, image0, image2 = load_triplet_image(
+                path=image0_path,
+                normalize=False,
+                data_format=self.data_format,
+                dtype=self.image_dtype,
+                codec=self.codec)
+        else:
+            frames = [0, 1, 2] if self.load_temporal_frames else [1]
+
+            images = [
+                load_triplet_frame(
+                    path=image0_path,
+                    frame=frame,
+                    normalize=False,
+                    data_format=self.data_format,
+                    dtype=self.image_dtype,
+                    split=split_triplets,
+                    codec=self.codec)
+                for frame in frames
+            ]
+
+            if self.load_temporal_frames:
+                image1, image0, image2 = images
+            else:
+                # Temporal frames are unused so stand in image at t
+                image1 = image0 = image2 = images[0]
 
         # Load sparse depth map at time t
-        sparse_depth0 = data_utils.load_depth(
+        sparse_depth0 = self.load_depth_func(
             path=sparse_depth0_path,
-            data_format=self.data_format)
+            data_format=self.data_format,
+            codec=self.codec)
 
         # Load ground_truth map at time t
-        ground_truth0 = data_utils.load_depth(
+        ground_truth0 = self.load_depth_func(
             path=ground_truth0_path,
-            data_format=self.data_format)
+            data_format=self.data_format,
+            codec=self.codec)
 
         # Load teacher output from ensemble
-        teacher_output0 = []
-
-        for paths in ensemble_teacher_output0_paths:
-            teacher_output0.append(
-                data_utils.load_depth(
-                    path=paths[index],
-                    data_format=self.data_format))
-
-        teacher_output0 = np.concatenate(teacher_output0, axis=0)
+        teacher_output0 = load_teacher_output(
+            paths=[paths[index] for paths in ensemble_teacher_output0_paths],
+            data_format=self.data_format,
+            compact=self.load_compact,
+            codec=self.codec)
 
         # Load camera intrinsics
         intrinsics0 = np.load(intrinsics0_path)
 
         # Load stereo pair for image0
         if self.stereo_available:
-            _, image3, _ = load_triplet_image(
+            image3 = load_triplet_frame(
                 path=image3_path,
+                frame=1,
                 normalize=False,
-                data_format=self.data_format)
+                data_format=self.data_format,
+                dtype=self.image_dtype,
+                split=self.split_triplets,
+                codec=self.codec)
 
             # Load camera intrinsics
             focal_length_baseline0 = np.load(focal_length_baseline0_path)
@@ -446,6 +852,14 @@ class MonitoredDistillationTrainingDataset(torch.utils.data.Dataset):
             teacher_output0,
         ]
 
+        # Selection maps are stored in camera orientation so they are swapped and cropped with images
+        if self.load_selection_map:
+            teacher_selection_map0 = data_utils.load_selection_map(
+                teacher_selection_map_paths[index],
+                data_format=self.data_format)
+
+            inputs.append(teacher_selection_map0)
+
         # If we swapped L and R, also need to horizontally flip images
         if do_swap:
             inputs = horizontal_flip(inputs)
@@ -458,14 +872,229 @@ class MonitoredDistillationTrainingDataset(torch.utils.data.Dataset):
                 intrinsics=[intrinsics0],
                 crop_type=self.random_crop_type)
 
-        # Convert inputs to float32
-        inputs = inputs + [intrinsics0, focal_length_baseline0]
+        # Keep images and depth maps compact, otherwise convert to float32
+        if self.load_compact:
+            inputs = [
+                np.ascontiguousarray(T)
+                for T in inputs
+            ]
+        else:
+            inputs = [
+                T.astype(np.float32)
+                for T in inputs
+            ]
+
+        if self.load_sparse_depth_points:
+            inputs[4] = depth_to_points(inputs[4])
+
+        if self.load_selection_map:
+            teacher_selection_map0 = inputs.pop(7).astype(np.float32)
+
+        inputs = inputs + [
+            intrinsics0.astype(np.float32),
+            focal_length_baseline0.astype(np.float32)
+        ]
+
+        if self.load_selection_map:
+            inputs.append(teacher_selection_map0)
+
+        return inputs
+
+    def __len__(self):
+        return self.n_sample
+
+
+class MonitoredDistillationTrainingCacheDataset(torch.utils.data.Dataset):
+    '''
+    Dataset for fetching the same inputs as MonitoredDistillationTrainingDataset
+    from a cache of pre-decoded, memory-mapped arrays
+    (see setup/setup_dataset_training_cache.py):
+        (1) camera image at t
+        (2) left camera image at t - 1
+        (3) left camera image at t + 1
+        (4) if stereo is available, stereo camera image
+        (5) sparse depth map at t
+        (6) teacher output from ensemble at t
+        (7) if stereo is available, intrinsic camera calibration matrix
+        (8) if stereo is available, focal length and baseline
+
+    Arg(s):
+        cache_dirpath : str
+            path to directory containing cached arrays
+        random_crop_shape : tuple[int]
+            shape (height, width) to crop inputs
+        random_crop_type : list[str]
+            none, horizontal, vertical, anchored, bottom
+        random_swap : bool
+            Whether to perform random swapping as data augmentation
+        load_compact : bool
+            if set, then return images as uint8 and depth maps as raw 16-bit values
+            to be converted on device (see decode_depth_compact)
+        load_temporal_frames : bool
+            if not set, then images at t - 1 and t + 1 are not read and image at t
+            is returned in their place
+        load_sparse_depth_points : bool
+            if set, then return sparse depth as P x 3 list of points (see depth_to_points),
+            which requires batching with collate_fn
+    '''
+
+    def __init__(self,
+                 cache_dirpath,
+                 random_crop_shape=None,
+                 random_crop_type=None,
+                 random_swap=False,
+                 load_compact=False,
+                 load_temporal_frames=True,
+                 load_sparse_depth_points=False):
+
+        self.cache_dirpath = cache_dirpath
+
+        # Height and width of each sample before padding to fixed shape
+        shapes = np.load(os.path.join(cache_dirpath, 'shape.npy'))
+
+        self.n_sample = shapes.shape[0]
+
+        self.stereo_available = all([
+            os.path.exists(os.path.join(cache_dirpath, name + '1.npy'))
+            for name in ['image', 'sparse_depth', 'ground_truth', 'teacher_output', 'intrinsics', 'focal_length_baseline']
+        ])
+
+        self.n_teacher = np.load(
+            os.path.join(cache_dirpath, 'teacher_output0.npy'), mmap_mode='r').shape[1]
+
+        self.random_crop_type = random_crop_type
+        self.random_crop_shape = random_crop_shape
+
+        self.do_random_crop = \
+            random_crop_shape is not None and all([x > 0 for x in random_crop_shape])
+
+        self.do_random_swap = random_swap and self.stereo_available
+
+        self.load_compact = load_compact
+        self.load_temporal_frames = load_temporal_frames
+
+        # Sparse depth point lists differ in length so they are padded when batched
+        self.load_sparse_depth_points = load_sparse_depth_points
+        self.collate_fn = PointListCollate([4]) if load_sparse_depth_points else None
+
+        # Arrays are memory-mapped on first access so each worker maps its own view
+        self.arrays = None
+
+    def load_arrays(self):
+        '''
+        Memory-maps cached arrays in read-only mode
+        '''
+
+        names = ['shape']
+
+        cameras = ['0', '1'] if self.stereo_available else ['0']
+
+        for camera in cameras:
+            names = names + [
+                name + camera
+                for name in ['image', 'sparse_depth', 'ground_truth', 'teacher_output', 'intrinsics', 'focal_length_baseline']
+            ]
+
+        self.arrays = {}
+
+        for name in names:
+            path = os.path.join(self.cache_dirpath, name + '.npy')
+
+            if os.path.exists(path):
+                self.arrays[name] = np.load(path, mmap_mode='r')
+
+    def __getitem__(self, index):
+
+        if self.arrays is None:
+            self.load_arrays()
+
+        # Swap and flip a stereo video stream
+        do_swap = True if self.do_random_swap and np.random.uniform() < 0.5 else False
+
+        camera0, camera3 = ('1', '0') if do_swap else ('0', '1')
+
+        # Arrays are padded to a fixed shape so slice out the valid region
+        n_height, n_width = self.arrays['shape'][index]
+
+        # Load images at times: t-1, t, t+1
+        if self.load_temporal_frames:
+            images = self.arrays['image' + camera0][index, :, :n_height, :3 * n_width]
+            image1, image0, image2 = np.split(images, indices_or_sections=3, axis=-1)
+        else:
+            # Only read the columns of image at t and stand it in for temporal frames
+            image0 = self.arrays['image' + camera0][index, :, :n_height, n_width:2 * n_width]
+            image1 = image2 = image0
+
+        # Load sparse depth map, ground truth and teacher output at time t
+        sparse_depth0 = self.arrays['sparse_depth' + camera0][index, :, :n_height, :n_width]
+        ground_truth0 = self.arrays['ground_truth' + camera0][index, :, :n_height, :n_width]
+        teacher_output0 = self.arrays['teacher_output' + camera0][index, :, :n_height, :n_width]
+
+        # Load camera intrinsics
+        intrinsics0 = np.asarray(self.arrays['intrinsics' + camera0][index])
+
+        # Load stereo pair for image0
+        if self.stereo_available:
+            image3 = self.arrays['image' + camera3][index, :, :n_height, n_width:2 * n_width]
+
+            focal_length_baseline0 = np.asarray(self.arrays['focal_length_baseline' + camera0][index])
+        else:
+            image3 = image0.copy()
+            focal_length_baseline0 = np.array([0, 0])
 
         inputs = [
-            T.astype(np.float32)
-            for T in inputs
+            image0,
+            image1,
+            image2,
+            image3,
+            sparse_depth0,
+            ground_truth0,
+            teacher_output0,
+        ]
+
+        # If we swapped L and R, also need to horizontally flip images
+        if do_swap:
+            inputs = horizontal_flip(inputs)
+
+        # Crop input images and depth maps and adjust intrinsics
+        if self.do_random_crop:
+            inputs, [intrinsics0] = random_crop(
+                inputs=inputs,
+                shape=self.random_crop_shape,
+                intrinsics=[intrinsics0],
+                crop_type=self.random_crop_type)
+
+        if self.load_compact:
+            # Copy out of memory-mapped arrays, reinterpret 16-bit depth maps as int16 to batch
+            images = [
+                np.ascontiguousarray(T)
+                for T in inputs[0:4]
+            ]
+
+            depths = [
+                np.ascontiguousarray(T).view(np.int16)
+                for T in inputs[4:]
+            ]
+        else:
+            # Convert images to float32 and 16-bit depth maps to float32 metric depth
+            images = [
+                T.astype(np.float32)
+                for T in inputs[0:4]
+            ]
+
+            depths = [
+                T.astype(np.float32) / 256.0
+                for T in inputs[4:]
+            ]
+
+        inputs = images + depths + [
+            intrinsics0.astype(np.float32),
+            focal_length_baseline0.astype(np.float32)
         ]
 
+        if self.load_sparse_depth_points:
+            inputs[4] = depth_to_points(inputs[4])
+
         return inputs
 
     def __len__(self):
@@ -18,6 +18,7 @@ https://arxiv.org/abs/2203.16034
 }
 '''
 
+import torch
 import numpy as np
 
 
@@ -110,3 +111,158 @@ def sq_rel_err(src, tgt):
     '''
 
     return np.mean(((src - tgt) ** 2) / (tgt * tgt))
+
+
+'''
+Metrics on device for batches of depth maps
+'''
+def decode_ground_truth(ground_truth):
+    '''
+    Decodes a batch of ground truth loaded by DepthCompletionInferenceDataset into
+    depth and validity map on the device it is on
+
+    Arg(s):
+        ground_truth : torch.Tensor
+            N x 2 x H x W float32 depth and validity map or
+            N x 1 x H x W int16 raw 16-bit depth (see data_utils.load_depth_compact)
+    Returns:
+        torch.Tensor[float32] : N x 1 x H x W ground truth depth
+        torch.Tensor[float32] : N x 1 x H x W validity map
+    '''
+
+    if ground_truth.dtype == torch.int16:
+        # Undo int16 reinterpretation of unsigned 16-bit values
+        ground_truth = torch.bitwise_and(ground_truth.to(torch.int32), 0xFFFF)
+        ground_truth = ground_truth.to(torch.float32) / 256.0
+
+        validity_map = (ground_truth > 0).to(torch.float32)
+    else:
+        validity_map = ground_truth[:, 1:2, :, :]
+        ground_truth = ground_truth[:, 0:1, :, :]
+
+    return ground_truth, validity_map
+
+def evaluate_depth_batch(output_depth,
+                         ground_truth,
+                         validity_map,
+                         min_evaluate_depth,
+                         max_evaluate_depth):
+    '''
+    Computes MAE, RMSE (in millimeters) and iMAE, iRMSE (in 1 / kilometers) for each
+    sample in a batch, masking and reducing on the device the tensors are on
+
+    Arg(s):
+        output_depth : torch.Tensor[float32]
+            N x 1 x H x W output depth in meters
+        ground_truth : torch.Tensor[float32]
+            N x 1 x H x W ground truth depth in meters
+        validity_map : torch.Tensor[float32]
+            N x 1 x H x W validity map of ground truth
+        min_evaluate_depth : float
+            minimum ground truth depth to evaluate
+        max_evaluate_depth : float
+            maximum ground truth depth to evaluate
+    Returns:
+        dict[str, torch.Tensor[float32]] : N metric values for each of mae, rmse, imae, irmse
+    '''
+
+    # Select valid regions to evaluate
+    mask = torch.logical_and(
+        validity_map > 0,
+        torch.logical_and(
+            ground_truth > min_evaluate_depth,
+            ground_truth < max_evaluate_depth))
+
+    n_valid = torch.sum(mask, dim=[1, 2, 3]).to(output_depth.dtype)
+
+    # Replace invalid regions by ones to avoid division by zero in inverse metrics
+    ones = torch.ones_like(ground_truth)
+    output_depth = torch.where(mask, output_depth, ones)
+    ground_truth = torch.where(mask, ground_truth, ones)
+
+    error = 1000.0 * output_depth - 1000.0 * ground_truth
+    inv_error = (1.0 / (0.001 * ground_truth)) - (1.0 / (0.001 * output_depth))
+
+    error = torch.where(mask, error, torch.zeros_like(error))
+    inv_error = torch.where(mask, inv_error, torch.zeros_like(inv_error))
+
+    return {
+        'mae': torch.sum(torch.abs(error), dim=[1, 2, 3]) / n_valid,
+        'rmse': torch.sqrt(torch.sum(error ** 2, dim=[1, 2, 3]) / n_valid),
+        'imae': torch.sum(torch.abs(inv_error), dim=[1, 2, 3]) / n_valid,
+        'irmse': torch.sqrt(torch.sum(inv_error ** 2, dim=[1, 2, 3]) / n_valid)
+    }
+
+
+class RunningMetrics(object):
+    '''
+    Accumulates per-sample metrics into running mean and standard deviation
+    on the device, so values only need to be copied to host once at the end
+
+    Arg(s):
+        names : list[str]
+            names of metrics to accumulate
+    '''
+
+    def __init__(self, names=['mae', 'rmse', 'imae', 'irmse']):
+
+        self.names = names
+        self.n_sample = 0
+        self.means = {}
+        self.sum_sq_diffs = {}
+
+    def update(self, metrics):
+        '''
+        Adds a batch of per-sample metrics using the parallel update of Chan et al.
+
+        Arg(s):
+            metrics : dict[str, torch.Tensor[float32]]
+                N values for each metric
+        '''
+
+        n_batch = metrics[self.names[0]].shape[0]
+
+        if n_batch == 0:
+            return
+
+        n_total = self.n_sample + n_batch
+
+        for name in self.names:
+            values = metrics[name].double()
+
+            mean_batch = torch.mean(values)
+            sum_sq_diff_batch = torch.sum((values - mean_batch) ** 2)
+
+            if self.n_sample == 0:
+                self.means[name] = mean_batch
+                self.sum_sq_diffs[name] = sum_sq_diff_batch
+            else:
+                delta = mean_batch - self.means[name]
+
+                self.means[name] = self.means[name] + delta * n_batch / n_total
+                self.sum_sq_diffs[name] = self.sum_sq_diffs[name] + sum_sq_diff_batch + \
+                    delta ** 2 * self.n_sample * n_batch / n_total
+
+        self.n_sample = n_total
+
+    def mean(self):
+        '''
+        Returns:
+            dict[str, float] : mean of each metric
+        '''
+
+        return {
+            name : self.means[name].item() if self.n_sample > 0 else np.nan
+            for name in self.names
+        }
+
+    def std(self):
+        '''
+        Returns:
+            dict[str, float] : (population) standard deviation of each metric
+        '''
+
+        return {
+            name : np.sqrt(self.sum_sq_diffs[name].item() / self.n_sample) if self.n_sample > 0 else np.nan
+            for name in self.names
+        }
@@ -24,6 +24,7 @@ EPSILON                                     = 1e-8
 N_BATCH                                     = 8
 N_HEIGHT                                    = 320
 N_WIDTH                                     = 768
+N_STEP_ACCUMULATE                           = 1
 
 # Input settings
 INPUT_TYPES                                 = ['image', 'sparse_depth', 'filtered_validity_map']
@@ -32,6 +33,7 @@ INPUT_CHANNELS_DEPTH                        = 2
 NORMALIZED_IMAGE_RANGE                      = [0, 1]
 OUTLIER_REMOVAL_KERNEL_SIZE                 = 7
 OUTLIER_REMOVAL_THRESHOLD                   = 1.5
+CODEC                                       = 'pil'
 
 # Sparse to dense pool settings
 MIN_POOL_SIZES_SPARSE_TO_DENSE_POOL         = [5, 7, 9, 11, 13]
@@ -73,6 +75,9 @@ AUGMENTATION_RANDOM_BRIGHTNESS              = [-1]
 AUGMENTATION_RANDOM_CONTRAST                = [-1]
 AUGMENTATION_RANDOM_SATURATION              = [-1]
 
+# Precomputed teacher selection maps only allow mild photometric augmentation
+TEACHER_SELECTION_MAP_MAX_PHOTOMETRIC_DEVIATION = 0.10
+
 # Loss function settings
 W_STEREO                                    = 1.00
 W_MONOCULAR                                 = 1.00
@@ -89,10 +94,16 @@ W_WEIGHT_DECAY_POSE                         = 0.00
 LOSS_FUNC_ENSEMBLE_DEPTH                    = 'l1'
 EPOCH_POSE_FOR_ENSEMBLE                     = 10
 ENSEMBLE_METHOD                             = 'mondi'
+ENSEMBLE_TOP_K                              = 0
+ENSEMBLE_SCALE                              = 1.0
+ENSEMBLE_UPSAMPLE_MODE                      = 'nearest'
+ENSEMBLE_UPSAMPLE_MODE_AVAILABLE            = ['nearest', 'bilinear']
 
 # Evaluation settings
 MIN_EVALUATE_DEPTH                          = 0.00
 MAX_EVALUATE_DEPTH                          = 100.0
+N_BATCH_EVALUATE                            = 1
+N_THREAD_EVALUATE                           = 1
 
 # Checkpoint settings
 CHECKPOINT_PATH                             = 'trained_kbnet'
@@ -108,4 +119,8 @@ CPU                                         = 'cpu'
 GPU                                         = 'gpu'
 DEVICE                                      = 'cuda'
 DEVICE_AVAILABLE                            = [CPU, CUDA, GPU]
+MIXED_PRECISION                             = 'none'
+MIXED_PRECISION_AVAILABLE                   = ['none', 'fp16', 'bf16']
 N_THREAD                                    = 8
+PREFETCH_FACTOR                             = 2
+N_THREAD_OUTPUT                             = 4
@@ -20,6 +20,7 @@ https://arxiv.org/abs/2203.16034
 
 import torch
 import random
+import net_utils
 
 
 '''
@@ -54,7 +55,7 @@ def color_consistency_loss_func(src, tgt, w=None, reduce_loss=True):
     else:
         return loss.unsqueeze(1)
 
-def structural_consistency_loss_func(src, tgt, w=None, reduce_loss=True):
+def structural_consistency_loss_func(src, tgt, w=None, reduce_loss=True, src_statistics=None):
     '''
     Computes the structural consistency loss using SSIM
 
@@ -62,11 +63,15 @@ def structural_consistency_loss_func(src, tgt, w=None, reduce_loss=True):
         src : torch.Tensor[float32]
             N x 3 x H x W source image
         tgt : torch.Tensor[float32]
-            N x 3 x H x W target image
+            N x 3 x H x W target image or (K x N) x 3 x H x W target images,
+            ordered K-major, to compare against the same source image
         w : torch.Tensor[float32]
             N x 3 x H x W weights
         reduce_loss : bool
             if set then return mean over loss
+        src_statistics : tuple[torch.Tensor[float32]]
+            statistics of source image from structural_consistency_statistics,
+            if None then they are computed from src
     Returns:
         Either
         (1) [reduce_loss=True] torch.Tensor[float32] : mean absolute difference between source and target images
@@ -74,13 +79,13 @@ def structural_consistency_loss_func(src, tgt, w=None, reduce_loss=True):
     '''
 
     if w is None:
-        w = torch.ones_like(src)
+        w = torch.ones_like(tgt)
 
-    refl = torch.nn.ReflectionPad2d(1)
+    if src_statistics is None:
+        src_statistics = structural_consistency_statistics(src)
 
-    src = refl(src)
-    tgt = refl(tgt)
-    scores = ssim(src, tgt)
+    tgt = torch.nn.functional.pad(tgt, (1, 1, 1, 1), mode='reflect')
+    scores = ssim(None, tgt, x_statistics=src_statistics)
 
     loss = torch.sum(w * scores, dim=1)
 
@@ -89,6 +94,70 @@ def structural_consistency_loss_func(src, tgt, w=None, reduce_loss=True):
     else:
         return loss.unsqueeze(1)
 
+def structural_consistency_statistics(src):
+    '''
+    Computes SSIM statistics of the reflection padded source image so that they
+    can be reused when comparing the same source image against many target images
+
+    Arg(s):
+        src : torch.Tensor[float32]
+            N x 3 x H x W source image
+    Returns:
+        tuple[torch.Tensor[float32]] : statistics of source image (see ssim_statistics)
+    '''
+
+    return ssim_statistics(torch.nn.functional.pad(src, (1, 1, 1, 1), mode='reflect'))
+
+def photometric_consistency_loss_func(src, tgt, w=None, reduce_loss=True, src_statistics=None):
+    '''
+    Computes the color and structural consistency losses in a single pass over
+    the target image
+
+    Arg(s):
+        src : torch.Tensor[float32]
+            N x 3 x H x W source image
+        tgt : torch.Tensor[float32]
+            N x 3 x H x W target image or (K x N) x 3 x H x W target images,
+            ordered K-major, to compare against the same source image
+        w : torch.Tensor[float32]
+            N x 1 x H x W weights
+        reduce_loss : bool
+            if set then return mean over loss
+        src_statistics : tuple[torch.Tensor[float32]]
+            statistics of source image from structural_consistency_statistics,
+            if None then they are computed from src
+    Returns:
+        Either
+        (1) [reduce_loss=True] torch.Tensor[float32] : mean color and mean structural consistency loss
+        (2) [reduce_loss=False] torch.Tensor[float32] : color and structural consistency loss, each N x 1 x H x W
+    '''
+
+    if w is None:
+        w = torch.ones_like(tgt[:, 0:1, ...])
+
+    if src_statistics is None:
+        src_statistics = structural_consistency_statistics(src)
+
+    # Unpadded source image is the center of the padded source image
+    src = src_statistics[0][..., 1:-1, 1:-1]
+
+    n_batch, n_channel, n_height, n_width = src.shape
+
+    delta = torch.abs(
+        tgt.reshape(-1, n_batch, n_channel, n_height, n_width) - src.unsqueeze(0))
+    delta = delta.reshape(tgt.shape)
+
+    tgt = torch.nn.functional.pad(tgt, (1, 1, 1, 1), mode='reflect')
+    scores = ssim(None, tgt, x_statistics=src_statistics)
+
+    loss_color = torch.sum(w * delta, dim=1, keepdim=True)
+    loss_structure = torch.sum(w * scores, dim=1, keepdim=True)
+
+    if reduce_loss:
+        return torch.mean(loss_color), torch.mean(loss_structure)
+    else:
+        return loss_color, loss_structure
+
 def sparse_depth_consistency_loss_func(src, tgt, w=None):
     '''
     Computes the sparse depth consistency loss
@@ -149,8 +218,8 @@ def aggregate_teacher_output(losses0x, teacher_output0):
     Combines ensemble of teacher output
 
     Arg(s):
-        losses0x : list[torch.Tensor[float32]]
-            list[N x 1 x H x W] losses for each teacher
+        losses0x : torch.Tensor[float32] or list[torch.Tensor[float32]]
+            N x M x H x W or list[N x 1 x H x W] losses for each teacher
         teacher_output0 : torch.Tensor[float32]
             N x M x H x W teacher output from ensemble of M teachers
     Returns:
@@ -159,7 +228,6 @@ def aggregate_teacher_output(losses0x, teacher_output0):
         torch.Tensor[float32] : N x 1 x H x W teacher id (index) for each prediction that minimize loss
     '''
 
-    device = teacher_output0.device
     N, M, H, W = teacher_output0.shape
 
     if len(losses0x) == 0:
@@ -169,25 +237,14 @@ def aggregate_teacher_output(losses0x, teacher_output0):
 
         return agg_teacher_output0, torch.zeros_like(agg_teacher_output0) + 0.05, None
 
-    losses0x_selection = losses0x
-
-    agg_teacher_output = torch.zeros((N, 1, H, W)).to(device)
-    teacher_output_loss = torch.zeros((N, 1, H, W)).to(device)
-    losses0x_selection = torch.stack(losses0x_selection, dim=0)
-
-    # Select teachers based on ones that minimize losses
-    _, teacher_idxs = torch.min(losses0x_selection, dim=0)
-
-    for i in range(M):
-        teacher_output_i = teacher_output0[:, i:i+1]
+    if isinstance(losses0x, list):
+        losses0x = torch.cat(losses0x, dim=1)
 
-        # Take loss from original
-        teacher_output_loss_i = losses0x[i]
+    # Select teachers based on ones that minimize losses, minimum is the loss of selected teacher
+    teacher_output_loss, teacher_idxs = torch.min(losses0x, dim=1, keepdim=True)
 
-        # Create a mask to mask out anything that isn't from selected and insert into output
-        teacher_mask = teacher_idxs == i
-        agg_teacher_output += teacher_output_i * teacher_mask
-        teacher_output_loss += teacher_output_loss_i * teacher_mask
+    # Take the prediction of the selected teacher for each pixel
+    agg_teacher_output = torch.gather(teacher_output0, dim=1, index=teacher_idxs)
 
     return agg_teacher_output, teacher_output_loss, teacher_idxs
 
@@ -281,15 +338,40 @@ def gradient_yx(T):
     dy = T[:, :, :-1, :] - T[:, :, 1:, :]
     return dy, dx
 
-def ssim(x, y):
+@net_utils.autocast_float32
+def ssim_statistics(x):
+    '''
+    Computes local statistics of an image used by SSIM
+
+    Arg(s):
+        x : torch.Tensor[float32]
+            N x C x H x W image
+    Returns:
+        torch.Tensor[float32] : N x C x H x W image
+        torch.Tensor[float32] : N x C x (H - 2) x (W - 2) local mean
+        torch.Tensor[float32] : N x C x (H - 2) x (W - 2) squared local mean
+        torch.Tensor[float32] : N x C x (H - 2) x (W - 2) local variance
+    '''
+
+    mu_x = torch.nn.functional.avg_pool2d(x, 3, 1)
+    mu_xx = mu_x ** 2
+    sigma_x = torch.nn.functional.avg_pool2d(x ** 2, 3, 1) - mu_xx
+
+    return x, mu_x, mu_xx, sigma_x
+
+@net_utils.autocast_float32
+def ssim(x, y, x_statistics=None):
     '''
     Computes Structural Similarity Index distance between two images
 
     Arg(s):
         x : torch.Tensor[float32]
-            N x 3 x H x W RGB image
+            N x 3 x H x W RGB image, unused if x_statistics is given
         y : torch.Tensor[float32]
-            N x 3 x H x W RGB image
+            N x 3 x H x W RGB image or (K x N) x 3 x H x W RGB images,
+            ordered K-major, to compare against the same image x
+        x_statistics : tuple[torch.Tensor[float32]]
+            precomputed statistics of x from ssim_statistics
     Returns:
         torch.Tensor[float32] : SSIM distance between two images
     '''
@@ -297,19 +379,30 @@ def ssim(x, y):
     C1 = 0.01 ** 2
     C2 = 0.03 ** 2
 
-    mu_x = torch.nn.AvgPool2d(3, 1)(x)
-    mu_y = torch.nn.AvgPool2d(3, 1)(y)
-    mu_xy = mu_x * mu_y
-    mu_xx = mu_x ** 2
+    if x_statistics is None:
+        x_statistics = ssim_statistics(x)
+
+    x, mu_x, mu_xx, sigma_x = x_statistics
+
+    # Broadcast statistics of x across the K images in y
+    n_batch = x.shape[0]
+
+    def unfold(T):
+        return T.reshape(-1, n_batch, *T.shape[1:])
+
+    mu_y = torch.nn.functional.avg_pool2d(y, 3, 1)
     mu_yy = mu_y ** 2
+    sigma_y = torch.nn.functional.avg_pool2d(y ** 2, 3, 1) - mu_yy
+
+    xy = (x.unsqueeze(0) * unfold(y)).reshape(y.shape)
 
-    sigma_x = torch.nn.AvgPool2d(3, 1)(x ** 2) - mu_xx
-    sigma_y = torch.nn.AvgPool2d(3, 1)(y ** 2) - mu_yy
-    sigma_xy = torch.nn.AvgPool2d(3, 1)(x * y) - mu_xy
+    mu_xy = mu_x.unsqueeze(0) * unfold(mu_y)
+    sigma_xy = unfold(torch.nn.functional.avg_pool2d(xy, 3, 1)) - mu_xy
 
-    numer = (2 * mu_xy + C1)*(2 * sigma_xy + C2)
-    denom = (mu_xx + mu_yy + C1) * (sigma_x + sigma_y + C2)
-    score = numer / denom
+    numer = (2 * mu_xy + C1) * (2 * sigma_xy + C2)
+    denom = (mu_xx.unsqueeze(0) + unfold(mu_yy) + C1) * \
+        (sigma_x.unsqueeze(0) + unfold(sigma_y) + C2)
+    score = (numer / denom).reshape(mu_y.shape)
 
     return torch.clamp((1.0 - score) / 2.0, 0.0, 1.0)
 
@@ -317,6 +410,116 @@ def ssim(x, y):
 '''
 Rigid warping functions
 '''
+class Warp1dHorizontal(torch.autograd.Function):
+    '''
+    Row-wise linear interpolation along x for rectified stereo warping. Samples the
+    same locations as bilinear grid_sample with align_corners=True on a flow field
+    of x + disparity / W, without building the flow field or interpolating along y
+    '''
+
+    @staticmethod
+    def forward(ctx, image, disparity, padding_mode='border'):
+        '''
+        Arg(s):
+            image : torch.Tensor[float32]
+                N x C x H x W image
+            disparity : torch.Tensor[float32]
+                N x 1 x H x W disparity
+            padding_mode : str
+                border, zeros
+        Returns:
+            torch.Tensor[float32] : N x C x H x W warped image
+        '''
+
+        if padding_mode not in ['border', 'zeros']:
+            raise ValueError('Unsupported padding mode: {}'.format(padding_mode))
+
+        n_batch, n_channel, n_height, n_width = image.shape
+        device = image.device
+
+        # Pixel x coordinates: 1 x 1 x 1 x W
+        x = net_utils.get_cached_grid(
+            ('warp1d_horizontal', n_width, str(device), image.dtype),
+            lambda: torch.arange(n_width, dtype=image.dtype, device=device).view(1, 1, 1, n_width))
+
+        # Normalized shift of disparity / W spans W - 1 pixels with align_corners=True
+        scale = (n_width - 1) / n_width
+        x = x + scale * disparity
+
+        if padding_mode == 'border':
+            # Clipped coordinates do not receive gradients
+            inside = ((x > 0) & (x < n_width - 1)).to(image.dtype)
+            x = torch.clamp(x, 0, n_width - 1)
+
+        x0 = torch.floor(x)
+        weight1 = x - x0
+        weight0 = 1.0 - weight1
+
+        x0 = x0.long()
+        x1 = x0 + 1
+
+        if padding_mode == 'zeros':
+            # Neighbors outside of the image are sampled as zeros
+            valid0 = ((x0 >= 0) & (x0 <= n_width - 1)).to(image.dtype)
+            valid1 = ((x1 >= 0) & (x1 <= n_width - 1)).to(image.dtype)
+
+            weight0 = valid0 * weight0
+            weight1 = valid1 * weight1
+            slope0 = valid0
+            slope1 = valid1
+        else:
+            slope0 = inside
+            slope1 = inside
+
+        x0 = torch.clamp(x0, 0, n_width - 1)
+        x1 = torch.clamp(x1, 0, n_width - 1)
+
+        shape = (n_batch, n_channel, n_height, n_width)
+
+        output = \
+            weight0 * torch.gather(image, 3, x0.expand(shape)) + \
+            weight1 * torch.gather(image, 3, x1.expand(shape))
+
+        ctx.scale = scale
+        ctx.save_for_backward(image, x0, x1, weight0, weight1, slope0, slope1)
+
+        return output
+
+    @staticmethod
+    @torch.autograd.function.once_differentiable
+    def backward(ctx, grad_output):
+        '''
+        Arg(s):
+            grad_output : torch.Tensor[float32]
+                N x C x H x W gradient with respect to warped image
+        Returns:
+            torch.Tensor[float32] : N x C x H x W gradient with respect to image
+            torch.Tensor[float32] : N x 1 x H x W gradient with respect to disparity
+            None : padding mode is not differentiable
+        '''
+
+        image, x0, x1, weight0, weight1, slope0, slope1 = ctx.saved_tensors
+
+        shape = grad_output.shape
+        grad_image = None
+        grad_disparity = None
+
+        if ctx.needs_input_grad[0]:
+            grad_image = torch.zeros_like(image)
+            grad_image.scatter_add_(3, x0.expand(shape), weight0 * grad_output)
+            grad_image.scatter_add_(3, x1.expand(shape), weight1 * grad_output)
+
+        if ctx.needs_input_grad[1]:
+            # Derivative of linear interpolation with respect to x is the difference of neighbors
+            dx = \
+                slope1 * torch.gather(image, 3, x1.expand(shape)) - \
+                slope0 * torch.gather(image, 3, x0.expand(shape))
+
+            grad_disparity = ctx.scale * torch.sum(grad_output * dx, dim=1, keepdim=True)
+
+        return grad_image, grad_disparity, None
+
+@net_utils.autocast_float32
 def warp1d_horizontal(image, disparity, padding_mode='border'):
     '''
     Performs horizontal 1d warping
@@ -326,28 +529,13 @@ def warp1d_horizontal(image, disparity, padding_mode='border'):
             N x C x H x W image
         disparity : torch.Tensor[float32]
             N x 1 x H x W disparity
+        padding_mode : str
+            border, zeros
+    Returns:
+        torch.Tensor[float32] : N x C x H x W warped image
     '''
 
-    n_batch, _, n_height, n_width = image.shape
-
-    # Original coordinates of pixels
-    x = torch.linspace(0, 1, n_width, dtype=torch.float32, device=image.device) \
-        .repeat(n_batch, n_height, 1)
-    y = torch.linspace(0, 1, n_height, dtype=torch.float32, device=image.device) \
-        .repeat(n_batch, n_width, 1) \
-        .transpose(1, 2)
-
-    # Apply shift in X direction
-    dx = disparity[:, 0, :, :] / n_width  # Disparity is passed in NCHW format with 1 channel
-    flow_field = torch.stack((x + dx, y), dim=3)
-
-    # In grid_sample coordinates are assumed to be between -1 and 1
-    return torch.nn.functional.grid_sample(
-        image,
-        grid=(2 * flow_field - 1),
-        mode='bilinear',
-        padding_mode=padding_mode,
-        align_corners=True)
+    return Warp1dHorizontal.apply(image, disparity, padding_mode)
 
 def rigid_warp(image1, depth0, pose01, intrinsics, shape):
     '''
@@ -377,7 +565,9 @@ Utility functions for rigid warping
 '''
 def meshgrid(n_batch, n_height, n_width, device, homogeneous=True):
     '''
-    Creates N x 2 x H x W meshgrid in x, y directions
+    Creates N x 2 x H x W meshgrid in x, y directions. Grids are shared with
+    net_utils.meshgrid through its cache so the returned tensor must not be
+    modified in place
 
     Arg(s):
         n_batch : int
@@ -394,25 +584,15 @@ def meshgrid(n_batch, n_height, n_width, device, homogeneous=True):
         torch.Tensor[float32]: N x 2 x H x W meshgrid of x, y and 1 (if homogeneous)
     '''
 
-    x = torch.linspace(start=0.0, end=n_width-1, steps=n_width, device=device)
-    y = torch.linspace(start=0.0, end=n_height-1, steps=n_height, device=device)
-
-    # Create H x W grids
-    grid_y, grid_x = torch.meshgrid(y, x)
+    return net_utils.meshgrid(
+        n_batch=n_batch,
+        n_height=n_height,
+        n_width=n_width,
+        device=device,
+        homogeneous=homogeneous)
 
-    if homogeneous:
-        # Create 3 x H x W grid (x, y, 1)
-        grid_xy = torch.stack([grid_x, grid_y, torch.ones_like(grid_x)], dim=0)
-    else:
-        # Create 2 x H x W grid (x, y)
-        grid_xy = torch.stack([grid_x, grid_y], dim=0)
-
-    grid_xy = torch.unsqueeze(grid_xy, dim=0) \
-        .repeat(n_batch, 1, 1, 1)
-
-    return grid_xy
-
-def backproject_to_camera(depth, intrinsics, shape):
+@net_utils.autocast_float32
+def backproject_to_camera(depth, intrinsics, shape, intrinsics_inverse=None):
     '''
     Backprojects pixel coordinates to 3D camera coordinates
 
@@ -423,6 +603,8 @@ def backproject_to_camera(depth, intrinsics, shape):
             N x 3 x 3 camera intrinsics
         shape : list[int]
             shape of tensor in (N, C, H, W)
+        intrinsics_inverse : torch.Tensor[float32]
+            N x 3 x 3 inverse of camera intrinsics, if given then reused instead of inverting intrinsics
     Return:
         torch.Tensor[float32] : N x 4 x (H x W)
     '''
@@ -438,12 +620,16 @@ def backproject_to_camera(depth, intrinsics, shape):
     # Reshape depth as N x 1 x (H x W)
     depth = depth.view(n_batch, 1, -1)
 
+    if intrinsics_inverse is None:
+        intrinsics_inverse = torch.inverse(intrinsics)
+
     # K^-1 [x, y, 1] z
-    points = torch.matmul(torch.inverse(intrinsics), xy_h) * depth
+    points = torch.matmul(intrinsics_inverse, xy_h) * depth
 
     # Make homogeneous
     return torch.cat([points, torch.ones_like(depth)], dim=1)
 
+@net_utils.autocast_float32
 def project_to_pixel(points, pose, intrinsics, shape):
     '''
     Projects points in camera coordinates to 2D pixel coordinates
@@ -481,6 +667,7 @@ def project_to_pixel(points, pose, intrinsics, shape):
     # Reshape to N x 2 x H x W
     return points.view(n_batch, 2, n_height, n_width)
 
+@net_utils.autocast_float32
 def grid_sample(image, target_xy, shape, padding_mode='border'):
     '''
     Samples the image at x, y locations to target x, y locations
@@ -566,9 +753,9 @@ def dilate_sparse_depth(sparse_depth, dilation_kernel_size):
 
     return dilated_sparse_depth, dilated_validity_map
 
-def sparse_depth_error_weight(sparse_depth, dilation_kernel_size, teacher_outputs, w_sparse_error=1):
+def sparse_depth_error(sparse_depth, dilation_kernel_size, teacher_outputs):
     '''
-    Given sparse depth, return tensor or integer evaluating teacher predictions against sparse depth
+    Given sparse depth, return mean relative error of each teacher prediction against dilated sparse depth
 
     Arg(s):
         sparse_depth : torch.Tensor[float32]
@@ -577,10 +764,8 @@ def sparse_depth_error_weight(sparse_depth, dilation_kernel_size, teacher_output
             Odd number of how large of a window to repeat sparse depth values
         teacher_outputs : torch.Tensor[float32]
             N x M x H x W teacher output from ensemble of M teachers for left image
-        w_sparse_error : float
-            weight of sparse depth error. Default value is 1
     Returns:
-        torch.Tensor : N x M x H x W tensor evaluating each teacher compared to dilated sparse depth
+        torch.Tensor : N x M x 1 x 1 tensor of error of each teacher compared to dilated sparse depth
     '''
 
     # Obtain dilated sparse depth
@@ -604,8 +789,70 @@ def sparse_depth_error_weight(sparse_depth, dilation_kernel_size, teacher_output
     # Normalize error
     error[dilated_validity_map > 0] /= dilated_sparse_depth[dilated_validity_map > 0]
 
+    return torch.mean(error, dim=[2, 3], keepdim=True)
+
+def sparse_depth_error_weight(sparse_depth, dilation_kernel_size, teacher_outputs, w_sparse_error=1):
+    '''
+    Given sparse depth, return tensor or integer evaluating teacher predictions against sparse depth
+
+    Arg(s):
+        sparse_depth : torch.Tensor[float32]
+            N x 1 x H x W sparse depth tensor
+        dilation_kernel_size : int
+            Odd number of how large of a window to repeat sparse depth values
+        teacher_outputs : torch.Tensor[float32]
+            N x M x H x W teacher output from ensemble of M teachers for left image
+        w_sparse_error : float
+            weight of sparse depth error. Default value is 1
+    Returns:
+        torch.Tensor : N x M x H x W tensor evaluating each teacher compared to dilated sparse depth
+    '''
+
+    error = sparse_depth_error(sparse_depth, dilation_kernel_size, teacher_outputs)
+
     # If is_global, then take sum of errors
-    ones = torch.ones_like(error)
-    error = ones * torch.mean(error, dim=[2, 3], keepdim=True)
+    error = error.expand_as(teacher_outputs)
 
     return 1 - torch.exp(-w_sparse_error * error)
+
+def select_top_k_teachers(sparse_depth, dilation_kernel_size, teacher_outputs, k):
+    '''
+    Ranks teachers of each sample by their error against dilated sparse depth, which
+    is cheap compared to photometric reprojection, and keeps the k teachers with least error
+
+    Arg(s):
+        sparse_depth : torch.Tensor[float32]
+            N x 1 x H x W sparse depth tensor
+        dilation_kernel_size : int
+            Odd number of how large of a window to repeat sparse depth values
+        teacher_outputs : torch.Tensor[float32]
+            N x M x H x W teacher output from ensemble of M teachers for left image
+        k : int
+            number of teachers to keep for each sample
+    Returns:
+        torch.Tensor[int64] : N x k x 1 x 1 indices of kept teachers, ordered from least error
+    '''
+
+    error = sparse_depth_error(sparse_depth, dilation_kernel_size, teacher_outputs)
+
+    _, teacher_idxs = torch.topk(error, k=k, dim=1, largest=False, sorted=True)
+
+    return teacher_idxs
+
+def gather_teachers(T, teacher_idxs):
+    '''
+    Selects a subset of teachers for each sample
+
+    Arg(s):
+        T : torch.Tensor
+            N x M x H x W tensor with one channel per teacher
+        teacher_idxs : torch.Tensor[int64]
+            N x K x 1 x 1 or N x K x H x W indices of teachers to select
+    Returns:
+        torch.Tensor : N x K x H x W tensor of selected teachers
+    '''
+
+    N, _, H, W = T.shape
+    K = teacher_idxs.shape[1]
+
+    return torch.gather(T, dim=1, index=teacher_idxs.expand(N, K, H, W))
@@ -23,12 +23,12 @@ import numpy as np
 import torch
 from torch.utils.tensorboard import SummaryWriter
 import datasets, data_utils, eval_utils
+import global_constants as settings
 from log_utils import log
 from mondi_model import MonitoredDistillationModel
 from posenet_model import PoseNetModel
 from transforms import Transforms
-from net_utils import OutlierRemoval
-from PIL import Image
+from net_utils import OutlierRemoval, autocast
 
 
 def train(train_image0_path,
@@ -43,21 +43,29 @@ def train(train_image0_path,
           train_focal_length_baseline1_path,
           train_ground_truth0_path,
           train_ground_truth1_path,
+          train_teacher_selection_map0_path,
+          train_teacher_selection_map1_path,
           val_image_path,
           val_sparse_depth_path,
           val_intrinsics_path,
           val_ground_truth_path,
+          train_cache_path,
           # Batch settings
           n_batch,
           n_height,
           n_width,
+          n_step_accumulate,
           # Input settings
           input_types,
           input_channels_image,
           input_channels_depth,
           normalized_image_range,
+          load_compact_inputs,
+          load_sparse_depth_points,
+          codec,
           outlier_removal_kernel_size,
           outlier_removal_threshold,
+          outlier_removal_sparse_aware,
           # Sparse to dense pool settings
           min_pool_sizes_sparse_to_dense_pool,
           max_pool_sizes_sparse_to_dense_pool,
@@ -110,9 +118,14 @@ def train(train_image0_path,
           loss_func_ensemble_depth,
           epoch_pose_for_ensemble,
           ensemble_method,
+          ensemble_top_k,
+          ensemble_scale,
+          ensemble_upsample_mode,
           # Evaluation settings
           min_evaluate_depth,
           max_evaluate_depth,
+          n_batch_val,
+          n_thread_val,
           # Checkpoint settings
           checkpoint_path,
           n_checkpoint,
@@ -123,6 +136,7 @@ def train(train_image0_path,
           pose_model_restore_path,
           # Hardware settings
           device='cuda',
+          mixed_precision='none',
           n_thread=6):
 
     # Select device to run on
@@ -133,6 +147,22 @@ def train(train_image0_path,
     else:
         raise ValueError('Unsupported device: {}'.format(device))
 
+    if mixed_precision not in settings.MIXED_PRECISION_AVAILABLE:
+        raise ValueError('Unsupported mixed precision: {}'.format(mixed_precision))
+
+    if mixed_precision == 'fp16' and device.type != 'cuda':
+        raise ValueError('Mixed precision fp16 requires CUDA, use bf16 on {}'.format(device.type))
+
+    if mixed_precision != 'none' and not hasattr(torch, 'autocast'):
+        raise ValueError('Mixed precision {} requires PyTorch 1.10 or newer, found {}'.format(
+            mixed_precision, torch.__version__))
+
+    if ensemble_scale <= 0 or ensemble_scale > 1:
+        raise ValueError('Ensemble scale must be in (0, 1]: {}'.format(ensemble_scale))
+
+    if ensemble_upsample_mode not in settings.ENSEMBLE_UPSAMPLE_MODE_AVAILABLE:
+        raise ValueError('Unsupported ensemble upsample mode: {}'.format(ensemble_upsample_mode))
+
     # Set up checkpoint and event paths
     if not os.path.exists(checkpoint_path):
         os.makedirs(checkpoint_path)
@@ -236,6 +266,52 @@ def train(train_image0_path,
         train_ensemble_teacher_output0_paths + \
         train_ensemble_teacher_output1_paths
 
+    # Read precomputed stereo teacher selection maps if given
+    use_teacher_selection_maps = train_teacher_selection_map0_path is not None
+
+    if use_teacher_selection_maps:
+        if 'stereo' not in supervision_types or not stereo_available:
+            raise ValueError('Teacher selection maps require stereo supervision')
+
+        if train_cache_path is not None:
+            raise ValueError('Teacher selection maps are not supported with training cache')
+
+        # Maps are computed on unaugmented images so photometric augmentation must be off or mild
+        max_photometric_deviation = 0.0
+
+        for name, factor_range in [('brightness', augmentation_random_brightness),
+                                   ('contrast', augmentation_random_contrast),
+                                   ('saturation', augmentation_random_saturation)]:
+
+            if -1 in factor_range:
+                continue
+
+            deviation = max([abs(factor - 1.0) for factor in factor_range])
+
+            if deviation > settings.TEACHER_SELECTION_MAP_MAX_PHOTOMETRIC_DEVIATION:
+                raise ValueError(
+                    'Teacher selection maps are computed on unaugmented images, ' +
+                    'random {} range {} deviates from 1 by more than {}'.format(
+                        name, factor_range, settings.TEACHER_SELECTION_MAP_MAX_PHOTOMETRIC_DEVIATION))
+
+            max_photometric_deviation = max(max_photometric_deviation, deviation)
+
+        train_teacher_selection_map0_paths = \
+            data_utils.read_paths(train_teacher_selection_map0_path)
+
+        input_paths.append(train_teacher_selection_map0_paths)
+
+        if train_teacher_selection_map1_path is not None:
+            train_teacher_selection_map1_paths = \
+                data_utils.read_paths(train_teacher_selection_map1_path)
+
+            input_paths.append(train_teacher_selection_map1_paths)
+        else:
+            train_teacher_selection_map1_paths = None
+    else:
+        train_teacher_selection_map0_paths = None
+        train_teacher_selection_map1_paths = None
+
     for paths in input_paths:
         assert len(paths) == n_train_sample
 
@@ -245,12 +321,29 @@ def train(train_image0_path,
 
     assert learning_schedule_depth[-1] == learning_schedule_pose[-1]
 
-    # Set up training dataloader
+    assert n_step_accumulate > 0
+
+    # Set up training dataloader, each step accumulates gradients over n_step_accumulate batches
+    n_train_batch_per_epoch = np.ceil(n_train_sample / n_batch).astype(np.int32)
+
     n_train_step = \
-        learning_schedule_depth[-1] * np.ceil(n_train_sample / n_batch).astype(np.int32)
+        learning_schedule_depth[-1] * np.ceil(n_train_batch_per_epoch / n_step_accumulate).astype(np.int32)
 
-    train_dataloader = torch.utils.data.DataLoader(
-        datasets.MonitoredDistillationTrainingDataset(
+    if train_cache_path is not None:
+        # Read pre-decoded samples from memory-mapped arrays instead of image files
+        train_dataset = datasets.MonitoredDistillationTrainingCacheDataset(
+            cache_dirpath=train_cache_path,
+            random_crop_shape=(n_height, n_width),
+            random_crop_type=augmentation_random_crop_type,
+            random_swap=augmentation_random_swap,
+            load_compact=load_compact_inputs,
+            load_temporal_frames='monocular' in supervision_types,
+            load_sparse_depth_points=load_sparse_depth_points)
+
+        assert len(train_dataset) == n_train_sample, \
+            'Number of samples in training cache does not match number of training paths.'
+    else:
+        train_dataset = datasets.MonitoredDistillationTrainingDataset(
             image0_paths=train_image0_paths,
             image1_paths=train_image1_paths,
             sparse_depth0_paths=train_sparse_depth0_paths,
@@ -265,11 +358,21 @@ def train(train_image0_path,
             focal_length_baseline1_paths=train_focal_length_baseline1_paths,
             random_crop_shape=(n_height, n_width),
             random_crop_type=augmentation_random_crop_type,
-            random_swap=augmentation_random_swap),
+            random_swap=augmentation_random_swap,
+            load_compact=load_compact_inputs,
+            load_temporal_frames='monocular' in supervision_types,
+            codec=codec,
+            load_sparse_depth_points=load_sparse_depth_points,
+            teacher_selection_map0_paths=train_teacher_selection_map0_paths,
+            teacher_selection_map1_paths=train_teacher_selection_map1_paths)
+
+    train_dataloader = torch.utils.data.DataLoader(
+        train_dataset,
         batch_size=n_batch,
         shuffle=True,
         num_workers=n_thread,
-        drop_last=False)
+        drop_last=False,
+        collate_fn=train_dataset.collate_fn)
 
     train_transforms = Transforms(
         normalized_image_range=normalized_image_range,
@@ -296,21 +399,26 @@ def train(train_image0_path,
         for paths in [val_sparse_depth_paths, val_intrinsics_paths, val_ground_truth_paths]:
             assert len(paths) == n_val_sample
 
-        ground_truths = []
-        for path in val_ground_truth_paths:
-            ground_truth, validity_map = data_utils.load_depth_with_validity_map(path)
-            ground_truths.append(np.stack([ground_truth, validity_map], axis=-1))
+        # Ground truth is streamed with inputs as raw 16-bit values
+        val_dataset = datasets.DepthCompletionInferenceDataset(
+            image_paths=val_image_paths,
+            sparse_depth_paths=val_sparse_depth_paths,
+            intrinsics_paths=val_intrinsics_paths,
+            load_image_triplets=False,
+            ground_truth_paths=val_ground_truth_paths,
+            load_compact_ground_truth=True,
+            load_compact=load_compact_inputs,
+            codec=codec,
+            load_sparse_depth_points=load_sparse_depth_points)
 
         val_dataloader = torch.utils.data.DataLoader(
-            datasets.DepthCompletionInferenceDataset(
-                image_paths=val_image_paths,
-                sparse_depth_paths=val_sparse_depth_paths,
-                intrinsics_paths=val_intrinsics_paths,
-                load_image_triplets=False),
-            batch_size=1,
+            val_dataset,
+            batch_size=n_batch_val,
             shuffle=False,
-            num_workers=1,
-            drop_last=False)
+            num_workers=n_thread_val,
+            drop_last=False,
+            pin_memory=device.type == 'cuda',
+            collate_fn=val_dataset.collate_fn)
 
         val_transforms = Transforms(
             normalized_image_range=normalized_image_range)
@@ -318,7 +426,8 @@ def train(train_image0_path,
     # Initialize outlier removal for sparse depth
     outlier_removal = OutlierRemoval(
         kernel_size=outlier_removal_kernel_size,
-        threshold=outlier_removal_threshold)
+        threshold=outlier_removal_threshold,
+        sparse_aware=outlier_removal_sparse_aware)
 
     '''
     Set up the model
@@ -402,10 +511,32 @@ def train(train_image0_path,
         train_input_paths = train_input_paths + \
             train_teacher_output0_paths
 
+    if use_teacher_selection_maps:
+        train_input_paths = train_input_paths + [
+            path
+            for path in [train_teacher_selection_map0_path, train_teacher_selection_map1_path]
+            if path is not None
+        ]
+
     for path in train_input_paths:
         log(path, log_path)
     log('', log_path)
 
+    if use_teacher_selection_maps:
+        if max_photometric_deviation == 0:
+            log('Teacher selection maps: photometric augmentation is off', log_path)
+        else:
+            log('Teacher selection maps: photometric augmentation is mild, ' +
+                'factors deviate from 1 by at most {:.2f} (limit {:.2f})'.format(
+                    max_photometric_deviation, settings.TEACHER_SELECTION_MAP_MAX_PHOTOMETRIC_DEVIATION),
+                log_path)
+        log('', log_path)
+
+    if train_cache_path is not None:
+        log('Training cache path:', log_path)
+        log(train_cache_path, log_path)
+        log('', log_path)
+
     log('Validation input paths:', log_path)
     val_input_paths = [
         val_image_path,
@@ -423,6 +554,7 @@ def train(train_image0_path,
         n_batch=n_batch,
         n_height=n_height,
         n_width=n_width,
+        n_step_accumulate=n_step_accumulate,
         # Input settings
         input_types=input_types,
         input_channels_image=input_channels_image,
@@ -496,12 +628,16 @@ def train(train_image0_path,
         w_weight_decay_pose=w_weight_decay_pose,
         loss_func_ensemble_depth=loss_func_ensemble_depth,
         epoch_pose_for_ensemble=epoch_pose_for_ensemble,
-        ensemble_method=ensemble_method)
+        ensemble_method=ensemble_method,
+        ensemble_top_k=ensemble_top_k,
+        ensemble_scale=ensemble_scale,
+        ensemble_upsample_mode=ensemble_upsample_mode)
 
     log_evaluation_settings(
         log_path,
         min_evaluate_depth=min_evaluate_depth,
-        max_evaluate_depth=max_evaluate_depth)
+        max_evaluate_depth=max_evaluate_depth,
+        n_batch=n_batch_val)
 
     log_system_settings(
         log_path,
@@ -516,6 +652,7 @@ def train(train_image0_path,
         pose_model_restore_path=pose_model_restore_path,
         # Hardware settings
         device=device,
+        mixed_precision=mixed_precision,
         n_thread=n_thread)
 
     '''
@@ -545,6 +682,9 @@ def train(train_image0_path,
         }],
         lr=learning_rate_pose)
 
+    # Scale loss to keep float16 gradients from underflowing, bfloat16 has the range of float32
+    grad_scaler = torch.cuda.amp.GradScaler(enabled=mixed_precision == 'fp16')
+
     # Start training
     train_step = 0
 
@@ -552,7 +692,9 @@ def train(train_image0_path,
         try:
             train_step, optimizer_depth = depth_model.restore_model(
                 depth_model_restore_path,
-                optimizer=optimizer_depth)
+                optimizer=optimizer_depth,
+                mixed_precision=mixed_precision,
+                grad_scaler=grad_scaler)
         except Exception:
             print("[Depth] Failed to restore optimizer: Ignoring...")
             train_step, _ = depth_model.restore_model(
@@ -566,7 +708,8 @@ def train(train_image0_path,
         try:
             _, optimizer_pose = pose_model.restore_model(
                 pose_model_restore_path,
-                optimizer=optimizer_pose)
+                optimizer=optimizer_pose,
+                mixed_precision=mixed_precision)
         except Exception:
             print("[Pose] Failed to restore optimizer: Ignoring...")
             _, _ = pose_model.restore_model(
@@ -578,7 +721,8 @@ def train(train_image0_path,
 
     time_start = time.time()
 
-    n_teachers = len(train_teacher_output0_paths)
+    # Packed teacher output may hold more than one teacher per path
+    n_teachers = train_dataloader.dataset.n_teacher
 
     log('Begin training...', log_path)
     for epoch in range(1, learning_schedule_depth[-1] + 1):
@@ -607,9 +751,21 @@ def train(train_image0_path,
 
         selection_stats = np.zeros(n_teachers)
 
-        for inputs in train_dataloader:
+        for batch_idx, inputs in enumerate(train_dataloader):
 
-            train_step = train_step + 1
+            # Start a new step every n_step_accumulate batches
+            if (batch_idx % n_step_accumulate) == 0:
+                train_step = train_step + 1
+
+                optimizer_depth.zero_grad()
+                optimizer_pose.zero_grad()
+
+                # Last step of an epoch may have fewer samples to accumulate
+                n_sample_accumulate = min(n_step_accumulate * n_batch, n_train_sample - batch_idx * n_batch)
+
+            # Weights are updated after the last batch of a step
+            is_last_batch_of_step = \
+                (batch_idx + 1) % n_step_accumulate == 0 or batch_idx + 1 == n_train_batch_per_epoch
 
             # Fetch data
             inputs = [
@@ -624,7 +780,43 @@ def train(train_image0_path,
                 ground_truth0, \
                 teacher_output0, \
                 intrinsics0, \
-                focal_length_baseline0 = inputs
+                focal_length_baseline0 = inputs[:9]
+
+            # Precomputed selection maps are transformed with teacher output
+            if use_teacher_selection_maps:
+                teacher_selection_map0_arr = [inputs[9]]
+            else:
+                teacher_selection_map0_arr = []
+
+            # Convert compact depth maps to metric depth on device
+            sparse_depth0, ground_truth0, teacher_output0 = [
+                datasets.decode_depth_compact(depth)
+                for depth in [sparse_depth0, ground_truth0, teacher_output0]
+            ]
+
+            validity_map_ground_truth0 = torch.where(
+                ground_truth0 > 0,
+                torch.ones_like(ground_truth0),
+                ground_truth0)
+
+            if load_sparse_depth_points:
+                # Augment sparse depth as a point list, then scatter it into a depth map
+                [image0, image1, image2, image3], \
+                    [ground_truth0], \
+                    [validity_map_ground_truth0, teacher_output0, *teacher_selection_map0_arr], \
+                    [intrinsics0], \
+                    [sparse_depth0] = train_transforms.transform(
+                        images_arr=[image0, image1, image2, image3],
+                        range_maps_arr=[ground_truth0],
+                        validity_maps_arr=[validity_map_ground_truth0, teacher_output0] + teacher_selection_map0_arr,
+                        intrinsics_arr=[intrinsics0],
+                        points_arr=[sparse_depth0],
+                        random_transform_probability=augmentation_probability)
+
+                sparse_depth0 = datasets.points_to_depth(
+                    sparse_depth0,
+                    n_height=image0.shape[-2],
+                    n_width=image0.shape[-1])
 
             # Validity map is where sparse depth is available
             validity_map0 = torch.where(
@@ -652,91 +844,109 @@ def train(train_image0_path,
             else:
                 raise ValueError('Validity map type is required')
 
-            validity_map_ground_truth0 = torch.where(
-                ground_truth0 > 0,
-                torch.ones_like(ground_truth0),
-                ground_truth0)
+            if not load_sparse_depth_points:
+                # Do data augmentation
+                [image0, image1, image2, image3], \
+                    [sparse_depth0, ground_truth0], \
+                    [validity_map0, validity_map_ground_truth0, teacher_output0, *teacher_selection_map0_arr], \
+                    [intrinsics0] = train_transforms.transform(
+                        images_arr=[image0, image1, image2, image3],
+                        range_maps_arr=[sparse_depth0, ground_truth0],
+                        validity_maps_arr=[validity_map0, validity_map_ground_truth0, teacher_output0] + teacher_selection_map0_arr,
+                        intrinsics_arr=[intrinsics0],
+                        random_transform_probability=augmentation_probability)
+
+            teacher_selection_map0 = \
+                teacher_selection_map0_arr[0] if use_teacher_selection_maps else None
+
+            # Forward and compute loss under autocast if mixed precision is enabled
+            with autocast(device, mixed_precision):
+
+                # Forward through the network
+                output_depth0 = depth_model.forward(
+                    image=image0,
+                    sparse_depth=sparse_depth0,
+                    validity_map=validity_map0,
+                    intrinsics=intrinsics0)
+
+                if 'monocular' in supervision_types:
+                    pose0to1 = pose_model.forward(image0, image1)
+                    pose0to2 = pose_model.forward(image0, image2)
+                else:
+                    image1 = None
+                    image2 = None
+                    pose0to1 = None
+                    pose0to2 = None
 
-            # Do data augmentation
-            [image0, image1, image2, image3], \
-                [sparse_depth0, ground_truth0], \
-                [validity_map0, validity_map_ground_truth0, teacher_output0], \
-                [intrinsics0] = train_transforms.transform(
-                    images_arr=[image0, image1, image2, image3],
-                    range_maps_arr=[sparse_depth0, ground_truth0],
-                    validity_maps_arr=[validity_map0, validity_map_ground_truth0, teacher_output0],
-                    intrinsics_arr=[intrinsics0],
-                    random_transform_probability=augmentation_probability)
-
-            # Forward through the network
-            output_depth0 = depth_model.forward(
-                image=image0,
-                sparse_depth=sparse_depth0,
-                validity_map=validity_map0,
-                intrinsics=intrinsics0)
+                if 'stereo' not in supervision_types:
+                    image3 = None
 
-            if 'monocular' in supervision_types:
-                pose0to1 = pose_model.forward(image0, image1)
-                pose0to2 = pose_model.forward(image0, image2)
-            else:
-                image1 = None
-                image2 = None
-                pose0to1 = None
-                pose0to2 = None
-
-            if 'stereo' not in supervision_types:
-                image3 = None
-
-            # Only use pose after epoch 10
-            use_pose_for_ensemble = True if epoch >= epoch_pose_for_ensemble else False
-
-            # Compute loss function
-            loss, loss_info, images_info = depth_model.compute_loss(
-                output_depth0=output_depth0,
-                sparse_depth0=sparse_depth0,
-                validity_map0=validity_map0,
-                teacher_output0=teacher_output0,
-                ground_truth0=ground_truth0,
-                validity_map_ground_truth0=validity_map_ground_truth0,
-                image0=image0,
-                image1=image1,
-                image2=image2,
-                image3=image3,
-                pose0to1=pose0to1,
-                pose0to2=pose0to2,
-                intrinsics0=intrinsics0,
-                focal_length_baseline0=focal_length_baseline0,
-                w_stereo=w_stereo,
-                w_monocular=w_monocular,
-                w_color=w_color,
-                w_structure=w_structure,
-                w_sparse_depth=w_sparse_depth,
-                w_ensemble_depth=w_ensemble_depth,
-                w_ensemble_temperature=w_ensemble_temperature,
-                w_sparse_select_ensemble=w_sparse_select_ensemble,
-                sparse_select_dilate_kernel_size=sparse_select_dilate_kernel_size,
-                w_smoothness=w_smoothness,
-                loss_func_ensemble_depth=loss_func_ensemble_depth,
-                use_pose_for_ensemble=use_pose_for_ensemble,
-                ensemble_method=ensemble_method)
-
-            # Compute gradient and backpropagate
-            optimizer_depth.zero_grad()
-            optimizer_pose.zero_grad()
-
-            loss.backward()
-
-            optimizer_depth.step()
-            optimizer_pose.step()
-
-            # Save teacher statistics
+                # Only use pose after epoch 10
+                use_pose_for_ensemble = True if epoch >= epoch_pose_for_ensemble else False
+
+                # Compute loss function
+                loss, loss_info, images_info = depth_model.compute_loss(
+                    output_depth0=output_depth0,
+                    sparse_depth0=sparse_depth0,
+                    validity_map0=validity_map0,
+                    teacher_output0=teacher_output0,
+                    teacher_selection_map0=teacher_selection_map0,
+                    ground_truth0=ground_truth0,
+                    validity_map_ground_truth0=validity_map_ground_truth0,
+                    image0=image0,
+                    image1=image1,
+                    image2=image2,
+                    image3=image3,
+                    pose0to1=pose0to1,
+                    pose0to2=pose0to2,
+                    intrinsics0=intrinsics0,
+                    focal_length_baseline0=focal_length_baseline0,
+                    w_stereo=w_stereo,
+                    w_monocular=w_monocular,
+                    w_color=w_color,
+                    w_structure=w_structure,
+                    w_sparse_depth=w_sparse_depth,
+                    w_ensemble_depth=w_ensemble_depth,
+                    w_ensemble_temperature=w_ensemble_temperature,
+                    w_sparse_select_ensemble=w_sparse_select_ensemble,
+                    sparse_select_dilate_kernel_size=sparse_select_dilate_kernel_size,
+                    w_smoothness=w_smoothness,
+                    loss_func_ensemble_depth=loss_func_ensemble_depth,
+                    use_pose_for_ensemble=use_pose_for_ensemble,
+                    ensemble_method=ensemble_method,
+                    ensemble_top_k=ensemble_top_k,
+                    ensemble_scale=ensemble_scale,
+                    ensemble_upsample_mode=ensemble_upsample_mode,
+                    check_ensemble_scale=is_last_batch_of_step and (train_step % n_summary) == 0)
+
+            # Compute gradient and backpropagate, weight batch loss by its share of samples
+            # in the step so that the gradient is the mean over all accumulated samples
+            grad_scaler.scale(loss * (image0.shape[0] / n_sample_accumulate)).backward()
+
+            # Save teacher statistics for every batch
             teacher_idxs = images_info.pop('teacher_idxs')
             if teacher_idxs is not None:
                 for teacher_idx in range(n_teachers):
                     selection_stats[teacher_idx] += (teacher_idxs == teacher_idx).sum().detach().item()
 
+            # Update weights, log summaries and save checkpoints once per step
+            if not is_last_batch_of_step:
+                continue
+
+            grad_scaler.step(optimizer_depth)
+
+            if 'monocular' in supervision_types:
+                grad_scaler.step(optimizer_pose)
+
+            grad_scaler.update()
+
             if (train_step % n_summary) == 0:
 
+                if 'ensemble_selection_agreement' in loss_info:
+                    log('Step={:6}/{}  Teacher selection agreement with full resolution={:.4f}'.format(
+                        train_step, n_train_step, loss_info['ensemble_selection_agreement'].item()),
+                        log_path)
+
                 if pose0to1 is not None:
                     image1to0 = images_info.pop('image1to0').detach().clone()
                 else:
@@ -794,7 +1004,6 @@ def train(train_image0_path,
                             input_types=input_types,
                             transforms=val_transforms,
                             outlier_removal=outlier_removal,
-                            ground_truths=ground_truths,
                             step=train_step,
                             best_results=best_results,
                             min_evaluate_depth=min_evaluate_depth,
@@ -809,11 +1018,19 @@ def train(train_image0_path,
 
                 # Save checkpoints
                 depth_model.save_model(
-                    depth_model_checkpoint_path.format(train_step), train_step, optimizer_depth)
+                    depth_model_checkpoint_path.format(train_step),
+                    train_step,
+                    optimizer_depth,
+                    mixed_precision=mixed_precision,
+                    grad_scaler=grad_scaler)
 
                 if 'monocular' in supervision_types:
                     pose_model.save_model(
-                        pose_model_checkpoint_path.format(train_step), train_step, optimizer_pose)
+                        pose_model_checkpoint_path.format(train_step),
+                        train_step,
+                        optimizer_pose,
+                        mixed_precision=mixed_precision,
+                        grad_scaler=grad_scaler)
 
     # Perform validation for final step
     depth_model.eval()
@@ -825,7 +1042,6 @@ def train(train_image0_path,
             input_types=input_types,
             transforms=val_transforms,
             outlier_removal=outlier_removal,
-            ground_truths=ground_truths,
             step=train_step,
             best_results=best_results,
             min_evaluate_depth=min_evaluate_depth,
@@ -837,18 +1053,25 @@ def train(train_image0_path,
 
     # Save checkpoints
     depth_model.save_model(
-        depth_model_checkpoint_path.format(train_step), train_step, optimizer_depth)
+        depth_model_checkpoint_path.format(train_step),
+        train_step,
+        optimizer_depth,
+        mixed_precision=mixed_precision,
+        grad_scaler=grad_scaler)
 
     if 'monocular' in supervision_types:
         pose_model.save_model(
-            pose_model_checkpoint_path.format(train_step), train_step, optimizer_pose)
+            pose_model_checkpoint_path.format(train_step),
+            train_step,
+            optimizer_pose,
+            mixed_precision=mixed_precision,
+            grad_scaler=grad_scaler)
 
 def validate(depth_model,
              dataloader,
              input_types,
              transforms,
              outlier_removal,
-             ground_truths,
              step,
              best_results,
              min_evaluate_depth,
@@ -859,11 +1082,8 @@ def validate(depth_model,
              n_summary_display_interval=250,
              log_path=None):
 
-    n_sample = len(dataloader)
-    mae = np.zeros(n_sample)
-    rmse = np.zeros(n_sample)
-    imae = np.zeros(n_sample)
-    irmse = np.zeros(n_sample)
+    # Accumulate metrics on device
+    running_metrics = eval_utils.RunningMetrics()
 
     image_summary = []
     output_depth_summary = []
@@ -871,18 +1091,32 @@ def validate(depth_model,
     validity_map_summary = []
     ground_truth_summary = []
 
-    for idx, (inputs, ground_truth) in enumerate(zip(dataloader, ground_truths)):
+    # Index of first sample in each batch
+    idx = 0
+
+    for inputs in dataloader:
 
         # Move inputs to device
         inputs = [
-            in_.to(device) for in_ in inputs
+            in_.to(device, non_blocking=True) for in_ in inputs
         ]
 
-        image, sparse_depth, intrinsics = inputs
+        image, sparse_depth, intrinsics, ground_truth = inputs
 
-        ground_truth = np.expand_dims(ground_truth, axis=0)
-        ground_truth = np.transpose(ground_truth, (0, 3, 1, 2))
-        ground_truth = torch.from_numpy(ground_truth).to(device)
+        n_batch = image.shape[0]
+
+        # Convert compact sparse depth or point list to metric depth map on device
+        sparse_depth = datasets.decode_depth_compact(sparse_depth)
+
+        if sparse_depth.ndim == 3:
+            sparse_depth = datasets.points_to_depth(
+                sparse_depth,
+                n_height=image.shape[-2],
+                n_width=image.shape[-1])
+
+        # Decode ground truth into N x 1 x H x W depth and validity map
+        ground_truth, validity_map_ground_truth = \
+            eval_utils.decode_ground_truth(ground_truth)
 
         with torch.no_grad():
             # Validity map is where sparse depth is available
@@ -922,41 +1156,36 @@ def validate(depth_model,
                 validity_map=validity_map,
                 intrinsics=intrinsics)
 
-        if (idx % n_summary_display_interval) == 0 and summary_writer is not None:
-            image_summary.append(image)
-            output_depth_summary.append(output_depth)
-            sparse_depth_summary.append(sparse_depth)
-            validity_map_summary.append(validity_map)
-            ground_truth_summary.append(ground_truth)
-
-        # Convert to numpy to validate
-        output_depth = np.squeeze(output_depth.cpu().numpy())
-        ground_truth = np.squeeze(ground_truth.cpu().numpy())
-
-        validity_map = ground_truth[1, :, :]
-        ground_truth = ground_truth[0, :, :]
-
-        # Select valid regions to evaluate
-        validity_mask = np.where(validity_map > 0, 1, 0)
-        min_max_mask = np.logical_and(
-            ground_truth > min_evaluate_depth,
-            ground_truth < max_evaluate_depth)
-        mask = np.where(np.logical_and(validity_mask, min_max_mask) > 0)
+        if summary_writer is not None:
+            for batch_idx in range(n_batch):
+                if ((idx + batch_idx) % n_summary_display_interval) == 0:
+                    image_summary.append(image[batch_idx:batch_idx+1])
+                    output_depth_summary.append(output_depth[batch_idx:batch_idx+1])
+                    sparse_depth_summary.append(sparse_depth[batch_idx:batch_idx+1])
+                    validity_map_summary.append(validity_map[batch_idx:batch_idx+1])
+                    ground_truth_summary.append(torch.cat([
+                        ground_truth[batch_idx:batch_idx+1],
+                        validity_map_ground_truth[batch_idx:batch_idx+1]], dim=1))
+
+        # Compute validation metrics for each sample without leaving device
+        metrics = eval_utils.evaluate_depth_batch(
+            output_depth=output_depth,
+            ground_truth=ground_truth,
+            validity_map=validity_map_ground_truth,
+            min_evaluate_depth=min_evaluate_depth,
+            max_evaluate_depth=max_evaluate_depth)
 
-        output_depth = output_depth[mask]
-        ground_truth = ground_truth[mask]
+        running_metrics.update(metrics)
 
-        # Compute validation metrics
-        mae[idx] = eval_utils.mean_abs_err(1000.0 * output_depth, 1000.0 * ground_truth)
-        rmse[idx] = eval_utils.root_mean_sq_err(1000.0 * output_depth, 1000.0 * ground_truth)
-        imae[idx] = eval_utils.inv_mean_abs_err(0.001 * output_depth, 0.001 * ground_truth)
-        irmse[idx] = eval_utils.inv_root_mean_sq_err(0.001 * output_depth, 0.001 * ground_truth)
+        idx = idx + n_batch
 
     # Compute mean metrics
-    mae   = np.mean(mae)
-    rmse  = np.mean(rmse)
-    imae  = np.mean(imae)
-    irmse = np.mean(irmse)
+    metrics_mean = running_metrics.mean()
+
+    mae   = metrics_mean['mae']
+    rmse  = metrics_mean['rmse']
+    imae  = metrics_mean['imae']
+    irmse = metrics_mean['irmse']
 
     # Log to tensorboard
     if summary_writer is not None:
@@ -1018,12 +1247,16 @@ def run(image_path,
         ground_truth_path,
         # Input settings
         load_image_triplets,
+        load_compact_inputs,
+        load_sparse_depth_points,
+        codec,
         input_types,
         input_channels_image,
         input_channels_depth,
         normalized_image_range,
         outlier_removal_kernel_size,
         outlier_removal_threshold,
+        outlier_removal_sparse_aware,
         # Sparse to dense pool settings
         min_pool_sizes_sparse_to_dense_pool,
         max_pool_sizes_sparse_to_dense_pool,
@@ -1055,7 +1288,12 @@ def run(image_path,
         save_outputs,
         keep_input_filenames,
         # Hardware settings
-        device):
+        device,
+        n_batch=1,
+        n_thread=1,
+        pin_memory=False,
+        prefetch_factor=2,
+        n_thread_output=4):
 
     # Select device to run on
     if device == 'cuda' or device == 'gpu':
@@ -1099,26 +1337,36 @@ def run(image_path,
     for paths in input_paths:
         assert n_sample == len(paths)
 
-    if ground_truth_available:
+    if not ground_truth_available:
+        ground_truth_paths = None
 
-        ground_truths = []
-        for path in ground_truth_paths:
-            ground_truth, validity_map = data_utils.load_depth_with_validity_map(path)
-            ground_truths.append(np.stack([ground_truth, validity_map], axis=-1))
-    else:
-        ground_truths = [None] * n_sample
+    # Prefetching is only supported when loading with worker processes
+    dataloader_settings = {}
+
+    if n_thread > 0:
+        dataloader_settings['prefetch_factor'] = prefetch_factor
+
+    # Set up dataloader, batching requires all samples to share the same shape (e.g. KITTI 352 x 1216)
+    dataset = datasets.DepthCompletionInferenceDataset(
+        image_paths=image_paths,
+        sparse_depth_paths=sparse_depth_paths,
+        intrinsics_paths=intrinsics_paths,
+        load_image_triplets=load_image_triplets,
+        ground_truth_paths=ground_truth_paths,
+        load_compact_ground_truth=True,
+        load_compact=load_compact_inputs,
+        codec=codec,
+        load_sparse_depth_points=load_sparse_depth_points)
 
-    # Set up dataloader
     dataloader = torch.utils.data.DataLoader(
-        datasets.DepthCompletionInferenceDataset(
-            image_paths=image_paths,
-            sparse_depth_paths=sparse_depth_paths,
-            intrinsics_paths=intrinsics_paths,
-            load_image_triplets=load_image_triplets),
-        batch_size=1,
+        dataset,
+        batch_size=n_batch,
         shuffle=False,
-        num_workers=1,
-        drop_last=False)
+        num_workers=n_thread,
+        drop_last=False,
+        pin_memory=pin_memory,
+        collate_fn=dataset.collate_fn,
+        **dataloader_settings)
 
     # Initialize transforms to normalize image and outlier removal for sparse depth
     transforms = Transforms(
@@ -1126,7 +1374,8 @@ def run(image_path,
 
     outlier_removal = OutlierRemoval(
         kernel_size=outlier_removal_kernel_size,
-        threshold=outlier_removal_threshold)
+        threshold=outlier_removal_threshold,
+        sparse_aware=outlier_removal_sparse_aware)
 
     '''
     Set up the model
@@ -1219,7 +1468,8 @@ def run(image_path,
     log_evaluation_settings(
         log_path,
         min_evaluate_depth=min_evaluate_depth,
-        max_evaluate_depth=max_evaluate_depth)
+        max_evaluate_depth=max_evaluate_depth,
+        n_batch=n_batch)
 
     log_system_settings(
         log_path,
@@ -1228,31 +1478,65 @@ def run(image_path,
         depth_model_restore_path=depth_model_restore_path,
         # Hardware settings
         device=device,
-        n_thread=1)
+        n_thread=n_thread)
 
     '''
     Run model
     '''
     # Set up metrics in case groundtruth is available
-    mae = np.zeros(n_sample)
-    rmse = np.zeros(n_sample)
-    imae = np.zeros(n_sample)
-    irmse = np.zeros(n_sample)
+    running_metrics = eval_utils.RunningMetrics()
+
+    if save_outputs:
+        log('Saving outputs to {}'.format(output_path), log_path)
+
+        image_dirpath = os.path.join(output_path, 'image')
+        output_depth_dirpath = os.path.join(output_path, 'output_depth')
+        sparse_depth_dirpath = os.path.join(output_path, 'sparse_depth')
+        ground_truth_dirpath = os.path.join(output_path, 'ground_truth')
+
+        dirpaths = [
+            image_dirpath,
+            output_depth_dirpath,
+            sparse_depth_dirpath,
+            ground_truth_dirpath
+        ]
+
+        for dirpath in dirpaths:
+            if not os.path.exists(dirpath):
+                os.makedirs(dirpath)
 
-    images = []
-    output_depths = []
-    sparse_depths = []
+        # Save outputs in background as soon as each batch is done
+        output_writer = data_utils.OutputWriter(
+            n_thread=n_thread_output,
+            max_queue_size=4 * max(n_batch, n_thread_output))
 
     time_elapse = 0.0
 
-    for idx, (inputs, ground_truth) in enumerate(zip(dataloader, ground_truths)):
+    # Index of first sample in each batch
+    idx = 0
+
+    for inputs in dataloader:
 
         # Move inputs to device
         inputs = [
-            in_.to(device) for in_ in inputs
+            in_.to(device, non_blocking=True) for in_ in inputs
         ]
 
-        image, sparse_depth, intrinsics = inputs
+        if ground_truth_available:
+            image, sparse_depth, intrinsics, ground_truth = inputs
+        else:
+            image, sparse_depth, intrinsics = inputs
+
+        n_batch = image.shape[0]
+
+        # Convert compact sparse depth or point list to metric depth map on device
+        sparse_depth = datasets.decode_depth_compact(sparse_depth)
+
+        if sparse_depth.ndim == 3:
+            sparse_depth = datasets.points_to_depth(
+                sparse_depth,
+                n_height=image.shape[-2],
+                n_width=image.shape[-1])
 
         time_start = time.time()
 
@@ -1296,48 +1580,80 @@ def run(image_path,
 
         time_elapse = time_elapse + (time.time() - time_start)
 
-        # Convert to numpy
-        output_depth = np.squeeze(output_depth.detach().cpu().numpy())
+        if ground_truth_available:
+            # Decode ground truth into N x 1 x H x W depth and validity map
+            ground_truth, validity_map_ground_truth = \
+                eval_utils.decode_ground_truth(ground_truth)
+
+            # Compute metrics for each sample without leaving device
+            metrics = eval_utils.evaluate_depth_batch(
+                output_depth=output_depth,
+                ground_truth=ground_truth,
+                validity_map=validity_map_ground_truth,
+                min_evaluate_depth=min_evaluate_depth,
+                max_evaluate_depth=max_evaluate_depth)
+
+            running_metrics.update(metrics)
 
         # Save to output
         if save_outputs:
-            images.append(np.transpose(np.squeeze(image.cpu().numpy()), (1, 2, 0)))
-            sparse_depths.append(np.squeeze(filtered_sparse_depth.cpu().numpy()))
-            output_depths.append(output_depth)
+            output_depth = output_depth.detach().cpu().numpy()
+            image = np.transpose(image.cpu().numpy(), (0, 2, 3, 1))
+            filtered_sparse_depth = filtered_sparse_depth.cpu().numpy()
 
-        if ground_truth_available:
-            ground_truth = np.squeeze(ground_truth)
+            if ground_truth_available:
+                ground_truth = ground_truth.cpu().numpy()
 
-            validity_map = ground_truth[:, :, 1]
-            ground_truth = ground_truth[:, :, 0]
+            for batch_idx in range(n_batch):
 
-            validity_mask = np.where(validity_map > 0, 1, 0)
-            min_max_mask = np.logical_and(
-                ground_truth > min_evaluate_depth,
-                ground_truth < max_evaluate_depth)
-            mask = np.where(np.logical_and(validity_mask, min_max_mask) > 0)
+                if keep_input_filenames:
+                    filename = os.path.basename(image_paths[idx + batch_idx])
+                else:
+                    filename = '{:010d}.png'.format(idx + batch_idx)
+
+                output_writer.submit(
+                    data_utils.save_image,
+                    image[batch_idx],
+                    os.path.join(image_dirpath, filename))
+
+                output_writer.submit(
+                    data_utils.save_depth,
+                    output_depth[batch_idx, 0, :, :],
+                    os.path.join(output_depth_dirpath, filename))
 
-            output_depth = output_depth[mask]
-            ground_truth = ground_truth[mask]
+                output_writer.submit(
+                    data_utils.save_depth,
+                    filtered_sparse_depth[batch_idx, 0, :, :],
+                    os.path.join(sparse_depth_dirpath, filename))
 
-            mae[idx] = eval_utils.mean_abs_err(1000.0 * output_depth, 1000.0 * ground_truth)
-            rmse[idx] = eval_utils.root_mean_sq_err(1000.0 * output_depth, 1000.0 * ground_truth)
-            imae[idx] = eval_utils.inv_mean_abs_err(0.001 * output_depth, 0.001 * ground_truth)
-            irmse[idx] = eval_utils.inv_root_mean_sq_err(0.001 * output_depth, 0.001 * ground_truth)
+                if ground_truth_available:
+                    output_writer.submit(
+                        data_utils.save_depth,
+                        ground_truth[batch_idx, 0, :, :],
+                        os.path.join(ground_truth_dirpath, filename))
+
+        idx = idx + n_batch
+
+    # Wait for remaining outputs to be saved
+    if save_outputs:
+        output_writer.close()
 
     # Compute total time elapse in ms
     time_elapse = time_elapse * 1000.0
 
     if ground_truth_available:
-        mae_mean   = np.mean(mae)
-        rmse_mean  = np.mean(rmse)
-        imae_mean  = np.mean(imae)
-        irmse_mean = np.mean(irmse)
+        metrics_mean = running_metrics.mean()
+        metrics_std = running_metrics.std()
+
+        mae_mean   = metrics_mean['mae']
+        rmse_mean  = metrics_mean['rmse']
+        imae_mean  = metrics_mean['imae']
+        irmse_mean = metrics_mean['irmse']
 
-        mae_std = np.std(mae)
-        rmse_std = np.std(rmse)
-        imae_std = np.std(imae)
-        irmse_std = np.std(irmse)
+        mae_std = metrics_std['mae']
+        rmse_std = metrics_std['rmse']
+        imae_std = metrics_std['imae']
+        irmse_std = metrics_std['irmse']
 
         # Print evaluation results to console and file
         log('Evaluation results:', log_path)
@@ -1359,48 +1675,6 @@ def run(image_path,
     log('Total time: {:.2f} ms  Average time per sample: {:.2f} ms'.format(
         time_elapse, time_elapse / float(n_sample)))
 
-    if save_outputs:
-        log('Saving outputs to {}'.format(output_path), log_path)
-
-        outputs = zip(images, output_depths, sparse_depths, ground_truths)
-
-        image_dirpath = os.path.join(output_path, 'image')
-        output_depth_dirpath = os.path.join(output_path, 'output_depth')
-        sparse_depth_dirpath = os.path.join(output_path, 'sparse_depth')
-        ground_truth_dirpath = os.path.join(output_path, 'ground_truth')
-
-        dirpaths = [
-            image_dirpath,
-            output_depth_dirpath,
-            sparse_depth_dirpath,
-            ground_truth_dirpath
-        ]
-
-        for dirpath in dirpaths:
-            if not os.path.exists(dirpath):
-                os.makedirs(dirpath)
-
-        for idx, (image, output_depth, sparse_depth, ground_truth) in enumerate(outputs):
-
-            if keep_input_filenames:
-                filename = os.path.basename(image_paths[idx])
-            else:
-                filename = '{:010d}.png'.format(idx)
-
-            image_path = os.path.join(image_dirpath, filename)
-            image = (255 * image).astype(np.uint8)
-            Image.fromarray(image).save(image_path)
-
-            output_depth_path = os.path.join(output_depth_dirpath, filename)
-            data_utils.save_depth(output_depth, output_depth_path)
-
-            sparse_depth_path = os.path.join(sparse_depth_dirpath, filename)
-            data_utils.save_depth(sparse_depth, sparse_depth_path)
-
-            if ground_truth_available:
-                ground_truth_path = os.path.join(ground_truth_dirpath, filename)
-                data_utils.save_depth(ground_truth[..., 0], ground_truth_path)
-
 
 '''
 Helper functions for logging
@@ -1414,7 +1688,8 @@ def log_input_settings(log_path,
                        outlier_removal_threshold,
                        n_batch=None,
                        n_height=None,
-                       n_width=None):
+                       n_width=None,
+                       n_step_accumulate=None):
 
     batch_settings_text = ''
     batch_settings_vars = []
@@ -1437,6 +1712,13 @@ def log_input_settings(log_path,
         batch_settings_text = batch_settings_text + 'n_width={}'
         batch_settings_vars.append(n_width)
 
+    batch_settings_text = \
+        batch_settings_text + '  ' if len(batch_settings_text) > 0 else batch_settings_text
+
+    if n_step_accumulate is not None:
+        batch_settings_text = batch_settings_text + 'n_step_accumulate={}'
+        batch_settings_vars.append(n_step_accumulate)
+
     log('Input settings:', log_path)
 
     if len(batch_settings_vars) > 0:
@@ -1570,6 +1852,9 @@ def log_training_settings(log_path,
                           augmentation_random_contrast,
                           augmentation_random_saturation):
 
+    # Number of optimizer steps in an epoch, may be fewer than batches if gradients are accumulated
+    n_train_step_per_epoch = n_train_step // learning_schedule_depth[-1]
+
     log('Training settings:', log_path)
     log('n_sample={}  n_epoch={}  n_step={}'.format(
         n_train_sample, learning_schedule_depth[-1], n_train_step),
@@ -1579,13 +1864,13 @@ def log_training_settings(log_path,
         log_path)
     log('learning_schedule_depth=[%s]' %
         ', '.join('{}-{} : {}'.format(
-            ls * (n_train_sample // n_batch), le * (n_train_sample // n_batch), v)
+            ls * n_train_step_per_epoch, le * n_train_step_per_epoch, v)
             for ls, le, v in zip([0] + learning_schedule_depth[:-1], learning_schedule_depth, learning_rates_depth)),
         log_path)
 
     log('learning_schedule_pose=[%s]' %
         ', '.join('{}-{} : {}'.format(
-            ls * (n_train_sample // n_batch), le * (n_train_sample // n_batch), v)
+            ls * n_train_step_per_epoch, le * n_train_step_per_epoch, v)
             for ls, le, v in zip([0] + learning_schedule_pose[:-1], learning_schedule_pose, learning_rates_pose)),
         log_path)
 
@@ -1594,7 +1879,7 @@ def log_training_settings(log_path,
     log('Augmentation settings:', log_path)
     log('augmentation_schedule=[%s]' %
         ', '.join('{}-{} : {}'.format(
-            ls * (n_train_sample // n_batch), le * (n_train_sample // n_batch), v)
+            ls * n_train_step_per_epoch, le * n_train_step_per_epoch, v)
             for ls, le, v in zip([0] + augmentation_schedule[:-1], augmentation_schedule, augmentation_probabilities)),
         log_path)
     log('augmentation_random_crop_type={}'.format(augmentation_random_crop_type),
@@ -1627,7 +1912,10 @@ def log_loss_func_settings(log_path,
                            w_weight_decay_pose,
                            loss_func_ensemble_depth,
                            epoch_pose_for_ensemble,
-                           ensemble_method):
+                           ensemble_method,
+                           ensemble_top_k=0,
+                           ensemble_scale=1.0,
+                           ensemble_upsample_mode='nearest'):
 
     log('Loss function settings:', log_path)
     log('w_stereo={:.1e}  w_monocular={:.1e}'.format(
@@ -1650,18 +1938,23 @@ def log_loss_func_settings(log_path,
     log('loss_func_ensemble_depth={}  epoch_pose_for_ensemble={}'.format(
         loss_func_ensemble_depth, epoch_pose_for_ensemble),
         log_path)
-    log('ensemble_method={}'.format(ensemble_method),
+    log('ensemble_method={}  ensemble_top_k={}'.format(ensemble_method, ensemble_top_k),
+        log_path)
+    log('ensemble_scale={}  ensemble_upsample_mode={}'.format(ensemble_scale, ensemble_upsample_mode),
         log_path)
     log('', log_path)
 
 def log_evaluation_settings(log_path,
                             min_evaluate_depth,
-                            max_evaluate_depth):
+                            max_evaluate_depth,
+                            n_batch=1):
 
     log('Evaluation settings:', log_path)
     log('min_evaluate_depth={:.2f}  max_evaluate_depth={:.2f}'.format(
         min_evaluate_depth, max_evaluate_depth),
         log_path)
+    log('n_batch={}'.format(n_batch),
+        log_path)
     log('', log_path)
 
 def log_system_settings(log_path,
@@ -1676,6 +1969,7 @@ def log_system_settings(log_path,
                         pose_model_restore_path=None,
                         # Hardware settings
                         device=torch.device('cuda'),
+                        mixed_precision=None,
                         n_thread=8):
 
     log('Checkpoint settings:', log_path)
@@ -1727,5 +2021,9 @@ def log_system_settings(log_path,
 
     log('Hardware settings:', log_path)
     log('device={}'.format(device.type), log_path)
+
+    if mixed_precision is not None:
+        log('mixed_precision={}'.format(mixed_precision), log_path)
+
     log('n_thread={}'.format(n_thread), log_path)
     log('', log_path)
@@ -214,7 +214,9 @@ class MonitoredDistillationModel(object):
 
         outputs = self.decoder(latent, skips=skips, shape=image.shape[-2:])
 
-        output_depth = outputs[-1]
+        # Map to depth in float32, under mixed precision the offset of
+        # min / max predict depth and depths near max are not representable
+        output_depth = outputs[-1].float()
         output_depth = torch.sigmoid(output_depth)
 
         output_depth = \
@@ -227,6 +229,7 @@ class MonitoredDistillationModel(object):
                      sparse_depth0,
                      validity_map0,
                      teacher_output0,
+                     teacher_selection_map0=None,
                      image0=None,
                      image1=None,
                      image2=None,
@@ -247,7 +250,11 @@ class MonitoredDistillationModel(object):
                      w_smoothness=0.00,
                      loss_func_ensemble_depth='smoothl1',
                      use_pose_for_ensemble=False,
-                     ensemble_method='mondi'):
+                     ensemble_method='mondi',
+                     ensemble_top_k=0,
+                     ensemble_scale=1.0,
+                     ensemble_upsample_mode='nearest',
+                     check_ensemble_scale=False):
         '''
         Computes loss function
 
@@ -260,6 +267,9 @@ class MonitoredDistillationModel(object):
                 N x 1 x H x W validity map of sparse depth for left image
             teacher_output0 : torch.Tensor[float32]
                 N x M x H x W teacher output from ensemble for left image
+            teacher_selection_map0 : torch.Tensor[float32]
+                N x M x H x W precomputed stereo reprojection error of each teacher,
+                if given then used in place of warping the right image with each teacher
             image0 : torch.Tensor[float32]
                 N x 3 x H x W left image
             image1 : torch.Tensor[float32]
@@ -298,6 +308,16 @@ class MonitoredDistillationModel(object):
                 if True, then use video (rigid warping) for teacher criterion
             ensemble_method : str
                 options: median, mean, random, mondi
+            ensemble_top_k : int
+                if greater than 0, then only score the k teachers that agree most
+                with sparse depth for each sample (mondi only)
+            ensemble_scale : float
+                if less than 1, then score teachers on inputs downsampled by this factor (mondi only)
+            ensemble_upsample_mode : str
+                nearest, bilinear interpolation to upsample teacher scores to full resolution
+            check_ensemble_scale : bool
+                if set and ensemble scale is less than 1, then also score teachers at full
+                resolution and return the fraction of pixels that select the same teacher
         Returns:
             torch.Tensor[float32] : loss
             dict[str, torch.Tensor[float32]] : dictionary of loss related tensors
@@ -305,6 +325,10 @@ class MonitoredDistillationModel(object):
 
         shape = image0.shape
 
+        # Loss is computed in float32 even under autocast, disparity (1 / depth)
+        # and photometric terms lose too much precision in float16 or bfloat16
+        output_depth0 = output_depth0.float()
+
         # Keep track of number of views we have
         t = 0.0
 
@@ -319,11 +343,21 @@ class MonitoredDistillationModel(object):
             fb = fb[:, None, None, None]
 
             t = t + 1
+        else:
+            fb = None
+
+        # Invert camera intrinsics once for all backprojections
+        if intrinsics0 is not None:
+            intrinsics0_inverse = torch.inverse(intrinsics0)
+        else:
+            intrinsics0_inverse = None
+
+        # Compute SSIM statistics of left image once for every view and teacher
+        image0_statistics = loss_utils.structural_consistency_statistics(image0)
 
         M = teacher_output0.shape[1]
         teacher_idxs = None
-
-        ensemble_loss = loss_utils.structural_consistency_loss_func
+        ensemble_selection_agreement = None
 
         with torch.no_grad():
             if ensemble_method == 'mean':
@@ -337,59 +371,66 @@ class MonitoredDistillationModel(object):
                 r = random.randint(0, M-1)
                 teacher_output0 = teacher_output0[:, r:r+1]
             elif ensemble_method == 'mondi':
-                lossesxto0_ensemble = []
-
-                if image3 is not None:
-                    images3to0_ensemble = [
-                        loss_utils.warp1d_horizontal(
-                            image3,
-                            -fb / teacher_output0[:, i:i+1])
-                        for i in range(M)
-                    ]
-                    losses3to0_ensemble = [
-                        ensemble_loss(image0, images3to0_ensemble[i], reduce_loss=False)
-                        for i in range(M)
-                    ]
-
-                    lossesxto0_ensemble.append(losses3to0_ensemble)
-
-                if pose0to2 is not None and pose0to1 is not None and use_pose_for_ensemble:
-                    images1to0_ensemble = [
-                        loss_utils.rigid_warp(
-                            image1,
-                            teacher_output0[:, i:i+1],
-                            pose0to1,
-                            intrinsics0,
-                            shape)
-                        for i in range(M)
-                    ]
-                    losses1to0_ensemble = [
-                        ensemble_loss(image0, images1to0_ensemble[i], reduce_loss=False)
-                        for i in range(M)
-                    ]
-
-                    lossesxto0_ensemble.append(losses1to0_ensemble)
-
-                    images2to0_ensemble = [
-                        loss_utils.rigid_warp(
-                            image2,
-                            teacher_output0[:, i:i+1],
-                            pose0to2,
-                            intrinsics0,
-                            shape)
-                        for i in range(M)
-                    ]
-                    losses2to0_ensemble = [
-                        ensemble_loss(image0, images2to0_ensemble[i], reduce_loss=False)
-                        for i in range(M)
-                    ]
-
-                    lossesxto0_ensemble.append(losses2to0_ensemble)
-
-                # Take mean loss from each view
-                losses_ensemble = []
-
-                if len(lossesxto0_ensemble) != 0:
+                # Prune teachers by cheap agreement with sparse depth before photometric scoring
+                if ensemble_top_k > 0 and ensemble_top_k < M:
+                    teacher_top_k_idxs = loss_utils.select_top_k_teachers(
+                        sparse_depth=sparse_depth0,
+                        dilation_kernel_size=sparse_select_dilate_kernel_size,
+                        teacher_outputs=teacher_output0,
+                        k=ensemble_top_k)
+
+                    teacher_output0 = loss_utils.gather_teachers(teacher_output0, teacher_top_k_idxs)
+
+                    if teacher_selection_map0 is not None:
+                        teacher_selection_map0 = \
+                            loss_utils.gather_teachers(teacher_selection_map0, teacher_top_k_idxs)
+
+                    M = ensemble_top_k
+                else:
+                    teacher_top_k_idxs = None
+
+                N, _, H, W = teacher_output0.shape
+
+                # Only use temporal views to score teachers once pose is reliable
+                pose0to1_ensemble = pose0to1 if use_pose_for_ensemble else None
+                pose0to2_ensemble = pose0to2 if use_pose_for_ensemble else None
+
+                if ensemble_scale < 1:
+                    # Score teachers at lower resolution and upsample their losses
+                    losses_ensemble = self.score_teacher_output_downsampled(
+                        scale=ensemble_scale,
+                        teacher_output0=teacher_output0,
+                        teacher_selection_map0=teacher_selection_map0,
+                        image0=image0,
+                        image1=image1,
+                        image2=image2,
+                        image3=image3,
+                        pose0to1=pose0to1_ensemble,
+                        pose0to2=pose0to2_ensemble,
+                        intrinsics0=intrinsics0,
+                        focal_length_baseline0=focal_length_baseline0)
+
+                    if len(losses_ensemble) != 0:
+                        losses_ensemble = torch.nn.functional.interpolate(
+                            losses_ensemble,
+                            size=(H, W),
+                            mode=ensemble_upsample_mode)
+                else:
+                    losses_ensemble = self.score_teacher_output(
+                        teacher_output0=teacher_output0,
+                        teacher_selection_map0=teacher_selection_map0,
+                        image0=image0,
+                        image0_statistics=image0_statistics,
+                        image1=image1,
+                        image2=image2,
+                        image3=image3,
+                        pose0to1=pose0to1_ensemble,
+                        pose0to2=pose0to2_ensemble,
+                        intrinsics0=intrinsics0,
+                        intrinsics0_inverse=intrinsics0_inverse,
+                        fb=fb)
+
+                if len(losses_ensemble) != 0:
                     # Multiple with sparse depth error
                     sparse_select_ensemble_error = loss_utils.sparse_depth_error_weight(
                         sparse_depth=sparse_depth0,
@@ -397,23 +438,31 @@ class MonitoredDistillationModel(object):
                         teacher_outputs=teacher_output0,
                         w_sparse_error=w_sparse_select_ensemble)
 
-                    for i in range(M):
-                        lossesxto0 = []
-
-                        for lossxto0 in lossesxto0_ensemble:
-                            lossesxto0.append(lossxto0[i])
+                    assert sparse_select_ensemble_error.shape[1] == losses_ensemble.shape[1]
 
-                        # Minimum reprojection error
-                        loss_ensemble, _ = torch.min(torch.cat(lossesxto0, dim=1), dim=1, keepdim=True)
+                    losses_ensemble = sparse_select_ensemble_error * losses_ensemble
 
-                        losses_ensemble.append(loss_ensemble)
+                    # Compare against selection at full resolution to measure accuracy of low resolution scoring
+                    if ensemble_scale < 1 and check_ensemble_scale:
+                        losses_ensemble_full = self.score_teacher_output(
+                            teacher_output0=teacher_output0,
+                            teacher_selection_map0=teacher_selection_map0,
+                            image0=image0,
+                            image0_statistics=image0_statistics,
+                            image1=image1,
+                            image2=image2,
+                            image3=image3,
+                            pose0to1=pose0to1_ensemble,
+                            pose0to2=pose0to2_ensemble,
+                            intrinsics0=intrinsics0,
+                            intrinsics0_inverse=intrinsics0_inverse,
+                            fb=fb)
 
-                    assert sparse_select_ensemble_error.shape[1] == len(losses_ensemble)
+                        losses_ensemble_full = sparse_select_ensemble_error * losses_ensemble_full
 
-                    losses_ensemble = [
-                        sparse_select_ensemble_error[:, i:i+1] * losses_ensemble[i]
-                        for i in range(len(losses_ensemble))
-                    ]
+                        ensemble_selection_agreement = torch.mean(torch.eq(
+                            torch.argmin(losses_ensemble, dim=1),
+                            torch.argmin(losses_ensemble_full, dim=1)).float())
 
                 # Aggregate ensemble into single teacher output
                 teacher_output0, teacher_output_loss, teacher_idxs = \
@@ -421,6 +470,12 @@ class MonitoredDistillationModel(object):
                             losses_ensemble,
                             teacher_output0)
 
+                # Map indices of kept teachers back to indices in the full ensemble
+                if teacher_top_k_idxs is not None and teacher_idxs is not None:
+                    teacher_idxs = loss_utils.gather_teachers(
+                        teacher_top_k_idxs.expand(N, M, H, W),
+                        teacher_idxs)
+
                 DELTA = 0.3
                 # Don't change teacher_output_loss
                 non_error_sparse_map0 = torch.abs(teacher_output0 - sparse_depth0) < DELTA
@@ -437,7 +492,8 @@ class MonitoredDistillationModel(object):
             torch.zeros_like(teacher_output0))
 
         if w_ensemble_temperature > 0:
-            w_adaptive_ensemble = w_adaptive_ensemble * torch.exp(-w_ensemble_temperature * teacher_output_loss)
+            w_adaptive_ensemble = w_adaptive_ensemble * \
+                torch.exp(-w_ensemble_temperature * teacher_output_loss.float())
             w_adaptive_unsupervised = 1 - w_adaptive_ensemble
         else:
             w_adaptive_unsupervised = torch.ones_like(w_adaptive_ensemble)
@@ -447,20 +503,21 @@ class MonitoredDistillationModel(object):
         loss_structure = []
 
         if pose0to1 is not None or pose0to2 is not None:
-            points = loss_utils.backproject_to_camera(output_depth0, intrinsics0, shape)
+            points = loss_utils.backproject_to_camera(
+                output_depth0,
+                intrinsics0,
+                shape,
+                intrinsics_inverse=intrinsics0_inverse)
 
         if pose0to1 is not None:
             xy0to1 = loss_utils.project_to_pixel(points, pose0to1, intrinsics0, shape)
             image1to0 = loss_utils.grid_sample(image1, xy0to1, shape)
 
-            loss_color1to0 = loss_utils.color_consistency_loss_func(
-                image0,
-                image1to0,
-                reduce_loss=False)
-            loss_structure1to0 = loss_utils.structural_consistency_loss_func(
+            loss_color1to0, loss_structure1to0 = loss_utils.photometric_consistency_loss_func(
                 image0,
                 image1to0,
-                reduce_loss=False)
+                reduce_loss=False,
+                src_statistics=image0_statistics)
 
             loss_color.append(w_monocular * loss_color1to0)
             loss_structure.append(w_monocular * loss_structure1to0)
@@ -471,15 +528,11 @@ class MonitoredDistillationModel(object):
             xy0to2 = loss_utils.project_to_pixel(points, pose0to2, intrinsics0, shape)
             image2to0 = loss_utils.grid_sample(image2, xy0to2, shape)
 
-            loss_color2to0 = loss_utils.color_consistency_loss_func(
-                image0,
-                image2to0,
-                reduce_loss=False)
-
-            loss_structure2to0 = loss_utils.structural_consistency_loss_func(
+            loss_color2to0, loss_structure2to0 = loss_utils.photometric_consistency_loss_func(
                 image0,
                 image2to0,
-                reduce_loss=False)
+                reduce_loss=False,
+                src_statistics=image0_statistics)
 
             loss_color.append(w_monocular * loss_color2to0)
             loss_structure.append(w_monocular * loss_structure2to0)
@@ -489,15 +542,11 @@ class MonitoredDistillationModel(object):
         if image3 is not None:
             image3to0 = loss_utils.warp1d_horizontal(image3, -fb / output_depth0)
 
-            loss_color3to0 = loss_utils.color_consistency_loss_func(
+            loss_color3to0, loss_structure3to0 = loss_utils.photometric_consistency_loss_func(
                 image0,
                 image3to0,
-                reduce_loss=False)
-
-            loss_structure3to0 = loss_utils.structural_consistency_loss_func(
-                image0,
-                image3to0,
-                reduce_loss=False)
+                reduce_loss=False,
+                src_statistics=image0_statistics)
 
             loss_color.append(w_stereo * loss_color3to0)
             loss_structure.append(w_stereo * loss_structure3to0)
@@ -559,6 +608,9 @@ class MonitoredDistillationModel(object):
             'loss' : loss,
         }
 
+        if ensemble_selection_agreement is not None:
+            loss_info['ensemble_selection_agreement'] = ensemble_selection_agreement
+
         images_info = {
             'image1to0': image1to0,
             'image2to0': image2to0,
@@ -569,6 +621,250 @@ class MonitoredDistillationModel(object):
 
         return loss, loss_info, images_info
 
+    def score_teacher_output(self,
+                             teacher_output0,
+                             image0,
+                             image0_statistics=None,
+                             teacher_selection_map0=None,
+                             image1=None,
+                             image2=None,
+                             image3=None,
+                             pose0to1=None,
+                             pose0to2=None,
+                             intrinsics0=None,
+                             intrinsics0_inverse=None,
+                             fb=None):
+        '''
+        Computes photometric reprojection error of each teacher in an ensemble,
+        taking the minimum across stereo and temporal views
+
+        Arg(s):
+            teacher_output0 : torch.Tensor[float32]
+                N x M x H x W teacher output from ensemble for left image
+            image0 : torch.Tensor[float32]
+                N x 3 x H x W left image
+            image0_statistics : tuple[torch.Tensor[float32]]
+                SSIM statistics of left image, if None then they are computed from image0
+            teacher_selection_map0 : torch.Tensor[float32]
+                N x M x H x W precomputed stereo reprojection error of each teacher
+            image1 : torch.Tensor[float32]
+                N x 3 x H x W t-1 image
+            image2 : torch.Tensor[float32]
+                N x 3 x H x W t+1 image
+            image3 : torch.Tensor[float32]
+                N x 3 x H x W right image, if None then stereo view is not used
+            pose0to1 : torch.Tensor[float32]
+                N x 4 x 4 transformation matrix, if None then temporal views are not used
+            pose0to2 : torch.Tensor[float32]
+                N x 4 x 4 transformation matrix, if None then temporal views are not used
+            intrinsics0 : torch.Tensor[float32]
+                N x 3 x 3 camera intrinsics matrix for left camera
+            intrinsics0_inverse : torch.Tensor[float32]
+                N x 3 x 3 inverse of camera intrinsics matrix for left camera
+            fb : torch.Tensor[float32]
+                N x 1 x 1 x 1 product of focal length and baseline for left camera
+        Returns:
+            torch.Tensor[float32] : N x M x H x W reprojection error of each teacher
+                or empty list if no views are available
+        '''
+
+        ensemble_loss = loss_utils.structural_consistency_loss_func
+
+        if image0_statistics is None:
+            image0_statistics = loss_utils.structural_consistency_statistics(image0)
+
+        lossesxto0_ensemble = []
+
+        # Fold teachers into batch dimension to evaluate all of them at once:
+        # N x M x H x W -> (M x N) x 1 x H x W, ordered teacher-major
+        N, M, H, W = teacher_output0.shape
+
+        teacher_output0_ensemble = \
+            teacher_output0.transpose(0, 1).reshape(M * N, 1, H, W)
+
+        shape_ensemble = (M * N,) + tuple(image0.shape[1:])
+
+        if image3 is not None and teacher_selection_map0 is not None:
+            # Stereo error does not depend on the student so it can be precomputed
+            losses3to0_ensemble = \
+                teacher_selection_map0.transpose(0, 1).reshape(M * N, 1, H, W)
+
+            lossesxto0_ensemble.append(losses3to0_ensemble)
+        elif image3 is not None:
+            images3to0_ensemble = loss_utils.warp1d_horizontal(
+                image3.repeat(M, 1, 1, 1),
+                -fb.repeat(M, 1, 1, 1) / teacher_output0_ensemble)
+
+            losses3to0_ensemble = ensemble_loss(
+                image0,
+                images3to0_ensemble,
+                reduce_loss=False,
+                src_statistics=image0_statistics)
+
+            lossesxto0_ensemble.append(losses3to0_ensemble)
+
+        if pose0to2 is not None and pose0to1 is not None:
+            intrinsics0_ensemble = intrinsics0.repeat(M, 1, 1)
+
+            # Backproject teacher output once and reuse for both temporal views
+            points_ensemble = loss_utils.backproject_to_camera(
+                teacher_output0_ensemble,
+                intrinsics0_ensemble,
+                shape_ensemble,
+                intrinsics_inverse=intrinsics0_inverse.repeat(M, 1, 1))
+
+            xy0to1_ensemble = loss_utils.project_to_pixel(
+                points_ensemble,
+                pose0to1.repeat(M, 1, 1),
+                intrinsics0_ensemble,
+                shape_ensemble)
+
+            images1to0_ensemble = loss_utils.grid_sample(
+                image1.repeat(M, 1, 1, 1),
+                xy0to1_ensemble,
+                shape_ensemble)
+
+            losses1to0_ensemble = ensemble_loss(
+                image0,
+                images1to0_ensemble,
+                reduce_loss=False,
+                src_statistics=image0_statistics)
+
+            lossesxto0_ensemble.append(losses1to0_ensemble)
+
+            xy0to2_ensemble = loss_utils.project_to_pixel(
+                points_ensemble,
+                pose0to2.repeat(M, 1, 1),
+                intrinsics0_ensemble,
+                shape_ensemble)
+
+            images2to0_ensemble = loss_utils.grid_sample(
+                image2.repeat(M, 1, 1, 1),
+                xy0to2_ensemble,
+                shape_ensemble)
+
+            losses2to0_ensemble = ensemble_loss(
+                image0,
+                images2to0_ensemble,
+                reduce_loss=False,
+                src_statistics=image0_statistics)
+
+            lossesxto0_ensemble.append(losses2to0_ensemble)
+
+        if len(lossesxto0_ensemble) == 0:
+            return []
+
+        # Minimum reprojection error across views: (M x N) x 1 x H x W
+        losses_ensemble, _ = torch.min(
+            torch.cat(lossesxto0_ensemble, dim=1), dim=1, keepdim=True)
+
+        # Unfold teachers from batch dimension: N x M x H x W
+        return losses_ensemble.view(M, N, H, W).transpose(0, 1)
+
+    def score_teacher_output_downsampled(self,
+                                         scale,
+                                         teacher_output0,
+                                         image0,
+                                         teacher_selection_map0=None,
+                                         image1=None,
+                                         image2=None,
+                                         image3=None,
+                                         pose0to1=None,
+                                         pose0to2=None,
+                                         intrinsics0=None,
+                                         focal_length_baseline0=None):
+        '''
+        Computes photometric reprojection error of each teacher in an ensemble
+        (see score_teacher_output) on images and teacher output downsampled by scale
+
+        Arg(s):
+            scale : float
+                factor to downsample height and width by e.g. 0.5
+            teacher_output0 : torch.Tensor[float32]
+                N x M x H x W teacher output from ensemble for left image
+            image0 : torch.Tensor[float32]
+                N x 3 x H x W left image
+            teacher_selection_map0 : torch.Tensor[float32]
+                N x M x H x W precomputed stereo reprojection error of each teacher
+            image1 : torch.Tensor[float32]
+                N x 3 x H x W t-1 image
+            image2 : torch.Tensor[float32]
+                N x 3 x H x W t+1 image
+            image3 : torch.Tensor[float32]
+                N x 3 x H x W right image, if None then stereo view is not used
+            pose0to1 : torch.Tensor[float32]
+                N x 4 x 4 transformation matrix, if None then temporal views are not used
+            pose0to2 : torch.Tensor[float32]
+                N x 4 x 4 transformation matrix, if None then temporal views are not used
+            intrinsics0 : torch.Tensor[float32]
+                N x 3 x 3 camera intrinsics matrix for left camera
+            focal_length_baseline0 : torch.Tensor[float32]
+                N x 2 focal length and baseline for left camera
+        Returns:
+            torch.Tensor[float32] : N x M x h x w reprojection error of each teacher
+                or empty list if no views are available
+        '''
+
+        _, _, H, W = teacher_output0.shape
+
+        n_height = max(int(H * scale), 1)
+        n_width = max(int(W * scale), 1)
+
+        scale_x = n_width / W
+        scale_y = n_height / H
+
+        def downsample(T, mode):
+            if T is None:
+                return None
+
+            return torch.nn.functional.interpolate(T, size=(n_height, n_width), mode=mode)
+
+        # Average intensities and errors, but keep depth of a single teacher pixel
+        image0, image1, image2, image3, teacher_selection_map0 = [
+            downsample(T, mode='area')
+            for T in [image0, image1, image2, image3, teacher_selection_map0]
+        ]
+
+        teacher_output0 = downsample(teacher_output0, mode='nearest')
+
+        if intrinsics0 is not None:
+            scale_intrinsics = torch.tensor([
+                [scale_x, 1.0,     scale_x],
+                [1.0,     scale_y, scale_y],
+                [1.0,     1.0,     1.0]], dtype=torch.float32, device=intrinsics0.device)
+
+            # Pixel centers shift when downsampling, so principal point is offset by
+            # 0.5 * s - 0.5 e.g. cx' = cx * sx + 0.5 * sx - 0.5
+            offset_intrinsics = torch.tensor([
+                [0.0, 0.0, 0.5 * scale_x - 0.5],
+                [0.0, 0.0, 0.5 * scale_y - 0.5],
+                [0.0, 0.0, 0.0]], dtype=torch.float32, device=intrinsics0.device)
+
+            intrinsics0 = intrinsics0 * scale_intrinsics.view(1, 3, 3) + offset_intrinsics.view(1, 3, 3)
+            intrinsics0_inverse = torch.inverse(intrinsics0)
+        else:
+            intrinsics0_inverse = None
+
+        # Disparity is in pixels so it scales with width
+        if image3 is not None:
+            fb = focal_length_baseline0[:, 0] * focal_length_baseline0[:, 1] * scale_x
+            fb = fb[:, None, None, None]
+        else:
+            fb = None
+
+        return self.score_teacher_output(
+            teacher_output0=teacher_output0,
+            image0=image0,
+            teacher_selection_map0=teacher_selection_map0,
+            image1=image1,
+            image2=image2,
+            image3=image3,
+            pose0to1=pose0to1,
+            pose0to2=pose0to2,
+            intrinsics0=intrinsics0,
+            intrinsics0_inverse=intrinsics0_inverse,
+            fb=fb)
+
     def parameters(self):
         '''
         Returns the list of parameters in the model
@@ -616,7 +912,7 @@ class MonitoredDistillationModel(object):
         self.encoder.to(device)
         self.decoder.to(device)
 
-    def save_model(self, checkpoint_path, step, optimizer):
+    def save_model(self, checkpoint_path, step, optimizer, mixed_precision='none', grad_scaler=None):
         '''
         Save weights of the model to checkpoint path
 
@@ -627,12 +923,22 @@ class MonitoredDistillationModel(object):
                 current training step
             optimizer : torch.optim
                 optimizer
+            mixed_precision : str
+                mixed precision mode used for training: none, fp16, bf16
+            grad_scaler : torch.cuda.amp.GradScaler
+                gradient scaler used for fp16 training
         '''
 
         checkpoint = {}
         checkpoint['train_step'] = step
         checkpoint['optimizer_state_dict'] = optimizer.state_dict()
 
+        # Save mixed precision mode and loss scale so training resumes with the same settings
+        checkpoint['mixed_precision'] = mixed_precision
+
+        if grad_scaler is not None and grad_scaler.is_enabled():
+            checkpoint['grad_scaler_state_dict'] = grad_scaler.state_dict()
+
         # Load weights for sparse_to_dense_depth, encoder, and decoder
         checkpoint['sparse_to_dense_pool_state_dict'] = self.sparse_to_dense_pool.state_dict()
         checkpoint['encoder_state_dict'] = self.encoder.state_dict()
@@ -640,7 +946,7 @@ class MonitoredDistillationModel(object):
 
         torch.save(checkpoint, checkpoint_path)
 
-    def restore_model(self, checkpoint_path, optimizer=None):
+    def restore_model(self, checkpoint_path, optimizer=None, mixed_precision=None, grad_scaler=None):
         '''
         Restore weights of the model
 
@@ -649,6 +955,10 @@ class MonitoredDistillationModel(object):
                 path to checkpoint
             optimizer : torch.optim
                 optimizer
+            mixed_precision : str
+                mixed precision mode to resume training with: none, fp16, bf16
+            grad_scaler : torch.cuda.amp.GradScaler
+                gradient scaler to restore loss scale into for fp16 training
         Returns:
             int : current step in optimization
             torch.optim : optimizer with restored state
@@ -664,6 +974,17 @@ class MonitoredDistillationModel(object):
         if optimizer is not None:
             optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
 
+        # Checkpoints saved before mixed precision was supported were trained in float32
+        checkpoint_mixed_precision = checkpoint.get('mixed_precision', 'none')
+
+        if mixed_precision is not None and mixed_precision != checkpoint_mixed_precision:
+            print('[Depth] Checkpoint was trained with mixed_precision={}, resuming with mixed_precision={}'.format(
+                checkpoint_mixed_precision, mixed_precision))
+
+        if grad_scaler is not None and grad_scaler.is_enabled() and \
+                'grad_scaler_state_dict' in checkpoint:
+            grad_scaler.load_state_dict(checkpoint['grad_scaler_state_dict'])
+
         return checkpoint['train_step'], optimizer
 
     def data_parallel(self):
@@ -19,6 +19,13 @@ https://arxiv.org/abs/2203.16034
 '''
 
 import torch
+import functools, collections, contextlib
+
+
+# Maximum number of coordinate grids to keep in cache
+GRID_CACHE_SIZE = 32
+
+_grid_cache = collections.OrderedDict()
 
 def activation_func(activation_fn):
     '''
@@ -753,12 +760,16 @@ class OutlierRemoval(object):
             local neighborhood to consider
         threshold : float
             depth difference threshold
+        sparse_aware : bool
+            if set, then only neighborhoods of valid points are considered
+            (see remove_outliers_sparse), otherwise full depth map is pooled
     '''
 
-    def __init__(self, kernel_size=7, threshold=1.5):
+    def __init__(self, kernel_size=7, threshold=1.5, sparse_aware=False):
 
         self.kernel_size = kernel_size
         self.threshold = threshold
+        self.sparse_aware = sparse_aware
 
     def remove_outliers(self, sparse_depth, validity_map):
         '''
@@ -774,26 +785,27 @@ class OutlierRemoval(object):
             torch.Tensor[float32] : N x 1 x H x W validity map
         '''
 
+        if self.sparse_aware:
+            return self.remove_outliers_sparse(sparse_depth, validity_map)
+
         # Replace all zeros with large values
-        max_value = 10 * torch.max(sparse_depth)
-        sparse_depth_max_filled = torch.where(
-            validity_map <= 0,
-            torch.full_like(sparse_depth, fill_value=max_value),
-            sparse_depth)
+        sparse_depth_max_filled = self.fill_invalid(sparse_depth, validity_map)
 
-        # For each neighborhood find the smallest value
+        # For each neighborhood find the smallest value, pooling rows then columns,
+        # positions outside of depth map are ignored like the large fill value
         padding = self.kernel_size // 2
-        sparse_depth_max_filled = torch.nn.functional.pad(
-            input=sparse_depth_max_filled,
-            pad=(padding, padding, padding, padding),
-            mode='constant',
-            value=max_value)
 
-        min_values = -torch.nn.functional.max_pool2d(
+        min_values = torch.nn.functional.max_pool2d(
             input=-sparse_depth_max_filled,
-            kernel_size=self.kernel_size,
+            kernel_size=(1, self.kernel_size),
             stride=1,
-            padding=0)
+            padding=(0, padding))
+
+        min_values = -torch.nn.functional.max_pool2d(
+            input=min_values,
+            kernel_size=(self.kernel_size, 1),
+            stride=1,
+            padding=(padding, 0))
 
         # If measurement differs a lot from minimum value then remove
         validity_map_clean = torch.where(
@@ -807,10 +819,184 @@ class OutlierRemoval(object):
 
         return sparse_depth_clean, validity_map_clean
 
+    def remove_outliers_sparse(self, sparse_depth, validity_map):
+        '''
+        Removes erroneous measurements from sparse depth and validity map by only
+        gathering the neighborhoods of valid points, which is cheaper than pooling
+        the full depth map when few points (e.g. ~5% for lidar) are valid
+
+        Arg(s):
+            sparse_depth : torch.Tensor[float32]
+                N x 1 x H x W tensor sparse depth
+            validity_map : torch.Tensor[float32]
+                N x 1 x H x W tensor validity map
+        Returns:
+            torch.Tensor[float32] : N x 1 x H x W sparse depth
+            torch.Tensor[float32] : N x 1 x H x W validity map
+        '''
+
+        n_batch, _, n_height, n_width = sparse_depth.shape
+
+        # Replace all zeros and positions outside of depth map with large values
+        sparse_depth_max_filled = self.fill_invalid(sparse_depth, validity_map)
+
+        padding = self.kernel_size // 2
+        n_height_padded = n_height + 2 * padding
+        n_width_padded = n_width + 2 * padding
+
+        sparse_depth_max_filled = torch.nn.functional.pad(
+            input=sparse_depth_max_filled,
+            pad=(padding, padding, padding, padding),
+            mode='constant',
+            value=float('inf'))
+
+        # Batch, row and column index of each valid point
+        b, _, y, x = torch.nonzero(validity_map > 0, as_tuple=True)
+
+        # Top left corner of neighborhood of each point in padded depth map is (y, x)
+        indices = b * (n_height_padded * n_width_padded) + y * n_width_padded + x
+
+        offsets = torch.arange(self.kernel_size, device=sparse_depth.device)
+        offsets = (offsets.view(-1, 1) * n_width_padded + offsets.view(1, -1)).view(1, -1)
+
+        # P x K^2 neighborhood for each point, then find the smallest value
+        neighborhoods = torch.take(
+            sparse_depth_max_filled,
+            indices.view(-1, 1) + offsets)
+
+        min_values, _ = torch.min(neighborhoods, dim=1)
+
+        # If measurement differs a lot from minimum value then remove
+        is_outlier = min_values < sparse_depth[b, 0, y, x] - self.threshold
+
+        validity_map_clean = torch.ones_like(validity_map)
+        validity_map_clean[b[is_outlier], 0, y[is_outlier], x[is_outlier]] = 0.0
+
+        # Update sparse depth and validity map
+        validity_map_clean = validity_map * validity_map_clean
+        sparse_depth_clean = sparse_depth * validity_map_clean
+
+        return sparse_depth_clean, validity_map_clean
+
+    def fill_invalid(self, sparse_depth, validity_map):
+        '''
+        Replaces invalid points with a value larger than any valid point in the
+        same sample so that they are never the smallest value in a neighborhood
+
+        Arg(s):
+            sparse_depth : torch.Tensor[float32]
+                N x 1 x H x W tensor sparse depth
+            validity_map : torch.Tensor[float32]
+                N x 1 x H x W tensor validity map
+        Returns:
+            torch.Tensor[float32] : N x 1 x H x W sparse depth with invalid points filled
+        '''
+
+        n_batch = sparse_depth.shape[0]
+
+        # Fill value for each sample
+        max_values, _ = torch.max(sparse_depth.reshape(n_batch, -1), dim=1)
+        max_values = 10 * max_values.view(n_batch, 1, 1, 1)
+
+        return torch.where(
+            validity_map <= 0,
+            max_values.expand_as(sparse_depth),
+            sparse_depth)
+
+
+'''
+Mixed precision utilities
+'''
+# Data types of autocast regions for each mixed precision mode
+MIXED_PRECISION_DTYPES = {
+    'fp16' : torch.float16,
+    'bf16' : torch.bfloat16
+}
+
+def autocast(device, mixed_precision='none'):
+    '''
+    Creates an autocast region for a mixed precision mode. Float16 is only supported
+    on CUDA, bfloat16 is supported on both CUDA and CPU. Mixed precision requires
+    torch.autocast (PyTorch 1.10 or newer), mode none works on any version
+
+    Arg(s):
+        device : torch.device
+            device that the region runs on
+        mixed_precision : str
+            none, fp16, bf16
+    Returns:
+        context manager : autocast region or empty context if mixed precision is none
+    '''
+
+    if mixed_precision == 'none':
+        return contextlib.nullcontext()
+    elif mixed_precision not in MIXED_PRECISION_DTYPES:
+        raise ValueError('Unsupported mixed precision: {}'.format(mixed_precision))
+
+    if not hasattr(torch, 'autocast'):
+        raise ValueError('Mixed precision {} requires PyTorch 1.10 or newer, found {}'.format(
+            mixed_precision, torch.__version__))
+
+    if mixed_precision == 'fp16' and device.type != 'cuda':
+        raise ValueError('Mixed precision fp16 requires CUDA, use bf16 on {}'.format(device.type))
+
+    return torch.autocast(
+        device_type=device.type,
+        dtype=MIXED_PRECISION_DTYPES[mixed_precision])
+
+def autocast_float32(func):
+    '''
+    Decorator that runs a function outside of any autocast region and casts its
+    floating point tensor arguments to float32. Used for numerically sensitive
+    operations e.g. projections, warping and SSIM
+
+    Arg(s):
+        func : func
+            function to wrap
+    Returns:
+        func : wrapped function
+    '''
+
+    def to_float32(arg):
+        if torch.is_tensor(arg) and arg.is_floating_point():
+            return arg.float()
+        return arg
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        tensors = [
+            arg for arg in list(args) + list(kwargs.values()) if torch.is_tensor(arg)
+        ]
+
+        # CPU autocast is only available in PyTorch 1.10 or newer
+        is_autocast_cpu_enabled = getattr(torch, 'is_autocast_cpu_enabled', lambda: False)
+
+        autocast_enabled = \
+            torch.is_autocast_enabled() or is_autocast_cpu_enabled()
+
+        if len(tensors) == 0 or not autocast_enabled:
+            return func(*args, **kwargs)
+
+        if hasattr(torch, 'autocast'):
+            autocast_disabled = torch.autocast(device_type=tensors[0].device.type, enabled=False)
+        else:
+            autocast_disabled = torch.cuda.amp.autocast(enabled=False)
+
+        with autocast_disabled:
+            args = [to_float32(arg) for arg in args]
+            kwargs = {
+                key : to_float32(value) for key, value in kwargs.items()
+            }
+
+            return func(*args, **kwargs)
+
+    return wrapper
+
 
 '''
 Pose regression layer
 '''
+@autocast_float32
 def pose_matrix(v, rotation_parameterization='axis'):
     '''
     Convert 6 DoF parameters to transformation matrix
@@ -915,9 +1101,46 @@ def get_translation_matrix(translation_vector):
 
     return T
 
-def meshgrid(n_batch, n_height, n_width, device, homogeneous=True):
+def get_cached_grid(key, create_func):
+    '''
+    Fetches a constant tensor (e.g. coordinate grid) from a bounded cache, creating it
+    if it does not exist. Least recently used tensors are evicted once the cache is full.
+    Tensors in the cache are shared across calls and must not be modified in place
+
+    Arg(s):
+        key : tuple
+            key to identify tensor e.g. (name, batch, height, width, device, dtype)
+        create_func : func
+            function with no arguments that creates the tensor
+    Returns:
+        torch.Tensor : cached tensor
+    '''
+
+    if key in _grid_cache:
+        _grid_cache.move_to_end(key)
+        return _grid_cache[key]
+
+    with torch.no_grad():
+        grid = create_func()
+
+    _grid_cache[key] = grid
+
+    while len(_grid_cache) > GRID_CACHE_SIZE:
+        _grid_cache.popitem(last=False)
+
+    return grid
+
+def clear_grid_cache():
+    '''
+    Removes all tensors stored in the coordinate grid cache
+    '''
+
+    _grid_cache.clear()
+
+def meshgrid(n_batch, n_height, n_width, device, homogeneous=True, dtype=torch.float32):
     '''
-    Creates N x 2 x H x W meshgrid in x, y directions
+    Creates N x 2 x H x W meshgrid in x, y directions. Grids are cached so the
+    returned tensor must not be modified in place
 
     Arg(s):
         n_batch : int
@@ -930,27 +1153,34 @@ def meshgrid(n_batch, n_height, n_width, device, homogeneous=True):
             device on which to create meshgrid
         homoegenous : bool
             if set, then add homogeneous coordinates (N x H x W x 3)
+        dtype : torch.dtype
+            data type of meshgrid
     Return:
         torch.Tensor[float32]: N x 2 x H x W meshgrid of x, y and 1 (if homogeneous)
     '''
 
-    x = torch.linspace(start=0.0, end=n_width-1, steps=n_width, device=device)
-    y = torch.linspace(start=0.0, end=n_height-1, steps=n_height, device=device)
+    def create_meshgrid():
+        x = torch.linspace(start=0.0, end=n_width-1, steps=n_width, device=device, dtype=dtype)
+        y = torch.linspace(start=0.0, end=n_height-1, steps=n_height, device=device, dtype=dtype)
 
-    # Create H x W grids
-    grid_y, grid_x = torch.meshgrid(y, x)
+        # Create H x W grids
+        grid_y, grid_x = torch.meshgrid(y, x)
 
-    if homogeneous:
-        # Create 3 x H x W grid (x, y, 1)
-        grid_xy = torch.stack([grid_x, grid_y, torch.ones_like(grid_x)], dim=0)
-    else:
-        # Create 2 x H x W grid (x, y)
-        grid_xy = torch.stack([grid_x, grid_y], dim=0)
+        if homogeneous:
+            # Create 3 x H x W grid (x, y, 1)
+            grid_xy = torch.stack([grid_x, grid_y, torch.ones_like(grid_x)], dim=0)
+        else:
+            # Create 2 x H x W grid (x, y)
+            grid_xy = torch.stack([grid_x, grid_y], dim=0)
+
+        grid_xy = torch.unsqueeze(grid_xy, dim=0) \
+            .repeat(n_batch, 1, 1, 1)
+
+        return grid_xy
 
-    grid_xy = torch.unsqueeze(grid_xy, dim=0) \
-        .repeat(n_batch, 1, 1, 1)
+    key = ('meshgrid', n_batch, n_height, n_width, str(device), dtype, homogeneous)
 
-    return grid_xy
+    return get_cached_grid(key, create_meshgrid)
 
 def load_state_dict(model, state_dict):
     '''
@@ -1765,19 +1765,8 @@ class SparseToDensePool(torch.nn.Module):
             s for s in max_pool_sizes if s > 1
         ]
 
-        # Construct min pools
-        self.min_pools = []
-        for s in self.min_pool_sizes:
-            padding = s // 2
-            pool = torch.nn.MaxPool2d(kernel_size=s, stride=1, padding=padding)
-            self.min_pools.append(pool)
-
-        # Construct max pools
-        self.max_pools = []
-        for s in self.max_pool_sizes:
-            padding = s // 2
-            pool = torch.nn.MaxPool2d(kernel_size=s, stride=1, padding=padding)
-            self.max_pools.append(pool)
+        for s in self.min_pool_sizes + self.max_pool_sizes:
+            assert s % 2 == 1, 'Pool sizes must be odd: {}'.format(s)
 
         self.len_pool_sizes = len(self.min_pool_sizes) + len(self.max_pool_sizes)
 
@@ -1827,18 +1816,20 @@ class SparseToDensePool(torch.nn.Module):
         pool_pyramid = []
 
         # Use min and max pooling to densify and increase receptive field
-        for pool, s in zip(self.min_pools, self.min_pool_sizes):
+        if len(self.min_pool_sizes) > 0:
             # Set flag (999) for any zeros and max pool on -z then revert the values
-            z_pool = -pool(torch.where(z == 0, -999 * torch.ones_like(z), -z))
-            # Remove any 999 from the results
-            z_pool = torch.where(z_pool == 999, torch.zeros_like(z), z_pool)
+            z_negative = torch.where(z == 0, torch.full_like(z, -999), -z)
 
-            pool_pyramid.append(z_pool)
+            z_pools = self.max_pool_cascade(z_negative, self.min_pool_sizes)
 
-        for pool, s in zip(self.max_pools, self.max_pool_sizes):
-            z_pool = pool(z)
+            zeros = torch.zeros_like(z)
 
-            pool_pyramid.append(z_pool)
+            for z_pool in z_pools:
+                # Remove any 999 from the results
+                pool_pyramid.append(torch.where(z_pool == -999, zeros, -z_pool))
+
+        if len(self.max_pool_sizes) > 0:
+            pool_pyramid.extend(self.max_pool_cascade(z, self.max_pool_sizes))
 
         # Stack max and minpools into pyramid
         pool_pyramid = torch.cat(pool_pyramid, dim=1)
@@ -1849,3 +1840,44 @@ class SparseToDensePool(torch.nn.Module):
         pool_convs = torch.cat([pool_convs, x], dim=1)
 
         return self.conv(pool_convs)
+
+    def max_pool_cascade(self, x, pool_sizes):
+        '''
+        Max pools with stride 1 for several odd kernel sizes, where each kernel
+        size is computed from the next smaller one (a max over s + d window is a
+        max over d + 1 window of max over s windows) and each pool is separated
+        into a row and a column pool. Outputs are identical to independent pools
+
+        Arg(s):
+            x : torch.Tensor[float32]
+                N x C x H x W tensor
+            pool_sizes : list[int]
+                list of odd pool sizes s (kernel size is s x s)
+        Returns:
+            list[torch.Tensor[float32]] : N x C x H x W tensor for each pool size in given order
+        '''
+
+        x_pools = {}
+
+        x_pool = x
+        pool_size_prev = 1
+
+        for s in sorted(set(pool_sizes)):
+            # Grow window from previous pool size to s
+            k = s - pool_size_prev + 1
+
+            x_pool = torch.nn.functional.max_pool2d(
+                x_pool,
+                kernel_size=(1, k),
+                stride=1,
+                padding=(0, k // 2))
+            x_pool = torch.nn.functional.max_pool2d(
+                x_pool,
+                kernel_size=(k, 1),
+                stride=1,
+                padding=(k // 2, 0))
+
+            x_pools[s] = x_pool
+            pool_size_prev = s
+
+        return [x_pools[s] for s in pool_sizes]
@@ -143,7 +143,7 @@ class PoseNetModel(object):
         self.encoder.to(device)
         self.decoder.to(device)
 
-    def save_model(self, checkpoint_path, step, optimizer):
+    def save_model(self, checkpoint_path, step, optimizer, mixed_precision='none', grad_scaler=None):
         '''
         Save weights of the model to checkpoint path
         Arg(s):
@@ -153,6 +153,10 @@ class PoseNetModel(object):
                 current training step
             optimizer : torch.optim
                 optimizer
+            mixed_precision : str
+                mixed precision mode used for training: none, fp16, bf16
+            grad_scaler : torch.cuda.amp.GradScaler
+                gradient scaler used for fp16 training
         '''
 
         checkpoint = {}
@@ -160,13 +164,19 @@ class PoseNetModel(object):
         checkpoint['train_step'] = step
         checkpoint['optimizer_state_dict'] = optimizer.state_dict()
 
+        # Save mixed precision mode and loss scale so training resumes with the same settings
+        checkpoint['mixed_precision'] = mixed_precision
+
+        if grad_scaler is not None and grad_scaler.is_enabled():
+            checkpoint['grad_scaler_state_dict'] = grad_scaler.state_dict()
+
         # Save encoder and decoder weights
         checkpoint['encoder_state_dict'] = self.encoder.state_dict()
         checkpoint['decoder_state_dict'] = self.decoder.state_dict()
 
         torch.save(checkpoint, checkpoint_path)
 
-    def restore_model(self, checkpoint_path, optimizer=None):
+    def restore_model(self, checkpoint_path, optimizer=None, mixed_precision=None, grad_scaler=None):
         '''
         Restore weights of the model
         Arg(s):
@@ -174,6 +184,10 @@ class PoseNetModel(object):
                 path to checkpoint
             optimizer : torch.optim
                 optimizer
+            mixed_precision : str
+                mixed precision mode to resume training with: none, fp16, bf16
+            grad_scaler : torch.cuda.amp.GradScaler
+                gradient scaler to restore loss scale into for fp16 training
         Returns:
             int : current step in optimization
             torch.optim : optimizer with restored state
@@ -188,6 +202,17 @@ class PoseNetModel(object):
         if optimizer is not None:
             optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
 
+        # Checkpoints saved before mixed precision was supported were trained in float32
+        checkpoint_mixed_precision = checkpoint.get('mixed_precision', 'none')
+
+        if mixed_precision is not None and mixed_precision != checkpoint_mixed_precision:
+            print('[Pose] Checkpoint was trained with mixed_precision={}, resuming with mixed_precision={}'.format(
+                checkpoint_mixed_precision, mixed_precision))
+
+        if grad_scaler is not None and grad_scaler.is_enabled() and \
+                'grad_scaler_state_dict' in checkpoint:
+            grad_scaler.load_state_dict(checkpoint['grad_scaler_state_dict'])
+
         # Return the current step and optimizer
         return checkpoint['train_step'], optimizer
 
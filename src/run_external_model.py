@@ -27,7 +27,7 @@ from external_model import ExternalModel
 from PIL import Image
 
 
-def run(model, dataloader, output_paths=None, verbose=False):
+def run(model, dataloader, output_paths=None, verbose=False, output_writer=None):
     '''
     Runs an external depth completion model
     if output paths are provided, then will save outputs to a predetermined list of paths
@@ -39,6 +39,10 @@ def run(model, dataloader, output_paths=None, verbose=False):
             dataloader that outputs an image and a range map
         output_paths : list[str]
             list of paths to store output depth
+        verbose : bool
+            if set, then print progress
+        output_writer : data_utils.OutputWriter
+            if given, then save outputs in background instead of waiting for each save
     Returns:
         list[numpy[float32]] : list of depth maps if output paths is None else no return value
     '''
@@ -47,12 +51,15 @@ def run(model, dataloader, output_paths=None, verbose=False):
     images = []
     sparse_depths = []
 
-    n_sample = len(dataloader)
+    n_sample = len(dataloader.dataset)
 
     if output_paths is not None:
         assert len(output_paths) == n_sample
 
-    for idx, inputs in enumerate(dataloader):
+    # Index of first sample in each batch
+    idx = 0
+
+    for inputs in dataloader:
 
         # Move inputs to device
         inputs = [
@@ -61,6 +68,7 @@ def run(model, dataloader, output_paths=None, verbose=False):
 
         image, sparse_depth, intrinsics = inputs
 
+        n_batch = image.shape[0]
         n_height, n_width = image.shape[-2:]
 
         with torch.no_grad():
@@ -73,23 +81,229 @@ def run(model, dataloader, output_paths=None, verbose=False):
             assert output_depth.shape[-2] == n_height
             assert output_depth.shape[-1] == n_width
 
-        # Convert to numpy (if not converted already)
-        output_depth = np.squeeze(output_depth.detach().cpu().numpy())
-
-        if verbose:
-            print('Processed {}/{} samples'.format(idx + 1, n_sample), end='\r')
+        # Convert to numpy (if not converted already) as N x H x W
+        output_depth = output_depth.detach().cpu().numpy()
+        output_depth = np.reshape(output_depth, (n_batch, n_height, n_width))
 
-        # Return output depths as a list if we do not store them
         if output_paths is None:
-            output_depths.append(output_depth)
-            images.append(np.transpose(np.squeeze(image.cpu().numpy()), (1, 2, 0)))
-            sparse_depths.append(np.squeeze(sparse_depth.cpu().numpy()))
-        else:
-            data_utils.save_depth(output_depth, output_paths[idx])
+            image = np.transpose(image.cpu().numpy(), (0, 2, 3, 1))
+            sparse_depth = sparse_depth.cpu().numpy()
+
+        for batch_idx in range(n_batch):
+
+            # Return output depths as a list if we do not store them
+            if output_paths is None:
+                output_depths.append(output_depth[batch_idx])
+                images.append(image[batch_idx])
+                sparse_depths.append(sparse_depth[batch_idx, 0])
+            elif output_writer is not None:
+                output_writer.submit(
+                    save_output_depth,
+                    output_depth[batch_idx],
+                    output_paths[idx])
+            else:
+                save_output_depth(output_depth[batch_idx], output_paths[idx])
+
+            idx = idx + 1
+
+        if verbose:
+            print('Processed {}/{} samples'.format(idx, n_sample), end='\r')
 
     if output_paths is None:
         return images, sparse_depths, output_depths
 
+def save_output_depth(output_depth, path):
+    '''
+    Saves output depth to a temporary file and then moves it to path, so that
+    an interrupted run never leaves a partially written file at path
+
+    Arg(s):
+        output_depth : numpy[float32]
+            H x W depth map
+        path : str
+            path to store depth map
+    '''
+
+    dirpath, filename = os.path.split(path)
+    temp_path = os.path.join(dirpath, '.tmp-' + filename)
+
+    data_utils.save_depth(output_depth, temp_path)
+    os.replace(temp_path, path)
+
+def is_valid_output_depth(path, reference_path):
+    '''
+    Checks if output depth exists, is a complete PNG file and has the same shape as reference
+
+    Arg(s):
+        path : str
+            path to output depth
+        reference_path : str
+            path to image or depth map with the expected shape
+    Returns:
+        bool : if set, then output depth is valid
+    '''
+
+    if not os.path.exists(path):
+        return False
+
+    try:
+        with Image.open(path) as output_depth:
+            size = output_depth.size
+
+            # Checks integrity of file without decoding it
+            output_depth.verify()
+
+        with Image.open(reference_path) as reference:
+            return size == reference.size
+    except Exception:
+        return False
+
+def select_incomplete_outputs(output_paths, reference_paths):
+    '''
+    Finds samples whose output still needs to be generated
+
+    Arg(s):
+        output_paths : list[str]
+            paths to output depth
+        reference_paths : list[str]
+            paths to image or depth map with the expected shape for each output
+    Returns:
+        list[int] : indices of samples without a valid output
+    '''
+
+    return [
+        idx
+        for idx, (output_path, reference_path) in enumerate(zip(output_paths, reference_paths))
+        if not is_valid_output_depth(output_path, reference_path)
+    ]
+
+def batch_by_shape(reference_paths, n_batch):
+    '''
+    Groups consecutive samples with the same shape into batches of up to n_batch
+    samples, only image headers are read to get shapes
+
+    Arg(s):
+        reference_paths : list[str]
+            paths to image or depth map for each sample
+        n_batch : int
+            maximum number of samples per batch
+    Returns:
+        list[list[int]] : indices of samples in each batch
+    '''
+
+    batches = []
+    batch = []
+    batch_size = None
+
+    for idx, path in enumerate(reference_paths):
+
+        with Image.open(path) as image:
+            size = image.size
+
+        if len(batch) == n_batch or (len(batch) > 0 and size != batch_size):
+            batches.append(batch)
+            batch = []
+
+        batch.append(idx)
+        batch_size = size
+
+    if len(batch) > 0:
+        batches.append(batch)
+
+    return batches
+
+
+def generate_outputs(model,
+                     image_paths,
+                     sparse_depth_paths,
+                     intrinsics_paths,
+                     output_paths,
+                     load_image_triplets=False,
+                     n_batch=8,
+                     n_thread=8,
+                     n_thread_output=4,
+                     overwrite=False,
+                     verbose=False):
+    '''
+    Runs an external depth completion model over a list of samples in batches and
+    saves outputs in background. Samples that already have a valid output are skipped
+    so that an interrupted run can be resumed
+
+    Arg(s):
+        model : ExternalModel
+            external depth completion model instance
+        image_paths : list[str]
+            paths to images
+        sparse_depth_paths : list[str]
+            paths to sparse depth maps
+        intrinsics_paths : list[str]
+            paths to intrinsic camera calibration matrix
+        output_paths : list[str]
+            paths to store output depth
+        load_image_triplets : bool
+            Whether or not images are stored as triplets or single
+        n_batch : int
+            maximum number of samples per batch, batches only contain samples of the same shape
+        n_thread : int
+            number of threads for loading data
+        n_thread_output : int
+            number of threads for saving outputs
+        overwrite : bool
+            if set, then regenerate outputs that already exist
+        verbose : bool
+            if set, then print progress
+    '''
+
+    n_sample = len(image_paths)
+
+    for paths in [sparse_depth_paths, intrinsics_paths, output_paths]:
+        assert len(paths) == n_sample
+
+    # Skip samples that were completed by a previous run
+    if overwrite:
+        idxs = list(range(n_sample))
+    else:
+        idxs = select_incomplete_outputs(output_paths, sparse_depth_paths)
+
+    if verbose:
+        print('Found {}/{} samples with existing outputs'.format(n_sample - len(idxs), n_sample))
+
+    if len(idxs) == 0:
+        return
+
+    image_paths = [image_paths[idx] for idx in idxs]
+    sparse_depth_paths = [sparse_depth_paths[idx] for idx in idxs]
+    intrinsics_paths = [intrinsics_paths[idx] for idx in idxs]
+    output_paths = [output_paths[idx] for idx in idxs]
+
+    # Samples are batched in order so outputs line up with output paths
+    dataloader = torch.utils.data.DataLoader(
+        datasets.DepthCompletionInferenceDataset(
+            image_paths=image_paths,
+            sparse_depth_paths=sparse_depth_paths,
+            intrinsics_paths=intrinsics_paths,
+            load_image_triplets=load_image_triplets),
+        batch_sampler=batch_by_shape(sparse_depth_paths, n_batch),
+        num_workers=n_thread,
+        pin_memory=model.device.type == 'cuda')
+
+    output_writer = data_utils.OutputWriter(
+        n_thread=n_thread_output,
+        max_queue_size=4 * max(n_batch, n_thread_output))
+
+    try:
+        run(model,
+            dataloader,
+            output_paths=output_paths,
+            verbose=verbose,
+            output_writer=output_writer)
+    finally:
+        # Finish saving whatever has been computed
+        output_writer.close()
+
+    if verbose:
+        print('')
+
 
 if __name__ == '__main__':
 
@@ -46,10 +46,18 @@ parser.add_argument('--input_channels_depth',
     type=int, default=settings.INPUT_CHANNELS_DEPTH, help='Number of input depth channels')
 parser.add_argument('--normalized_image_range',
     nargs='+', type=float, default=settings.NORMALIZED_IMAGE_RANGE, help='Range of image intensities after normalization')
+parser.add_argument('--load_compact_inputs',
+    action='store_true', help='If set then load images as uint8 and depth as 16-bit and convert them on device')
+parser.add_argument('--load_sparse_depth_points',
+    action='store_true', help='If set then load sparse depth as list of points and scatter into depth map on device')
+parser.add_argument('--codec',
+    type=str, default=settings.CODEC, help='Backend to decode image and depth map files: pil, opencv, npz')
 parser.add_argument('--outlier_removal_kernel_size',
     type=int, default=settings.OUTLIER_REMOVAL_KERNEL_SIZE, help='Kernel size to filter outlier sparse depth')
 parser.add_argument('--outlier_removal_threshold',
     type=float, default=settings.OUTLIER_REMOVAL_THRESHOLD, help='Difference threshold to consider a point an outlier')
+parser.add_argument('--outlier_removal_sparse_aware',
+    action='store_true', help='If set then only consider neighborhoods of valid points to remove outliers')
 
 # Sparse to dense pool settings
 parser.add_argument('--min_pool_sizes_sparse_to_dense_pool',
@@ -112,6 +120,16 @@ parser.add_argument('--keep_input_filenames',
 # Hardware settings
 parser.add_argument('--device',
     type=str, default=settings.DEVICE, help='Device to use: cuda, gpu, cpu')
+parser.add_argument('--n_batch',
+    type=int, default=settings.N_BATCH_EVALUATE, help='Number of samples per batch, greater than 1 requires all samples to have the same shape')
+parser.add_argument('--n_thread',
+    type=int, default=settings.N_THREAD_EVALUATE, help='Number of threads for loading data')
+parser.add_argument('--pin_memory',
+    action='store_true', help='If set then load batches into pinned memory for faster transfer to device')
+parser.add_argument('--prefetch_factor',
+    type=int, default=settings.PREFETCH_FACTOR, help='Number of batches loaded in advance by each thread')
+parser.add_argument('--n_thread_output',
+    type=int, default=settings.N_THREAD_OUTPUT, help='Number of threads for saving outputs in background')
 
 
 args = parser.parse_args()
@@ -143,12 +161,16 @@ if __name__ == '__main__':
         ground_truth_path=args.ground_truth_path,
         # Input settings
         load_image_triplets=args.load_image_triplets,
+        load_compact_inputs=args.load_compact_inputs,
+        load_sparse_depth_points=args.load_sparse_depth_points,
+        codec=args.codec,
         input_types=args.input_types,
         input_channels_image=args.input_channels_image,
         input_channels_depth=args.input_channels_depth,
         normalized_image_range=args.normalized_image_range,
         outlier_removal_kernel_size=args.outlier_removal_kernel_size,
         outlier_removal_threshold=args.outlier_removal_threshold,
+        outlier_removal_sparse_aware=args.outlier_removal_sparse_aware,
         # Sparse to dense pool settings
         min_pool_sizes_sparse_to_dense_pool=args.min_pool_sizes_sparse_to_dense_pool,
         max_pool_sizes_sparse_to_dense_pool=args.max_pool_sizes_sparse_to_dense_pool,
@@ -180,4 +202,9 @@ if __name__ == '__main__':
         save_outputs=args.save_outputs,
         keep_input_filenames=args.keep_input_filenames,
         # Hardware settings
-        device=args.device)
+        device=args.device,
+        n_batch=args.n_batch,
+        n_thread=args.n_thread,
+        pin_memory=args.pin_memory,
+        prefetch_factor=args.prefetch_factor,
+        n_thread_output=args.n_thread_output)
@@ -44,6 +44,10 @@ parser.add_argument('--train_teacher_output0_paths',
     nargs='+', type=str, required=True, help='Path to list of training left camera teacher output paths')
 parser.add_argument('--train_teacher_output1_paths',
     nargs='+', type=str, default=None, help='Path to list of training right camera teacher output paths')
+parser.add_argument('--train_teacher_selection_map0_path',
+    type=str, default=None, help='Path to list of training left camera teacher selection map paths created by setup/setup_dataset_teacher_selection_map.py')
+parser.add_argument('--train_teacher_selection_map1_path',
+    type=str, default=None, help='Path to list of training right camera teacher selection map paths, required for random swap')
 parser.add_argument('--train_intrinsics0_path',
     type=str, required=True, help='Path to list of training left camera intrinsics paths')
 parser.add_argument('--train_intrinsics1_path',
@@ -63,6 +67,10 @@ parser.add_argument('--val_intrinsics_path',
 parser.add_argument('--val_ground_truth_path',
     type=str, default=None, help='Path to list of validation ground truth depth paths')
 
+# Training cache
+parser.add_argument('--train_cache_path',
+    type=str, default=None, help='Path to directory of pre-decoded training arrays created by setup/setup_dataset_training_cache.py')
+
 # Batch parameters
 parser.add_argument('--n_batch',
     type=int, default=settings.N_BATCH, help='Number of samples per batch')
@@ -70,6 +78,8 @@ parser.add_argument('--n_height',
     type=int, default=settings.N_HEIGHT, help='Height of of sample')
 parser.add_argument('--n_width',
     type=int, default=settings.N_WIDTH, help='Width of each sample')
+parser.add_argument('--n_step_accumulate',
+    type=int, default=settings.N_STEP_ACCUMULATE, help='Number of batches to accumulate gradients over per step, effective batch size is n_batch x n_step_accumulate')
 
 # Input settings
 parser.add_argument('--input_types',
@@ -80,10 +90,18 @@ parser.add_argument('--input_channels_depth',
     type=int, default=settings.INPUT_CHANNELS_DEPTH, help='Number of input depth channels')
 parser.add_argument('--normalized_image_range',
     nargs='+', type=float, default=settings.NORMALIZED_IMAGE_RANGE, help='Range of image intensities after normalization')
+parser.add_argument('--load_compact_inputs',
+    action='store_true', help='If set then load images as uint8 and depth as 16-bit and convert them on device')
+parser.add_argument('--load_sparse_depth_points',
+    action='store_true', help='If set then load sparse depth as list of points and scatter into depth map on device')
+parser.add_argument('--codec',
+    type=str, default=settings.CODEC, help='Backend to decode image and depth map files: pil, opencv, npz')
 parser.add_argument('--outlier_removal_kernel_size',
     type=int, default=settings.OUTLIER_REMOVAL_KERNEL_SIZE, help='Kernel size to filter outlier sparse depth')
 parser.add_argument('--outlier_removal_threshold',
     type=float, default=settings.OUTLIER_REMOVAL_THRESHOLD, help='Difference threshold to consider a point an outlier')
+parser.add_argument('--outlier_removal_sparse_aware',
+    action='store_true', help='If set then only consider neighborhoods of valid points to remove outliers')
 
 # Sparse to dense pool settings
 parser.add_argument('--min_pool_sizes_sparse_to_dense_pool',
@@ -192,12 +210,22 @@ parser.add_argument('--use_supervised_adaptive_weights',
     action='store_true', help='If set, use photometric loss as weights for supervised loss')
 parser.add_argument('--ensemble_method',
     type=str, default=settings.ENSEMBLE_METHOD, help='median|mean|random|mondi (default)')
+parser.add_argument('--ensemble_top_k',
+    type=int, default=settings.ENSEMBLE_TOP_K, help='If greater than 0, then only score photometric error of k teachers per sample that agree most with sparse depth (mondi only)')
+parser.add_argument('--ensemble_scale',
+    type=float, default=settings.ENSEMBLE_SCALE, help='If less than 1, then score teachers on inputs downsampled by this factor (mondi only)')
+parser.add_argument('--ensemble_upsample_mode',
+    type=str, default=settings.ENSEMBLE_UPSAMPLE_MODE, help='Interpolation to upsample teacher scores to full resolution: nearest, bilinear (not edge-aware)')
 
 # Evaluation settings
 parser.add_argument('--min_evaluate_depth',
     type=float, default=settings.MIN_EVALUATE_DEPTH, help='Minimum value of depth to evaluate')
 parser.add_argument('--max_evaluate_depth',
     type=float, default=settings.MAX_EVALUATE_DEPTH, help='Maximum value of depth to evaluate')
+parser.add_argument('--n_batch_val',
+    type=int, default=settings.N_BATCH_EVALUATE, help='Number of samples per batch during validation')
+parser.add_argument('--n_thread_val',
+    type=int, default=settings.N_THREAD_EVALUATE, help='Number of threads for loading validation data')
 
 # Checkpoint settings
 parser.add_argument('--checkpoint_path',
@@ -218,6 +246,8 @@ parser.add_argument('--pose_model_restore_path',
 # Hardware settings
 parser.add_argument('--device',
     type=str, default=settings.DEVICE, help='Device to use: cuda, gpu, cpu')
+parser.add_argument('--mixed_precision',
+    type=str, default=settings.MIXED_PRECISION, help='Mixed precision mode for training: none, fp16 (cuda only), bf16')
 parser.add_argument('--n_thread',
     type=int, default=settings.N_THREAD, help='Number of threads for fetching')
 
@@ -256,6 +286,8 @@ if __name__ == '__main__':
           train_sparse_depth1_path=args.train_sparse_depth1_path,
           train_ground_truth0_path=args.train_ground_truth0_path,
           train_ground_truth1_path=args.train_ground_truth1_path,
+          train_teacher_selection_map0_path=args.train_teacher_selection_map0_path,
+          train_teacher_selection_map1_path=args.train_teacher_selection_map1_path,
           train_teacher_output0_paths=args.train_teacher_output0_paths,
           train_teacher_output1_paths=args.train_teacher_output1_paths,
           train_intrinsics0_path=args.train_intrinsics0_path,
@@ -266,17 +298,23 @@ if __name__ == '__main__':
           val_sparse_depth_path=args.val_sparse_depth_path,
           val_intrinsics_path=args.val_intrinsics_path,
           val_ground_truth_path=args.val_ground_truth_path,
+          train_cache_path=args.train_cache_path,
           # Batch settings
           n_batch=args.n_batch,
           n_height=args.n_height,
           n_width=args.n_width,
+          n_step_accumulate=args.n_step_accumulate,
           # Input settings
           input_types=args.input_types,
           input_channels_image=args.input_channels_image,
           input_channels_depth=args.input_channels_depth,
           normalized_image_range=args.normalized_image_range,
+          load_compact_inputs=args.load_compact_inputs,
+          load_sparse_depth_points=args.load_sparse_depth_points,
+          codec=args.codec,
           outlier_removal_kernel_size=args.outlier_removal_kernel_size,
           outlier_removal_threshold=args.outlier_removal_threshold,
+          outlier_removal_sparse_aware=args.outlier_removal_sparse_aware,
           # Sparse to dense pool settings
           min_pool_sizes_sparse_to_dense_pool=args.min_pool_sizes_sparse_to_dense_pool,
           max_pool_sizes_sparse_to_dense_pool=args.max_pool_sizes_sparse_to_dense_pool,
@@ -330,9 +368,14 @@ if __name__ == '__main__':
           loss_func_ensemble_depth=args.loss_func_ensemble_depth,
           epoch_pose_for_ensemble=args.epoch_pose_for_ensemble,
           ensemble_method=args.ensemble_method,
+          ensemble_top_k=args.ensemble_top_k,
+          ensemble_scale=args.ensemble_scale,
+          ensemble_upsample_mode=args.ensemble_upsample_mode,
           # Evaluation settings
           min_evaluate_depth=args.min_evaluate_depth,
           max_evaluate_depth=args.max_evaluate_depth,
+          n_batch_val=args.n_batch_val,
+          n_thread_val=args.n_thread_val,
           # Checkpoint settings
           checkpoint_path=args.checkpoint_path,
           n_checkpoint=args.n_checkpoint,
@@ -343,4 +386,5 @@ if __name__ == '__main__':
           pose_model_restore_path=args.pose_model_restore_path,
           # Hardware settings
           device=args.device,
+          mixed_precision=args.mixed_precision.lower(),
           n_thread=args.n_thread)
@@ -19,7 +19,6 @@ https://arxiv.org/abs/2203.16034
 '''
 
 import torch
-import torchvision.transforms.functional as functional
 from PIL import Image
 import numpy as np
 
@@ -99,6 +98,7 @@ class Transforms(object):
                   range_maps_arr=[],
                   validity_maps_arr=[],
                   intrinsics_arr=[],
+                  points_arr=[],
                   random_transform_probability=0.50):
         '''
         Applies transform to images and ground truth
@@ -112,11 +112,15 @@ class Transforms(object):
                 list of N x c x H x W tensors
             intrinsics_arr : list[torch.Tensor]
                 list of N x 3 x 3 tensors
+            points_arr : list[torch.Tensor]
+                list of N x P x 3 lists of (row, column, depth) points of range maps,
+                points with depth of 0 are ignored
             random_transform_probability : float
                 probability to perform transform
         Returns:
             list[torch.Tensor[float32]] : list of transformed N x C x H x W image tensors
             list[torch.Tensor[float32]] : list of transformed N x c x H x W range maps tensors
+            list[torch.Tensor[float32]] : list of transformed N x P x 3 point lists
         '''
 
         device = images_arr[0].device
@@ -136,10 +140,12 @@ class Transforms(object):
         '''
         Photometric Transformations (only on images)
         '''
-        for idx, images in enumerate(images_arr):
-            # In case user pass in [0, 255] range image as float type
-            if torch.max(images) > 1.0:
-                images_arr[idx] = images.int()
+        # Samples that are not adjusted use a factor of 1, which is the identity
+        ones = torch.ones(n_batch, device=device)
+
+        brightness_factors = ones
+        contrast_factors = ones
+        saturation_factors = ones
 
         if self.do_random_brightness:
 
@@ -152,7 +158,10 @@ class Transforms(object):
             brightness_min, brightness_max = self.random_brightness
             factors = (brightness_max - brightness_min) * values + brightness_min
 
-            images_arr = self.adjust_brightness(images_arr, do_brightness, factors)
+            brightness_factors = torch.where(
+                self.batch_mask(do_brightness, factors),
+                factors,
+                ones)
 
         if self.do_random_contrast:
 
@@ -165,7 +174,10 @@ class Transforms(object):
             contrast_min, contrast_max = self.random_contrast
             factors = (contrast_max - contrast_min) * values + contrast_min
 
-            images_arr = self.adjust_contrast(images_arr, do_contrast, factors)
+            contrast_factors = torch.where(
+                self.batch_mask(do_contrast, factors),
+                factors,
+                ones)
 
         if self.do_random_saturation:
 
@@ -178,11 +190,17 @@ class Transforms(object):
             saturation_min, saturation_max = self.random_saturation
             factors = (saturation_max - saturation_min) * values + saturation_min
 
-            images_arr = self.adjust_saturation(images_arr, do_saturation, factors)
+            saturation_factors = torch.where(
+                self.batch_mask(do_saturation, factors),
+                factors,
+                ones)
 
-        # Normalize images to a given range
-        images_arr = self.normalize_images(
+        # Adjust and normalize all images to a given range in one pass
+        images_arr = self.adjust_photometric(
             images_arr,
+            brightness_factors=brightness_factors if self.do_random_brightness else None,
+            contrast_factors=contrast_factors if self.do_random_contrast else None,
+            saturation_factors=saturation_factors if self.do_random_saturation else None,
             normalized_image_range=self.normalized_image_range)
 
         '''
@@ -241,6 +259,11 @@ class Transforms(object):
                 start_yx=start_yx,
                 end_yx=end_yx)
 
+            points_arr = self.crop_points(
+                points_arr,
+                start_yx=start_yx,
+                end_yx=end_yx)
+
             intrinsics_arr = self.adjust_intrinsics(
                 intrinsics_arr,
                 scales=1,
@@ -269,6 +292,12 @@ class Transforms(object):
                 validity_maps_arr,
                 do_horizontal_flip)
 
+            points_arr = self.flip_points(
+                points_arr,
+                do_horizontal_flip,
+                dim=1,
+                size=n_width)
+
         if self.do_random_vertical_flip:
 
             do_vertical_flip = np.logical_and(
@@ -287,6 +316,12 @@ class Transforms(object):
                 validity_maps_arr,
                 do_vertical_flip)
 
+            points_arr = self.flip_points(
+                points_arr,
+                do_vertical_flip,
+                dim=0,
+                size=n_height)
+
         if self.do_random_remove_points:
 
             do_remove_points = np.logical_and(
@@ -305,12 +340,12 @@ class Transforms(object):
                 do_remove=do_remove_points,
                 densities=densities)
 
-        # Return the transformed inputs
-
-        for idx, images in enumerate(images_arr):
-            if torch.max(images) > 1.0:
-                images_arr[idx] = images.float()
+            points_arr = self.remove_random_points(
+                points_arr,
+                do_remove=do_remove_points,
+                densities=densities)
 
+        # Return the transformed inputs
         outputs = []
 
         if len(images_arr) > 0:
@@ -325,6 +360,9 @@ class Transforms(object):
         if len(intrinsics_arr) > 0:
             outputs.append(intrinsics_arr)
 
+        if len(points_arr) > 0:
+            outputs.append(points_arr)
+
         if len(outputs) == 1:
             return outputs[0]
         else:
@@ -362,115 +400,130 @@ class Transforms(object):
 
         return images_arr
 
-    def adjust_brightness(self, images_arr, do_brightness, factors):
+    def adjust_photometric(self,
+                           images_arr,
+                           brightness_factors=None,
+                           contrast_factors=None,
+                           saturation_factors=None,
+                           normalized_image_range=[0, 1]):
         '''
-        Adjust brightness on each sample
+        Adjust brightness, contrast and saturation of each sample and normalize images
+        in a single pass over all images. Images are stacked in their input type e.g.
+        uint8 and converted to float once. Intermediate results are truncated to
+        integers like adjustments on integer images so that outputs match applying
+        each adjustment separately
 
-        Args:
+        Arg(s):
             images_arr : list[torch.Tensor]
-                list of N x C x H x W tensors
-            do_brightness : bool
-                N booleans to determine if brightness is adjusted on each sample
-            factors : float
-                N floats to determine how much to adjust
+                list of N x C x H x W tensors with intensities in [0, 255]
+            brightness_factors : torch.Tensor[float32]
+                N brightness factors, 1 leaves sample unchanged, None to skip
+            contrast_factors : torch.Tensor[float32]
+                N contrast factors, 1 leaves sample unchanged, None to skip
+            saturation_factors : torch.Tensor[float32]
+                N saturation factors, 1 leaves sample unchanged, None to skip
+            normalized_image_range : list[float]
+                intensity range after normalizing images
         Returns:
-            list[torch.Tensor] : list of transformed N x C x H x W image tensors
+            list[torch.Tensor[float32]] : list of transformed N x C x H x W image tensors
         '''
 
-        for i, images in enumerate(images_arr):
+        n_image = len(images_arr)
 
-            for b, image in enumerate(images):
-                if do_brightness[b]:
-                    images[b, ...] = functional.adjust_brightness(image, factors[b])
+        if n_image == 0:
+            return images_arr
 
-            images_arr[i] = images
+        # Stack images before converting to float to move fewer bytes
+        images = torch.cat(images_arr, dim=0).float()
 
-        return images_arr
+        shape = [images.shape[0]] + [1] * (images.ndim - 1)
 
-    def adjust_contrast(self, images_arr, do_contrast, factors):
-        '''
-        Adjust contrast on each sample
+        if brightness_factors is not None:
+            factors = brightness_factors.repeat(n_image).view(shape)
+            images = torch.floor(torch.clamp(factors * images, 0.0, 255.0))
 
-        Args:
-            images_arr : list[torch.Tensor]
-                list of N x C x H x W tensors
-            do_contrast : bool
-                N booleans to determine if contrast is adjusted on each sample
-            factors : float
-                N floats to determine how much to adjust
-        Returns:
-            list[torch.Tensor] : list of transformed N x C x H x W image tensors
-        '''
-
-        for i, images in enumerate(images_arr):
+        if contrast_factors is not None:
+            factors = contrast_factors.repeat(n_image).view(shape)
+            means = torch.mean(
+                self.rgb_to_grayscale(images),
+                dim=(-3, -2, -1),
+                keepdim=True)
+            images = factors * images + (1.0 - factors) * means
+            images = torch.floor(torch.clamp(images, 0.0, 255.0))
 
-            for b, image in enumerate(images):
-                if do_contrast[b]:
-                    images[b, ...] = functional.adjust_contrast(image, factors[b])
+        if saturation_factors is not None:
+            factors = saturation_factors.repeat(n_image).view(shape)
+            images = factors * images + (1.0 - factors) * self.rgb_to_grayscale(images)
+            images = torch.floor(torch.clamp(images, 0.0, 255.0))
 
-            images_arr[i] = images
+        [images] = self.normalize_images(
+            [images],
+            normalized_image_range=normalized_image_range)
 
-        return images_arr
+        return list(torch.chunk(images, n_image, dim=0))
 
-    def adjust_saturation(self, images_arr, do_saturation, factors):
+    def rgb_to_grayscale(self, images):
         '''
-        Adjust saturation on each sample
+        Converts integer valued RGB images to grayscale
 
-        Args:
-            images_arr : list[torch.Tensor]
-                list of N x C x H x W tensors
-            do_saturation : bool
-                N booleans to determine if saturation is adjusted on each sample
-            gammas : float
-                N floats to determine how much to adjust
+        Arg(s):
+            images : torch.Tensor[float32]
+                N x 3 x H x W tensor
         Returns:
-            list[torch.Tensor] : list of transformed N x C x H x W image tensors
+            torch.Tensor[float32] : N x 1 x H x W tensor
         '''
 
-        for i, images in enumerate(images_arr):
+        r, g, b = torch.unbind(images, dim=-3)
 
-            for b, image in enumerate(images):
-                if do_saturation[b]:
-                    images[b, ...] = functional.adjust_saturation(image, factors[b])
+        grayscale = torch.floor(0.2989 * r + 0.587 * g + 0.114 * b)
 
-            images_arr[i] = images
+        return grayscale.unsqueeze(dim=-3)
 
-        return images_arr
     '''
     Geometric transforms
     '''
     def crop(self, images_arr, start_yx, end_yx):
         '''
-        Performs cropping on images
+        Performs cropping on images, all samples are cropped to the same shape
+        but may have different top left corners
 
         Arg(s):
             images_arr : list[torch.Tensor]
                 list of N x C x H x W tensors
-            start_yx : list[int, int]
-                top left corner y, x coordinate
-            end_yx : list
-                bottom right corner y, x coordinate
+            start_yx : list[torch.Tensor[int64]]
+                N top left corner y, x coordinates
+            end_yx : list[torch.Tensor[int64]]
+                N bottom right corner y, x coordinates
         Returns:
-            list[torch.Tensor] : list of transformed N x C x H x W image tensors
+            list[torch.Tensor] : list of transformed N x C x h x w image tensors
         '''
 
-        for i, images in enumerate(images_arr):
+        start_y, start_x = start_yx
+        end_y, end_x = end_yx
 
-            images_cropped = []
+        n_height = int(end_y[0] - start_y[0])
+        n_width = int(end_x[0] - start_x[0])
 
-            for b, image in enumerate(images):
+        for i, images in enumerate(images_arr):
+
+            n_batch = images.shape[0]
+            shape = list(images.shape)
+            ones = [1] * (images.ndim - 3)
 
-                start_y = start_yx[0][b]
-                start_x = start_yx[1][b]
-                end_y = end_yx[0][b]
-                end_x = end_yx[1][b]
+            # Row and column indices of crop for each sample: N x h and N x w
+            y = start_y.view(n_batch, 1) + torch.arange(n_height, device=images.device)
+            x = start_x.view(n_batch, 1) + torch.arange(n_width, device=images.device)
 
-                # Crop image
-                image = image[..., start_y:end_y, start_x:end_x]
+            # Select rows then columns
+            y = y.view([n_batch] + ones + [n_height, 1])
+            y = y.expand(shape[:-2] + [n_height, shape[-1]])
+            images = torch.gather(images, dim=-2, index=y)
 
-                images_cropped.append(image)
+            x = x.view([n_batch] + ones + [1, n_width])
+            x = x.expand(shape[:-2] + [n_height, n_width])
+            images = torch.gather(images, dim=-1, index=x)
 
-            images_arr[i] = torch.stack(images_cropped, dim=0)
+            images_arr[i] = images
 
         return images_arr
 
@@ -489,11 +542,9 @@ class Transforms(object):
 
         for i, images in enumerate(images_arr):
 
-            for b, image in enumerate(images):
-                if do_horizontal_flip[b]:
-                    images[b, ...] = torch.flip(image, dims=[-1])
+            flip = self.batch_mask(do_horizontal_flip, images)
 
-            images_arr[i] = images
+            images_arr[i] = torch.where(flip, torch.flip(images, dims=[-1]), images)
 
         return images_arr
 
@@ -512,24 +563,23 @@ class Transforms(object):
 
         for i, images in enumerate(images_arr):
 
-            for b, image in enumerate(images):
-                if do_vertical_flip[b]:
-                    images[b, ...] = torch.flip(image, dims=[-2])
+            flip = self.batch_mask(do_vertical_flip, images)
 
-            images_arr[i] = images
+            images_arr[i] = torch.where(flip, torch.flip(images, dims=[-2]), images)
 
         return images_arr
 
     def remove_random_nonzero(self, images_arr, do_remove, densities):
         '''
-        Remove random nonzero for each sample
+        Remove random nonzero for each sample, each nonzero element of a sample
+        is removed with probability equal to its density
 
         Arg(s):
             images_arr : list[torch.Tensor[float32]]
                 list of N x C x H x W tensors
             do_remove : bool
                 N booleans to determine if random remove is performed on each sample
-            densities : float
+            densities : torch.Tensor[float32]
                 N floats to determine how much to remove from each sample
         Returns:
             list[torch.Tensor[float32]] : list of transformed N x C x H x W image tensors
@@ -537,44 +587,130 @@ class Transforms(object):
 
         for i, images in enumerate(images_arr):
 
-            for b, image in enumerate(images):
-                if do_remove[b]:
+            remove = self.batch_mask(do_remove, images)
 
-                    nonzero_indices = self.random_nonzero(image, density=densities[b])
-                    image[nonzero_indices] = 0.0
+            thresholds = densities.to(images.device).view(remove.shape)
 
-                    images[b, ...] = image
+            # Select nonzero elements of samples to remove from
+            remove = torch.logical_and(remove, images > 0)
+            remove = torch.logical_and(remove, torch.rand_like(images, dtype=torch.float32) < thresholds)
 
-            images_arr[i] = images
+            images_arr[i] = torch.where(remove, torch.zeros_like(images), images)
 
         return images_arr
 
-    def random_nonzero(self, T, density=0.10):
+    def crop_points(self, points_arr, start_yx, end_yx):
         '''
-        Randomly selects nonzero elements
+        Performs cropping on point lists, points outside of crop are ignored
 
         Arg(s):
-            T : torch.Tensor[float32]
-                N x C x H x W tensor
-            density : float
-                percentage of nonzero elements to select
+            points_arr : list[torch.Tensor[float32]]
+                list of N x P x 3 (row, column, depth) point lists
+            start_yx : list[torch.Tensor[int64]]
+                N top left corner y, x coordinates
+            end_yx : list[torch.Tensor[int64]]
+                N bottom right corner y, x coordinates
         Returns:
-            list[tuple[torch.Tensor[float32]]] : list of tuples of indices
+            list[torch.Tensor[float32]] : list of transformed N x P x 3 point lists
         '''
 
-        # Find all nonzero indices
-        nonzero_indices = (T > 0).nonzero(as_tuple=True)
+        start_y, start_x = start_yx
+        end_y, end_x = end_yx
+
+        for i, points in enumerate(points_arr):
+
+            y, x, z = torch.unbind(points, dim=-1)
+
+            # Move points to coordinates of crop
+            y = y - start_y.view(-1, 1).to(points.dtype)
+            x = x - start_x.view(-1, 1).to(points.dtype)
+
+            n_height = (end_y - start_y).view(-1, 1).to(points.dtype)
+            n_width = (end_x - start_x).view(-1, 1).to(points.dtype)
 
-        # Randomly choose a subset of the indices
-        random_subset = torch.randperm(nonzero_indices[0].shape[0], device=T.device)
-        random_subset = random_subset[0:int(density * random_subset.shape[0])]
+            inside = (y >= 0) & (y < n_height) & (x >= 0) & (x < n_width)
+
+            z = torch.where(inside, z, torch.zeros_like(z))
+
+            points_arr[i] = torch.stack([y, x, z], dim=-1)
+
+        return points_arr
+
+    def flip_points(self, points_arr, do_flip, dim, size):
+        '''
+        Perform horizontal or vertical flip on point lists of each sample
 
-        random_nonzero_indices = [
-            indices[random_subset] for indices in nonzero_indices
-        ]
+        Arg(s):
+            points_arr : list[torch.Tensor[float32]]
+                list of N x P x 3 (row, column, depth) point lists
+            do_flip : bool
+                N booleans to determine if flip is performed on each sample
+            dim : int
+                0 to flip rows (vertical), 1 to flip columns (horizontal)
+            size : int
+                height or width of range maps
+        Returns:
+            list[torch.Tensor[float32]] : list of transformed N x P x 3 point lists
+        '''
+
+        for i, points in enumerate(points_arr):
+
+            flip = self.batch_mask(do_flip, points)
+
+            points_flipped = points.clone()
+            points_flipped[..., dim] = (size - 1) - points[..., dim]
+
+            points_arr[i] = torch.where(flip, points_flipped, points)
+
+        return points_arr
+
+    def remove_random_points(self, points_arr, do_remove, densities):
+        '''
+        Remove random points for each sample, each point of a sample is removed with
+        probability equal to its density (see remove_random_nonzero)
+
+        Arg(s):
+            points_arr : list[torch.Tensor[float32]]
+                list of N x P x 3 (row, column, depth) point lists
+            do_remove : bool
+                N booleans to determine if random remove is performed on each sample
+            densities : torch.Tensor[float32]
+                N floats to determine how much to remove from each sample
+        Returns:
+            list[torch.Tensor[float32]] : list of transformed N x P x 3 point lists
+        '''
+
+        for i, points in enumerate(points_arr):
+
+            y, x, z = torch.unbind(points, dim=-1)
+
+            remove = self.batch_mask(do_remove, z)
+            remove = torch.logical_and(
+                remove,
+                torch.rand_like(z) < densities.to(z.device).view(-1, 1))
+
+            z = torch.where(remove, torch.zeros_like(z), z)
+
+            points_arr[i] = torch.stack([y, x, z], dim=-1)
+
+        return points_arr
+
+    def batch_mask(self, flags, T):
+        '''
+        Converts per sample booleans to a mask that broadcasts over a tensor
+
+        Arg(s):
+            flags : numpy[bool]
+                N booleans
+            T : torch.Tensor
+                N x C x H x W tensor
+        Returns:
+            torch.Tensor[bool] : N x 1 x 1 x 1 mask
+        '''
 
-        return random_nonzero_indices
+        flags = torch.as_tensor(np.asarray(flags, dtype=bool), device=T.device)
 
+        return flags.view([T.shape[0]] + [1] * (T.ndim - 1))
 
     def adjust_intrinsics(self,
                           intrinsics_arr,